@@ -1,6 +1,8 @@
 import os
 import logging
 import json
+import threading
+import uuid
 import yaml
 
 from datetime import datetime
@@ -8,6 +10,14 @@ from datetime import datetime
 # adapted from: https://majornetwork.net/2019/10/webhook-listener-for-netbox/
 
 from helpers.netbox_proxmox import NetBoxProxmoxHelper, NetBoxProxmoxHelperVM, NetBoxProxmoxHelperLXC, NetBoxProxmoxHelperMigrate
+from helpers.job_queue import NetBoxProxmoxJobQueue, NetBoxProxmoxJobQueueFull
+from helpers.event_journal import get_event_journal, NetBoxProxmoxEventJournalError
+from helpers.idempotency import get_idempotency_store, get_idempotency_key
+from helpers.metrics import get_metrics
+from helpers.webhook_recorder import get_webhook_recorder
+from helpers.warm_pool import get_warm_pool
+from helpers.bulk_migration import start_bulk_migration, get_bulk_migration
+from helpers.placement import get_placement_engine
 
 from flask import Flask, Response, request, jsonify
 from flask_restx import Api, Resource, fields
@@ -25,6 +35,8 @@ with open(app_config_file) as yaml_cfg:
 if not 'netbox_webhook_name' in app_config:
     raise ValueError(f"'netbox_webhook_name' missing in {app_config_file}")
 
+metrics = get_metrics(app_config)
+
 app = Flask(__name__)
 api = Api(app, version=VERSION, title="NetBox-Proxmox Webhook Listener",
         description="NetBox-Proxmox Webhook Listener")
@@ -67,16 +79,23 @@ session = {
   },
 }
 
+session_lock = threading.Lock()
+
 
 @ns.route("/status/", methods=['GET'])
 class WebhookListener(Resource):
     @ns.expect(webhook_request)
 
     def get(self):
-        _session = session.copy()
-        _session['version_lastrun'] = VERSION
-        _session['status']['requests'] += 1
-        _session['status']['last_called'] = datetime.now()
+        with session_lock:
+            session['status']['requests'] += 1
+            session['status']['last_called'] = datetime.now()
+
+            _session = session.copy()
+            _session['version_lastrun'] = VERSION
+            _session['status'] = dict(session['status'])
+
+        metrics.status_requests.inc()
         sanitized_full_path = request.full_path.replace('\r\n', '').replace('\n', '')
         sanitized_remote_addr = request.remote_addr.replace('\r\n', '').replace('\n', '') if request.remote_addr else 'Unknown'
         sanitized_data = request.get_data(as_text=True).replace('\r\n', '').replace('\n', '') if request.get_data() else ''
@@ -84,6 +103,190 @@ class WebhookListener(Resource):
         return jsonify(_session)
 
 
+def process_webhook(webhook_json_data):
+    placement_engine = get_placement_engine(app_config, DEBUG)
+    placement_reservation_id = None
+
+    # pick a Proxmox node for new VMs / LXCs when proxmox_node is unset or 'auto'
+    if placement_engine and placement_engine.needs_placement(webhook_json_data):
+        try:
+            proxmox_node, placement_reservation_id = placement_engine.place_guest(webhook_json_data)
+
+            if DEBUG:
+                print(f"PLACED ON PROXMOX NODE {proxmox_node}")
+        except ValueError as e:
+            logger.warning(str(e))
+            return 500, {'result': str(e)}
+        except Exception as e:
+            # Proxmox or NetBox API errors while placing fail the webhook, like any other handler error
+            logger.exception(f"Unable to place {webhook_json_data['model']} {(webhook_json_data.get('data') or {}).get('name')}")
+            metrics.errors.inc(source='placement', exception=type(e).__name__)
+            return 500, {'result': f"{type(e).__name__}: {e}"}
+
+    try:
+        return process_webhook_event(webhook_json_data)
+    finally:
+        if placement_reservation_id:
+            placement_engine.release(placement_reservation_id)
+
+
+def process_webhook_event(webhook_json_data):
+    results = (500, {'result': 'Default error message (obviously something has gone wrong)'})
+
+    if DEBUG:
+        print(f"INCOMING DATA FOR WEBHOOK {webhook_json_data['event']} --> {webhook_json_data['model']}\n", json.dumps(webhook_json_data, indent=4))
+
+    if webhook_json_data['model'] == 'virtualmachine':
+        if not 'proxmox_node' in webhook_json_data['data']['custom_fields']:
+            results = 500, {'result': 'Missing proxmox_node in custom_fields'}
+        
+        proxmox_node = webhook_json_data['data']['custom_fields']['proxmox_node']
+
+        if webhook_json_data['data']['custom_fields']['proxmox_vm_type'] == 'vm':
+            tc = NetBoxProxmoxHelperVM(app_config, proxmox_node, DEBUG)
+
+            if webhook_json_data['data']['status']['value'] == 'staged':
+                if webhook_json_data['event'] == 'created':
+                    results = tc.proxmox_clone_vm(webhook_json_data)
+                elif webhook_json_data['event'] == 'updated':
+                    # vcpus, memory, ipconfig0 and sshkeys in a single config change
+                    results = tc.proxmox_update_vm_config(webhook_json_data)
+                elif webhook_json_data['event'] == 'deleted':
+                    results = tc.proxmox_delete_vm(webhook_json_data)
+            elif webhook_json_data['event'] == 'updated':
+                if webhook_json_data['data']['status']['value'] == 'offline':
+                    if (webhook_json_data['data']['status']['value'] != webhook_json_data['snapshots']['prechange']['status']) and (webhook_json_data['data']['custom_fields']['proxmox_node'] == webhook_json_data['snapshots']['prechange']['custom_fields']['proxmox_node']):
+                        results = tc.proxmox_stop_vm(webhook_json_data)
+
+                    if webhook_json_data['data']['custom_fields']['proxmox_node'] != webhook_json_data['snapshots']['prechange']['custom_fields']['proxmox_node']:
+                        proxmox_vmid = int(webhook_json_data['data']['custom_fields']['proxmox_vmid'])
+                        source_node = webhook_json_data['snapshots']['prechange']['custom_fields']['proxmox_node']
+                        target_node = webhook_json_data['data']['custom_fields']['proxmox_node']
+
+                        pxmx_migrate = NetBoxProxmoxHelperMigrate(app_config, None, DEBUG)
+
+                        results = pxmx_migrate.migrate_vm(proxmox_vmid, source_node, target_node)                            
+
+                elif webhook_json_data['data']['status']['value'] == 'active':
+                    if (webhook_json_data['data']['status']['value'] != webhook_json_data['snapshots']['prechange']['status']) and (webhook_json_data['data']['custom_fields']['proxmox_node'] == webhook_json_data['snapshots']['prechange']['custom_fields']['proxmox_node']):
+                        results = tc.proxmox_start_vm(webhook_json_data)
+
+                    if webhook_json_data['data']['custom_fields']['proxmox_node'] != webhook_json_data['snapshots']['prechange']['custom_fields']['proxmox_node']:
+                        proxmox_vmid = int(webhook_json_data['data']['custom_fields']['proxmox_vmid'])
+                        source_node = webhook_json_data['snapshots']['prechange']['custom_fields']['proxmox_node']
+                        target_node = webhook_json_data['data']['custom_fields']['proxmox_node']
+
+                        pxmx_migrate = NetBoxProxmoxHelperMigrate(app_config, None, DEBUG)
+
+                        results = pxmx_migrate.migrate_vm(proxmox_vmid, source_node, target_node)                            
+                else:
+                    results = (500, {'result': f"Unknown value {webhook_json_data['data']['status']['value']}"})
+            elif webhook_json_data['event'] == 'deleted':
+                results = tc.proxmox_delete_vm(webhook_json_data)
+        elif webhook_json_data['data']['custom_fields']['proxmox_vm_type'] == 'lxc':
+            tc = NetBoxProxmoxHelperLXC(app_config, proxmox_node, DEBUG)
+
+            if webhook_json_data['data']['status']['value'] == 'staged':
+                if DEBUG:
+                    print(f"LXC STAGED INPUT {webhook_json_data['data']}", webhook_json_data['event'])
+
+                if webhook_json_data['event'] == 'created':
+                    results = tc.proxmox_create_lxc(webhook_json_data)
+                elif webhook_json_data['event'] == 'updated':
+                    # vcpus, memory and net0 in a single config change
+                    results = tc.proxmox_update_lxc_config(webhook_json_data)
+                elif webhook_json_data['event'] == 'deleted':
+                    results = tc.proxmox_delete_lxc(webhook_json_data)
+            elif webhook_json_data['event'] == 'updated':
+                if webhook_json_data['data']['status']['value'] == 'offline':
+                    results = tc.proxmox_stop_lxc(webhook_json_data)
+                elif webhook_json_data['data']['status']['value'] == 'active':
+                    results = tc.proxmox_start_lxc(webhook_json_data)
+                else:
+                    results = (500, {'result': f"Unknown value {webhook_json_data['data']['status']['value']}"})
+            elif webhook_json_data['event'] == 'deleted':
+                results = tc.proxmox_delete_lxc(webhook_json_data)
+            else:
+                results = (500, {'result': f"Unknown event: {webhook_json_data['event']}"})
+    elif webhook_json_data['model'] == 'virtualdisk':
+        results = 500, {'result': 'Something has gone wrong with virtualdisk management'}
+        is_lxc = False
+
+        if webhook_json_data['data']['name'] == 'rootfs':
+            is_lxc = True
+
+        if DEBUG:
+            print("HERE VIRTUALDISK", is_lxc)
+
+        tcall = NetBoxProxmoxHelper(app_config, None, DEBUG)
+        proxmox_node = tcall.netbox_get_proxmox_node_from_vm_id(webhook_json_data['data']['virtual_machine']['id'])
+
+        if is_lxc:
+            if DEBUG:
+                print("change disk lxc")
+
+            if webhook_json_data['event'] == 'updated':
+                if webhook_json_data['snapshots']['prechange']['size'] != webhook_json_data['snapshots']['postchange']['size']:
+                    tc = NetBoxProxmoxHelperLXC(app_config, proxmox_node, DEBUG)
+                    results = tc.proxmox_lxc_resize_disk(webhook_json_data)
+            elif webhook_json_data['event'] == 'deleted':
+                results = 200, {'result': 'All good'}
+        else:
+            tc = NetBoxProxmoxHelperVM(app_config, proxmox_node, DEBUG)
+
+            if webhook_json_data['event'] == 'created':
+                results = tc.proxmox_add_disk(webhook_json_data)
+            elif webhook_json_data['event'] == 'updated':
+                results = tc.proxmox_resize_disk(webhook_json_data)
+            elif webhook_json_data['event'] == 'deleted':
+                results = tc.proxmox_delete_disk(webhook_json_data)
+
+    return results
+
+
+def process_accepted_webhook(event_id, webhook_json_data):
+    if event_journal:
+        event_journal.transition(event_id, 'running')
+
+    try:
+        results = process_webhook(webhook_json_data)
+    except Exception as e:
+        # handled like the job queue workers do, so that the webhook (and its idempotency entry) ends with the error result
+        logger.exception(f"Webhook {event_id} raised an exception")
+        metrics.errors.inc(source='webhook', exception=type(e).__name__)
+        results = 500, {'result': f"{type(e).__name__}: {e}"}
+
+    if event_journal:
+        event_journal.transition(event_id, 'finished' if results[0] < 400 else 'failed', results[0], results[1])
+
+    if idempotency_store:
+        idempotency_store.complete([event_id], results[0], results[1])
+
+    return results
+
+
+def complete_idempotent_job(job):
+    # a job also finishes the webhooks which were merged into it
+    idempotency_store.complete([job['id']] + job['coalesced_job_ids'], job['status_code'], job['result'])
+
+
+def replay_journaled_webhooks():
+    # Without the job queue, webhooks which were accepted but never finished before the last restart are replayed one by one
+    unfinished_events = event_journal.get_unfinished()
+
+    if unfinished_events:
+        logger.info(f"Replaying {len(unfinished_events)} unfinished webhooks from the event journal")
+
+    for event_id, webhook_json_data in unfinished_events:
+        event_journal.transition(event_id, 'replayed')
+
+        try:
+            results = process_accepted_webhook(event_id, webhook_json_data)
+            logger.info(f"Replayed webhook {event_id}: {results[0]} {results[1]['result']}")
+        except Exception as e:
+            logger.exception(f"Replaying webhook {event_id} failed: {e}")
+
+
 # For handling event rules
 @ns.route("/")
 class WebhookListener(Resource):
@@ -100,125 +303,49 @@ class WebhookListener(Resource):
         if not webhook_json_data or "model" not in webhook_json_data or "event" not in webhook_json_data:
             return {"result":"invalid input"}, 400
 
-        results = (500, {'result': 'Default error message (obviously something has gone wrong)'})
-
-        if DEBUG:
-            print(f"INCOMING DATA FOR WEBHOOK {webhook_json_data['event']} --> {webhook_json_data['model']}\n", json.dumps(webhook_json_data, indent=4))
-
-        if webhook_json_data['model'] == 'virtualmachine':
-            if not 'proxmox_node' in webhook_json_data['data']['custom_fields']:
-                results = 500, {'result': 'Missing proxmox_node in custom_fields'}
-            
-            proxmox_node = webhook_json_data['data']['custom_fields']['proxmox_node']
-
-            if webhook_json_data['data']['custom_fields']['proxmox_vm_type'] == 'vm':
-                tc = NetBoxProxmoxHelperVM(app_config, proxmox_node, DEBUG)
-
-                if webhook_json_data['data']['status']['value'] == 'staged':
-                    if webhook_json_data['event'] == 'created':
-                        results = tc.proxmox_clone_vm(webhook_json_data)
-                    elif webhook_json_data['event'] == 'updated':
-                        results = tc.proxmox_update_vm_vcpus_and_memory(webhook_json_data)
-
-                        if webhook_json_data['data']['primary_ip'] and webhook_json_data['data']['primary_ip']['address']:
-                            results = tc.proxmox_set_ipconfig0(webhook_json_data)
-
-                        if 'proxmox_public_ssh_key' in webhook_json_data['data']['custom_fields'] and webhook_json_data['data']['custom_fields']['proxmox_public_ssh_key']:
-                            results = tc.proxmox_set_ssh_public_key(webhook_json_data)
-                    elif webhook_json_data['event'] == 'deleted':
-                        results = tc.proxmox_delete_vm(webhook_json_data)
-                elif webhook_json_data['event'] == 'updated':
-                    if webhook_json_data['data']['status']['value'] == 'offline':
-                        if (webhook_json_data['data']['status']['value'] != webhook_json_data['snapshots']['prechange']['status']) and (webhook_json_data['data']['custom_fields']['proxmox_node'] == webhook_json_data['snapshots']['prechange']['custom_fields']['proxmox_node']):
-                            results = tc.proxmox_stop_vm(webhook_json_data)
-
-                        if webhook_json_data['data']['custom_fields']['proxmox_node'] != webhook_json_data['snapshots']['prechange']['custom_fields']['proxmox_node']:
-                            proxmox_vmid = int(webhook_json_data['data']['custom_fields']['proxmox_vmid'])
-                            source_node = webhook_json_data['snapshots']['prechange']['custom_fields']['proxmox_node']
-                            target_node = webhook_json_data['data']['custom_fields']['proxmox_node']
-
-                            pxmx_migrate = NetBoxProxmoxHelperMigrate(app_config, None, DEBUG)
+        # duplicates are recorded too, so that a replay of the corpus sees the traffic NetBox sent
+        if webhook_recorder:
+            webhook_recorder.record(webhook_json_data)
 
-                            results = pxmx_migrate.migrate_vm(proxmox_vmid, source_node, target_node)                            
+        event_id = str(uuid.uuid4())
+        idempotency_key = get_idempotency_key(webhook_json_data) if idempotency_store else None
 
-                    elif webhook_json_data['data']['status']['value'] == 'active':
-                        if (webhook_json_data['data']['status']['value'] != webhook_json_data['snapshots']['prechange']['status']) and (webhook_json_data['data']['custom_fields']['proxmox_node'] == webhook_json_data['snapshots']['prechange']['custom_fields']['proxmox_node']):
-                            results = tc.proxmox_start_vm(webhook_json_data)
+        if idempotency_key:
+            earlier_webhook = idempotency_store.claim(idempotency_key, event_id)
 
-                        if webhook_json_data['data']['custom_fields']['proxmox_node'] != webhook_json_data['snapshots']['prechange']['custom_fields']['proxmox_node']:
-                            proxmox_vmid = int(webhook_json_data['data']['custom_fields']['proxmox_vmid'])
-                            source_node = webhook_json_data['snapshots']['prechange']['custom_fields']['proxmox_node']
-                            target_node = webhook_json_data['data']['custom_fields']['proxmox_node']
+            # a retried or duplicated delivery never touches Proxmox again
+            if earlier_webhook:
+                metrics.webhook_duplicates.inc(model=webhook_json_data['model'], event=webhook_json_data['event'])
+                logger.info(f"Duplicate webhook for request_id {webhook_json_data.get('request_id')} ({webhook_json_data['model']} {webhook_json_data['event']}), first delivered as job {earlier_webhook['job_id']}")
 
-                            pxmx_migrate = NetBoxProxmoxHelperMigrate(app_config, None, DEBUG)
+                if earlier_webhook['status_code'] is None:
+                    return {'result': 'duplicate of a webhook which is still running', 'job_id': earlier_webhook['job_id']}, 202
 
-                            results = pxmx_migrate.migrate_vm(proxmox_vmid, source_node, target_node)                            
-                    else:
-                        results = (500, {'result': f"Unknown value {webhook_json_data['data']['status']['value']}"})
-                elif webhook_json_data['event'] == 'deleted':
-                    results = tc.proxmox_delete_vm(webhook_json_data)
-            elif webhook_json_data['data']['custom_fields']['proxmox_vm_type'] == 'lxc':
-                tc = NetBoxProxmoxHelperLXC(app_config, proxmox_node, DEBUG)
-
-                if webhook_json_data['data']['status']['value'] == 'staged':
-                    if DEBUG:
-                        print(f"LXC STAGED INPUT {webhook_json_data['data']}", webhook_json_data['event'])
-
-                    if webhook_json_data['event'] == 'created':
-                        results = tc.proxmox_create_lxc(webhook_json_data)
-                    elif webhook_json_data['event'] == 'updated':
-                        if webhook_json_data['data']['primary_ip'] and webhook_json_data['data']['primary_ip']['address']:
-                            results = tc.proxmox_lxc_set_net0(webhook_json_data)
-
-                        if (webhook_json_data['snapshots']['prechange']['vcpus'] != webhook_json_data['snapshots']['postchange']['vcpus']) or (webhook_json_data['snapshots']['prechange']['memory'] != webhook_json_data['snapshots']['postchange']['memory']):
-                            results = tc.proxmox_update_lxc_vpus_and_memory(webhook_json_data)
-                        else:
-                            results = (200, {'result': 'No resources to change'})
-                    elif webhook_json_data['event'] == 'deleted':
-                        results = tc.proxmox_delete_lxc(webhook_json_data)
-                elif webhook_json_data['event'] == 'updated':
-                    if webhook_json_data['data']['status']['value'] == 'offline':
-                        results = tc.proxmox_stop_lxc(webhook_json_data)
-                    elif webhook_json_data['data']['status']['value'] == 'active':
-                        results = tc.proxmox_start_lxc(webhook_json_data)
-                    else:
-                        results = (500, {'result': f"Unknown value {webhook_json_data['data']['status']['value']}"})
-                elif webhook_json_data['event'] == 'deleted':
-                    results = tc.proxmox_delete_lxc(webhook_json_data)
-                else:
-                    results = (500, {'result': f"Unknown event: {webhook_json_data['event']}"})
-        elif webhook_json_data['model'] == 'virtualdisk':
-            results = 500, {'result': 'Something has gone wrong with virtualdisk management'}
-            is_lxc = False
+                return {**earlier_webhook['result'], 'job_id': earlier_webhook['job_id'], 'duplicate': True}, earlier_webhook['status_code']
 
-            if webhook_json_data['data']['name'] == 'rootfs':
-                is_lxc = True
+        if job_queue:
+            try:
+                job = job_queue.submit(webhook_json_data, event_id)
+            except (NetBoxProxmoxJobQueueFull, NetBoxProxmoxEventJournalError) as e:
+                if idempotency_key:
+                    idempotency_store.release(idempotency_key)
 
-            if DEBUG:
-                print("HERE VIRTUALDISK", is_lxc)
+                logger.warning(str(e))
+                return {'result': str(e)}, 503
 
-            tcall = NetBoxProxmoxHelper(app_config, None, DEBUG)
-            proxmox_node = tcall.netbox_get_proxmox_node_from_vm_id(webhook_json_data['data']['virtual_machine']['id'])
+            return {'result': 'queued', 'job_id': job['id']}, 202
 
-            if is_lxc:
-                if DEBUG:
-                    print("change disk lxc")
+        if event_journal:
+            try:
+                event_journal.accept(event_id, webhook_json_data)
+            except NetBoxProxmoxEventJournalError as e:
+                if idempotency_key:
+                    idempotency_store.release(idempotency_key)
 
-                if webhook_json_data['event'] == 'updated':
-                    if webhook_json_data['snapshots']['prechange']['size'] != webhook_json_data['snapshots']['postchange']['size']:
-                        tc = NetBoxProxmoxHelperLXC(app_config, proxmox_node, DEBUG)
-                        results = tc.proxmox_lxc_resize_disk(webhook_json_data)
-                elif webhook_json_data['event'] == 'deleted':
-                    results = 200, {'result': 'All good'}
-            else:
-                tc = NetBoxProxmoxHelperVM(app_config, proxmox_node, DEBUG)
+                logger.warning(str(e))
+                return {'result': str(e)}, 503
 
-                if webhook_json_data['event'] == 'created':
-                    results = tc.proxmox_add_disk(webhook_json_data)
-                elif webhook_json_data['event'] == 'updated':
-                    results = tc.proxmox_resize_disk(webhook_json_data)
-                elif webhook_json_data['event'] == 'deleted':
-                    results = tc.proxmox_delete_disk(webhook_json_data)
+        results = process_accepted_webhook(event_id, webhook_json_data)
 
         if DEBUG:
             print("RAW RESULTS", results)
@@ -232,5 +359,93 @@ class WebhookListener(Resource):
         return response.status_code, {'result': response.json['result']}
 
 
+@app.after_request
+def count_webhook(response):
+    if metrics.enabled and request.method == 'POST' and request.url_rule and request.url_rule.rule == f"/{app_config['netbox_webhook_name']}/":
+        webhook_json_data = request.get_json(silent=True) or {}
+        metrics.webhooks.inc(model=webhook_json_data.get('model'), event=webhook_json_data.get('event'), status_code=response.status_code)
+
+    return response
+
+
+@app.route("/metrics", methods=['GET'])
+def prometheus_metrics():
+    if not metrics.enabled:
+        return Response("Metrics are not enabled\n", status=404, mimetype='text/plain')
+
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+@ns.route("/jobs/<string:job_id>", methods=['GET'])
+class WebhookJobStatus(Resource):
+    def get(self, job_id):
+        if not job_queue:
+            return {'result': 'Job queue is not enabled'}, 404
+
+        job = job_queue.get_job(job_id)
+
+        if not job:
+            return {'result': f"Unknown job {job_id}"}, 404
+
+        return job, 200
+
+
+@ns.route("/migrations/", methods=['POST'])
+class BulkMigration(Resource):
+    def post(self):
+        try:
+            migration_request = request.json or {}
+        except:
+            migration_request = {}
+
+        sanitized_data = json.dumps(migration_request).replace('\n', '').replace('\r', '')
+        logger.info("Bulk migration request: {}".format(sanitized_data))
+
+        try:
+            bulk_migration = start_bulk_migration(app_config, migration_request, DEBUG)
+        except ValueError as e:
+            return {'result': str(e)}, 400
+
+        if migration_request.get('dry_run', False):
+            return bulk_migration, 200
+
+        return bulk_migration, 202
+
+
+@ns.route("/migrations/<string:migration_id>", methods=['GET'])
+class BulkMigrationStatus(Resource):
+    def get(self, migration_id):
+        bulk_migration = get_bulk_migration(migration_id)
+
+        if not bulk_migration:
+            return {'result': f"Unknown bulk migration {migration_id}"}, 404
+
+        return bulk_migration, 200
+
+
+event_journal = get_event_journal(app_config, DEBUG)
+idempotency_store = get_idempotency_store(app_config, DEBUG)
+webhook_recorder = get_webhook_recorder(app_config, DEBUG)
+
+job_queue = None
+
+if 'job_queue' in app_config and app_config['job_queue'] and app_config['job_queue'].get('enabled', False):
+    job_queue = NetBoxProxmoxJobQueue(process_webhook, app_config, DEBUG, event_journal, complete_idempotent_job if idempotency_store else None)
+
+    # worker utilization is netbox_proxmox_job_queue_workers_busy / netbox_proxmox_job_queue_workers
+    metrics.gauge('netbox_proxmox_job_queue_depth', 'Jobs waiting in the job queue', callback=job_queue.queue_depth)
+    metrics.gauge('netbox_proxmox_job_queue_lanes', 'Virtual machines with queued or running jobs', callback=job_queue.active_lanes)
+    metrics.gauge('netbox_proxmox_job_queue_workers', 'Job queue worker threads', callback=lambda: job_queue.job_queue_config['workers'])
+
+# start topping up the warm pool (if enabled) before the first webhook arrives
+warm_pool = get_warm_pool(app_config, DEBUG)
+
+# run the webhooks which were accepted, but not finished, before the last restart
+if job_queue:
+    job_queue.replay()
+elif event_journal:
+    threading.Thread(target=replay_journaled_webhooks, name='netbox-proxmox-event-journal-replay', daemon=True).start()
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0")
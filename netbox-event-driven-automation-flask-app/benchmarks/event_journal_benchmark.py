@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import argparse
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from helpers.event_journal import NetBoxProxmoxEventJournal
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description="Measure the append rate of the webhook event journal")
+    parser.add_argument("--threads", type=int, action='append', default=[], help="Number of threads accepting webhooks at the same time (can be repeated, default: 1, 8 and 32)")
+    parser.add_argument("--events", type=int, default=2000, help="Number of webhooks accepted in each run (default: 2000)")
+    parser.add_argument("--group-commit-interval", type=float, action='append', default=[], help="Group commit interval in seconds (can be repeated, default: 0, 0.002 and 0.01)")
+    parser.add_argument("--synchronous", action='append', default=[], help="SQLite synchronous setting (can be repeated, default: full and normal)")
+    parser.add_argument("--directory", help="Directory for the journal files (default: a temporary directory)")
+
+    return parser.parse_args()
+
+
+def webhook_json_data(index):
+    return {
+        'event': 'updated',
+        'model': 'virtualmachine',
+        'request_id': str(uuid.uuid4()),
+        'username': 'admin',
+        'timestamp': '2025-11-01T00:00:00+00:00',
+        'data': {'id': index, 'name': f"vm-{index}", 'vcpus': 2, 'memory': 2048, 'status': {'value': 'active'}, 'custom_fields': {'proxmox_node': 'pve1', 'proxmox_vmid': str(1000 + index), 'proxmox_vm_type': 'vm'}},
+        'snapshots': {'prechange': {'vcpus': 1}, 'postchange': {'vcpus': 2}}
+    }
+
+
+def run(directory, synchronous, group_commit_interval, thread_count, event_count):
+    journal_path = os.path.join(directory, f"journal-{uuid.uuid4()}.db")
+    event_journal = NetBoxProxmoxEventJournal({'event_journal': {'path': journal_path, 'synchronous': synchronous, 'group_commit_interval': group_commit_interval}})
+
+    latencies = []
+    latencies_lock = threading.Lock()
+
+    def accept_webhooks(thread_index):
+        thread_latencies = []
+
+        for index in range(thread_index, event_count, thread_count):
+            start = time.perf_counter()
+            event_journal.accept(str(uuid.uuid4()), webhook_json_data(index))
+            thread_latencies.append(time.perf_counter() - start)
+
+        with latencies_lock:
+            latencies.extend(thread_latencies)
+
+    threads = [threading.Thread(target=accept_webhooks, args=(thread_index,)) for thread_index in range(thread_count)]
+
+    start = time.perf_counter()
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.perf_counter() - start
+
+    event_journal.close()
+
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(journal_path + suffix):
+            os.remove(journal_path + suffix)
+
+    latencies.sort()
+
+    return {
+        'rate': event_count / elapsed,
+        'p50': latencies[len(latencies) // 2],
+        'p99': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        'events_per_commit': event_journal.appended / max(event_journal.commits, 1)
+    }
+
+
+if __name__ == "__main__":
+    args = get_arguments()
+
+    thread_counts = args.threads if args.threads else [1, 8, 32]
+    group_commit_intervals = args.group_commit_interval if args.group_commit_interval else [0, 0.002, 0.01]
+    synchronous_settings = args.synchronous if args.synchronous else ['full', 'normal']
+
+    directory = args.directory if args.directory else tempfile.mkdtemp(prefix='event-journal-benchmark-')
+
+    print(f"{args.events} webhooks per run, journal in {directory}")
+    print(f"{'synchronous':<12} {'interval':>9} {'threads':>8} {'events/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'events/commit':>14}")
+
+    try:
+        for synchronous in synchronous_settings:
+            for group_commit_interval in group_commit_intervals:
+                for thread_count in thread_counts:
+                    result = run(directory, synchronous, group_commit_interval, thread_count, args.events)
+
+                    print(f"{synchronous:<12} {group_commit_interval:>9} {thread_count:>8} {result['rate']:>10.0f} {result['p50'] * 1000:>8.2f} {result['p99'] * 1000:>8.2f} {result['events_per_commit']:>14.1f}")
+    finally:
+        if not args.directory:
+            shutil.rmtree(directory, ignore_errors=True)
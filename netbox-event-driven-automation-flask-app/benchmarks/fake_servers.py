@@ -0,0 +1,1501 @@
+import hashlib
+import ipaddress
+import json
+import os
+import random
+import re
+import shutil
+import signal
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from helpers.metrics import get_endpoint_template
+
+app_directory = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+proxmox_version = {'version': '8.4.14', 'release': '8.4', 'repoid': 'b502d23c55afcba1'}
+netbox_version = '4.3.7'
+
+netbox_vm_custom_fields = ('proxmox_node', 'proxmox_vmid', 'proxmox_vm_type', 'proxmox_vm_storage', 'proxmox_vm_templates', 'proxmox_lxc_templates', 'proxmox_vm_clone_mode', 'proxmox_public_ssh_key', 'proxmox_is_lxc_container')
+
+# The subset of NetBox models used by netbox-discover-proxmox-vms.py and the Flask application
+netbox_models = {
+    'extras/tags': {
+        'defaults': {'name': '', 'slug': '', 'color': '9e9e9e', 'description': ''},
+        'unique': ('name',)
+    },
+    'tenancy/tenants': {
+        'defaults': {'name': '', 'slug': '', 'description': '', 'tags': [], 'custom_fields': {}},
+        'unique': ('name',)
+    },
+    'dcim/device-roles': {
+        'defaults': {'name': '', 'slug': '', 'color': '9e9e9e', 'vm_role': True, 'description': '', 'tags': [], 'custom_fields': {}},
+        'unique': ('name',)
+    },
+    'virtualization/cluster-types': {
+        'defaults': {'name': '', 'slug': '', 'description': '', 'tags': [], 'custom_fields': {}},
+        'unique': ('name',)
+    },
+    'virtualization/clusters': {
+        'defaults': {'name': '', 'type': None, 'status': 'active', 'tenant': None, 'description': '', 'comments': '', 'tags': [], 'custom_fields': {}},
+        'foreign_keys': {'type': 'virtualization/cluster-types', 'tenant': 'tenancy/tenants'},
+        'unique': ('name',)
+    },
+    'virtualization/virtual-machines': {
+        'defaults': {'name': '', 'status': 'active', 'cluster': None, 'role': None, 'tenant': None, 'platform': None, 'primary_ip4': None, 'primary_ip6': None, 'vcpus': None, 'memory': None, 'disk': None, 'description': '', 'comments': '', 'tags': [], 'custom_fields': {custom_field: None for custom_field in netbox_vm_custom_fields}},
+        'foreign_keys': {'cluster': 'virtualization/clusters', 'role': 'dcim/device-roles', 'tenant': 'tenancy/tenants', 'primary_ip4': 'ipam/ip-addresses', 'primary_ip6': 'ipam/ip-addresses'},
+        'unique': ('name', 'cluster', 'tenant')
+    },
+    'virtualization/interfaces': {
+        'defaults': {'virtual_machine': None, 'name': '', 'enabled': True, 'mtu': None, 'mac_address': None, 'primary_mac_address': None, 'mode': None, 'description': '', 'tags': [], 'custom_fields': {}},
+        'foreign_keys': {'virtual_machine': 'virtualization/virtual-machines', 'primary_mac_address': 'dcim/mac-addresses'},
+        'unique': ('virtual_machine', 'name')
+    },
+    'virtualization/virtual-disks': {
+        'defaults': {'virtual_machine': None, 'name': '', 'size': 0, 'description': '', 'tags': [], 'custom_fields': {'proxmox_disk_storage_volume': None}},
+        'foreign_keys': {'virtual_machine': 'virtualization/virtual-machines'},
+        'unique': ('virtual_machine', 'name')
+    },
+    'ipam/ip-addresses': {
+        'defaults': {'address': '', 'status': 'active', 'tenant': None, 'assigned_object_type': None, 'assigned_object_id': None, 'dns_name': '', 'description': '', 'tags': [], 'custom_fields': {}},
+        'foreign_keys': {'tenant': 'tenancy/tenants'}
+    },
+    'dcim/mac-addresses': {
+        'defaults': {'mac_address': '', 'assigned_object_type': None, 'assigned_object_id': None, 'description': '', 'tags': [], 'custom_fields': {}}
+    }
+}
+
+# filter -> indexed field, so that lookups by name, address, VM or interface stay fast with tens of thousands of objects
+netbox_indexed_filters = {
+    'name': 'name',
+    'slug': 'slug',
+    'address': 'address',
+    'mac_address': 'mac_address',
+    'virtual_machine_id': 'virtual_machine',
+    'cluster_id': 'cluster',
+    'assigned_object_id': 'assigned_object_id',
+    'vminterface_id': 'assigned_object_id'
+}
+
+netbox_control_parameters = ('limit', 'offset', 'brief', 'ordering', 'exclude', 'fields', 'omit')
+
+disk_config_key_pattern = re.compile(r'^(scsi|virtio|sata|ide|rootfs|mp)\d*$')
+disk_size_pattern = re.compile(r'size=(\d+)([MGT])')
+
+
+class FakeAPIError(Exception):
+    def __init__(self, status_code, message, errors=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+        self.errors = errors
+
+
+def get_self_signed_ssl_context():
+    # proxmoxer always talks https, so the Proxmox stand-in needs a (throwaway) certificate
+    if not shutil.which('openssl'):
+        raise RuntimeError("The Proxmox stand-in needs the 'openssl' command to create a self-signed certificate")
+
+    certificate_directory = tempfile.mkdtemp(prefix='fake-proxmox-tls-')
+
+    try:
+        subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1', '-subj', '/CN=127.0.0.1',
+                        '-keyout', os.path.join(certificate_directory, 'key.pem'), '-out', os.path.join(certificate_directory, 'cert.pem')],
+                       check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        ssl_context.load_cert_chain(os.path.join(certificate_directory, 'cert.pem'), os.path.join(certificate_directory, 'key.pem'))
+    finally:
+        shutil.rmtree(certificate_directory, ignore_errors=True)
+
+    return ssl_context
+
+
+def get_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as free_socket:
+        free_socket.bind(('127.0.0.1', 0))
+        return free_socket.getsockname()[1]
+
+
+class FakeHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    # a backlog of 5 (the default) makes concurrent clients wait for SYN retries
+    request_queue_size = 1024
+
+
+class FakeAPIRequestHandler(BaseHTTPRequestHandler):
+    # keep-alive, like the real APIs, so that the pooled clients of the Flask application reuse connections
+    protocol_version = 'HTTP/1.1'
+
+    # headers and body in one segment, otherwise Nagle and delayed ACKs add 40ms to every keep-alive request
+    disable_nagle_algorithm = True
+    wbufsize = 65536
+
+    def log_message(self, format, *args):
+        pass
+
+
+    def handle_request(self):
+        url = urllib.parse.urlsplit(self.path)
+        content_length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(content_length) if content_length else b''
+
+        self.server.fake_server.handle(self, self.command, urllib.parse.unquote(url.path), urllib.parse.parse_qs(url.query, keep_blank_values=True), body)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = handle_request
+
+
+    def send_json(self, status_code, response_data, reason=None, headers=None):
+        body = json.dumps(response_data, default=str).encode() if response_data is not None else b''
+
+        self.send_response(status_code, reason)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+
+        for header_name, header_value in (headers or {}).items():
+            self.send_header(header_name, header_value)
+
+        self.end_headers()
+
+        if body:
+            self.wfile.write(body)
+
+
+class FakeAPIServer:
+    def __init__(self, latency=0.0, ssl_context=None):
+        # seconds added to every request, e.g. 0.005 for a NetBox or Proxmox API a few milliseconds away
+        self.latency = latency
+        self.ssl_context = ssl_context
+
+        self.http_server = None
+        self.server_thread = None
+
+        # (method, endpoint template) -> number of requests
+        self.api_calls = Counter()
+        self.api_calls_lock = threading.Lock()
+
+
+    def start(self, host='127.0.0.1', port=0):
+        self.http_server = FakeHTTPServer((host, port), FakeAPIRequestHandler)
+        self.http_server.fake_server = self
+
+        if self.ssl_context:
+            # the TLS handshake runs in the request thread, not in the accepting one
+            self.http_server.socket = self.ssl_context.wrap_socket(self.http_server.socket, server_side=True, do_handshake_on_connect=False)
+
+        self.server_thread = threading.Thread(target=self.http_server.serve_forever, name=type(self).__name__, daemon=True)
+        self.server_thread.start()
+
+        return self
+
+
+    def stop(self):
+        if self.http_server:
+            self.http_server.shutdown()
+            self.http_server.server_close()
+            self.http_server = None
+
+
+    @property
+    def host(self):
+        return self.http_server.server_address[0]
+
+
+    @property
+    def port(self):
+        return self.http_server.server_address[1]
+
+
+    @property
+    def url(self):
+        return f"{'https' if self.ssl_context else 'http'}://{self.host}:{self.port}"
+
+
+    def get_api_calls(self):
+        with self.api_calls_lock:
+            return dict(self.api_calls)
+
+
+    def get_api_call_count(self):
+        with self.api_calls_lock:
+            return sum(self.api_calls.values())
+
+
+    def reset_api_calls(self):
+        with self.api_calls_lock:
+            self.api_calls.clear()
+
+
+    def handle(self, request_handler, method, path, query, body):
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        with self.api_calls_lock:
+            self.api_calls[(method, get_endpoint_template(path))] += 1
+
+        try:
+            status_code, response_data, reason, headers = self.dispatch(request_handler, method, path, query, body)
+        except FakeAPIError as e:
+            status_code, response_data, reason, headers = self.error_response(e)
+        except Exception as e:
+            status_code, response_data, reason, headers = self.error_response(FakeAPIError(500, f"{type(e).__name__}: {e}"))
+
+        try:
+            request_handler.send_json(status_code, response_data, reason, headers)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+    def dispatch(self, request_handler, method, path, query, body):
+        raise NotImplementedError
+
+
+    def error_response(self, e):
+        raise NotImplementedError
+
+
+class FakeProxmoxServer(FakeAPIServer):
+    # The PVE API calls made by netbox-discover-proxmox-vms.py and the Flask application, on an in-memory cluster
+    def __init__(self, node_count=3, latency=0.0, task_duration=0.0, cluster_name='fake-cluster', ssl_context=None):
+        super().__init__(latency, ssl_context or get_self_signed_ssl_context())
+
+        self.cluster_name = cluster_name
+
+        # seconds a task runs before it is stopped: one value, or {task type (e.g. qmclone): seconds, 'default': seconds}
+        self.task_duration = task_duration
+
+        self.lock = threading.Lock()
+
+        # node name -> {'ip', 'maxcpu', 'maxmem'}, and the upids of each node in the order they were started
+        self.nodes = {}
+        self.node_tasks = {}
+
+        for node_index in range(1, node_count + 1):
+            self.add_node(f"pve{node_index}")
+
+        self.storages = {
+            'local': {'type': 'dir', 'content': 'iso,vztmpl,backup', 'shared': 0, 'path': '/var/lib/vz'},
+            'local-lvm': {'type': 'lvmthin', 'content': 'images,rootdir', 'shared': 0, 'thinpool': 'data', 'vgname': 'pve'},
+            'ceph-vm': {'type': 'rbd', 'content': 'images,rootdir', 'shared': 1, 'pool': 'vm'}
+        }
+
+        # vmid -> {'vmid', 'type' (qemu or lxc), 'node', 'status', 'config'}
+        self.guests = {}
+
+        # upid -> task
+        self.tasks = {}
+        self.task_counter = 0
+
+        guest_path = r'^nodes/(?P<node>[^/]+)/(?P<guest_type>qemu|lxc)/(?P<vmid>\d+)'
+
+        self.routes = [(method, re.compile(route), handler) for method, route, handler in (
+            ('GET', r'^version$', self.get_version),
+            ('GET', r'^cluster/status$', self.get_cluster_status),
+            ('GET', r'^cluster/resources$', self.get_cluster_resources),
+            ('GET', r'^cluster/nextid$', self.get_cluster_nextid),
+            ('GET', r'^storage$', self.get_storages),
+            ('GET', r'^storage/(?P<storage>[^/]+)$', self.get_storage),
+            ('GET', r'^nodes$', self.get_nodes),
+            ('GET', r'^nodes/(?P<node>[^/]+)/version$', self.get_node_version),
+            ('GET', r'^nodes/(?P<node>[^/]+)/status$', self.get_node_status),
+            ('GET', r'^nodes/(?P<node>[^/]+)/storage/(?P<storage>[^/]+)/status$', self.get_node_storage_status),
+            ('GET', r'^nodes/(?P<node>[^/]+)/storage/(?P<storage>[^/]+)/content$', self.get_node_storage_content),
+            ('GET', r'^nodes/(?P<node>[^/]+)/tasks$', self.get_node_tasks),
+            ('GET', r'^nodes/(?P<node>[^/]+)/tasks/(?P<upid>[^/]+)/status$', self.get_task_status),
+            ('GET', r'^nodes/(?P<node>[^/]+)/tasks/(?P<upid>[^/]+)/log$', self.get_task_log),
+            ('POST', r'^nodes/(?P<node>[^/]+)/lxc$', self.create_lxc),
+            ('GET', guest_path + r'/config$', self.get_guest_config),
+            ('POST', guest_path + r'/config$', self.set_guest_config_async),
+            ('PUT', guest_path + r'/config$', self.set_guest_config),
+            ('GET', guest_path + r'/status/current$', self.get_guest_status),
+            ('POST', guest_path + r'/status/(?P<action>start|stop|shutdown|reboot)$', self.set_guest_status),
+            ('DELETE', guest_path + r'$', self.delete_guest),
+            ('POST', guest_path + r'/clone$', self.clone_guest),
+            ('PUT', guest_path + r'/resize$', self.resize_guest_disk),
+            ('PUT', guest_path + r'/unlink$', self.unlink_guest_disks),
+            ('GET', guest_path + r'/migrate$', self.get_guest_migrate),
+            ('POST', guest_path + r'/migrate$', self.migrate_guest),
+            ('POST', guest_path + r'/agent/ping$', self.ping_guest_agent),
+            ('GET', guest_path + r'/agent/network-get-interfaces$', self.get_guest_agent_network_interfaces)
+        )]
+
+
+    def dispatch(self, request_handler, method, path, query, body):
+        if not str(request_handler.headers.get('Authorization', '')).startswith('PVEAPIToken='):
+            raise FakeAPIError(401, 'No ticket')
+
+        if not path.startswith('/api2/json/'):
+            raise FakeAPIError(501, f"Method '{method} {path}' not implemented")
+
+        api_path = path[len('/api2/json/'):].strip('/')
+
+        # proxmoxer sends GET and DELETE parameters in the query string, POST and PUT parameters form-encoded
+        parameters = {key: values[-1] for key, values in query.items()}
+        parameters.update({key: values[-1] for key, values in urllib.parse.parse_qs(body.decode(), keep_blank_values=True).items()})
+
+        for route_method, route, handler in self.routes:
+            route_match = route.match(api_path)
+
+            if route_method == method and route_match:
+                with self.lock:
+                    return 200, {'data': handler(parameters, **route_match.groupdict())}, None, None
+
+        raise FakeAPIError(501, f"Method '{method} /{api_path}' not implemented")
+
+
+    def error_response(self, e):
+        # proxmoxer raises ResourceException with the HTTP reason phrase as content, like the real API
+        return e.status_code, {'data': None, 'errors': e.errors} if e.errors else {'data': None}, e.message.replace('\n', ' '), None
+
+
+    def populate(self, guest_count, seed=0, lxc_ratio=0.2, running_ratio=0.8, agent_ratio=0.9, templates=(9000, 9001)):
+        # Synthetic, deterministic guests spread round-robin over the nodes; templates live on the first node
+        rng = random.Random(seed)
+        proxmox_nodes = sorted(self.nodes)
+
+        with self.lock:
+            for template_index, template_vmid in enumerate(templates):
+                self.__add_guest(template_vmid, 'qemu', proxmox_nodes[0], 'stopped', {
+                    'name': f"template-{template_vmid}",
+                    'template': 1,
+                    'cores': 2,
+                    'sockets': 1,
+                    'memory': 2048,
+                    'bootdisk': 'scsi0',
+                    'scsihw': 'virtio-scsi-single',
+                    'scsi0': f"local-lvm:base-{template_vmid}-disk-0,size=16G",
+                    'ide2': f"local-lvm:vm-{template_vmid}-cloudinit,media=cdrom",
+                    'net0': f"virtio={get_fake_mac_address(template_index, 0xfe)},bridge=vmbr0",
+                    'agent': '1',
+                    'ostype': 'l26'
+                })
+
+            for guest_index in range(guest_count):
+                vmid = 100 + guest_index
+                proxmox_node = proxmox_nodes[guest_index % len(proxmox_nodes)]
+                status = 'running' if rng.random() < running_ratio else 'stopped'
+                disk_size = rng.choice((16, 32, 64, 128))
+
+                if rng.random() < lxc_ratio:
+                    self.__add_guest(vmid, 'lxc', proxmox_node, status, get_fake_lxc_config(vmid, f"fake-lxc-{guest_index:05d}", guest_index, rng.choice((1, 2, 4)), rng.choice((512, 1024, 2048)), disk_size))
+                    continue
+
+                vm_config = get_fake_vm_config(vmid, f"fake-vm-{guest_index:05d}", guest_index, rng.choice((1, 2, 4, 8)), rng.choice((1024, 2048, 4096, 8192)), disk_size, rng.random() < agent_ratio)
+
+                if guest_index % 4 == 0:
+                    vm_config['scsi1'] = f"local-lvm:vm-{vmid}-disk-1,size={rng.choice((32, 64))}G"
+
+                self.__add_guest(vmid, 'qemu', proxmox_node, status, vm_config)
+
+
+    def add_node(self, proxmox_node):
+        with self.lock:
+            if not proxmox_node in self.nodes:
+                self.nodes[proxmox_node] = {'ip': f"192.168.100.{len(self.nodes) + 1}", 'maxcpu': 64, 'maxmem': 512 * 1024 ** 3}
+                self.node_tasks[proxmox_node] = []
+
+
+    def add_guest(self, vmid, guest_type, proxmox_node, status, config):
+        with self.lock:
+            self.__add_guest(vmid, guest_type, proxmox_node, status, config)
+
+
+    def get_guests(self):
+        with self.lock:
+            return [{**guest, 'config': dict(guest['config'])} for guest in self.guests.values()]
+
+
+    def get_running_task_count(self):
+        with self.lock:
+            return len([task for task in self.tasks.values() if not self.__task_finished(task)])
+
+
+    def __add_guest(self, vmid, guest_type, proxmox_node, status, config):
+        self.guests[int(vmid)] = {'vmid': int(vmid), 'type': guest_type, 'node': proxmox_node, 'status': status, 'config': dict(config)}
+
+
+    def __node(self, proxmox_node):
+        if not proxmox_node in self.nodes:
+            raise FakeAPIError(500, f"hostname lookup '{proxmox_node}' failed - failed to get address info for: {proxmox_node}: Name or service not known")
+
+        return self.nodes[proxmox_node]
+
+
+    def __guest(self, proxmox_node, guest_type, vmid):
+        self.__node(proxmox_node)
+
+        guest = self.guests.get(int(vmid))
+
+        if not guest or guest['node'] != proxmox_node or guest['type'] != guest_type:
+            raise FakeAPIError(500, f"Configuration file 'nodes/{proxmox_node}/{'qemu-server' if guest_type == 'qemu' else 'lxc'}/{vmid}.conf' does not exist")
+
+        return guest
+
+
+    def __task_duration(self, task_type):
+        if isinstance(self.task_duration, dict):
+            return float(self.task_duration.get(task_type, self.task_duration.get('default', 0)))
+
+        return float(self.task_duration)
+
+
+    def __start_task(self, proxmox_node, task_type, vmid, exitstatus='OK'):
+        self.task_counter += 1
+        started = time.time()
+
+        # UPID:{node}:{pid}:{pstart}:{starttime}:{type}:{id}:{user}:
+        upid = f"UPID:{proxmox_node}:{self.task_counter:08X}:{self.task_counter:08X}:{int(started):08X}:{task_type}:{vmid}:root@pam!fake:"
+
+        self.tasks[upid] = {
+            'upid': upid,
+            'node': proxmox_node,
+            'pid': self.task_counter,
+            'pstart': self.task_counter,
+            'starttime': int(started),
+            'type': task_type,
+            'id': str(vmid),
+            'user': 'root@pam!fake',
+            'started': started,
+            'duration': self.__task_duration(task_type),
+            'exitstatus': exitstatus
+        }
+
+        self.node_tasks[proxmox_node].append(upid)
+
+        return upid
+
+
+    def __task_finished(self, task):
+        return time.time() >= task['started'] + task['duration']
+
+
+    def __task_entry(self, task):
+        task_entry = {key: task[key] for key in ('upid', 'node', 'pid', 'pstart', 'starttime', 'type', 'id', 'user')}
+
+        if self.__task_finished(task):
+            task_entry['endtime'] = int(task['started'] + task['duration'])
+            task_entry['status'] = task['exitstatus']
+
+        return task_entry
+
+
+    def __guest_disk_sizes(self, guest):
+        # (storage, size in bytes) of each disk of a guest
+        disk_sizes = []
+
+        for config_key, config_value in guest['config'].items():
+            if not disk_config_key_pattern.match(config_key) or 'media=cdrom' in str(config_value):
+                continue
+
+            size_match = disk_size_pattern.search(str(config_value))
+
+            if size_match:
+                disk_sizes.append((str(config_value).split(':')[0], int(size_match.group(1)) * 1024 ** {'M': 2, 'G': 3, 'T': 4}[size_match.group(2)]))
+
+        return disk_sizes
+
+
+    def __guest_resource(self, guest):
+        running = guest['status'] == 'running'
+        maxmem = int(guest['config'].get('memory', 512)) * 1024 ** 2
+
+        return {
+            'id': f"{guest['type']}/{guest['vmid']}",
+            'type': guest['type'],
+            'vmid': guest['vmid'],
+            'name': guest['config'].get('name', guest['config'].get('hostname', f"{guest['type']}-{guest['vmid']}")),
+            'node': guest['node'],
+            'status': guest['status'],
+            'template': int(guest['config'].get('template', 0)),
+            'tags': guest['config'].get('tags', ''),
+            'maxcpu': int(guest['config'].get('cores', 1)) * int(guest['config'].get('sockets', 1)),
+            'cpu': 0.05 if running else 0,
+            'maxmem': maxmem,
+            'mem': maxmem // 2 if running else 0,
+            'maxdisk': sum(disk_size for _, disk_size in self.__guest_disk_sizes(guest)),
+            'disk': 0,
+            'uptime': 3600 if running else 0
+        }
+
+
+    def __node_usage(self, proxmox_node):
+        running_guests = [guest for guest in self.guests.values() if guest['node'] == proxmox_node and guest['status'] == 'running']
+
+        return {
+            'cpu': min(1.0, sum(int(guest['config'].get('cores', 1)) for guest in running_guests) * 0.05 / self.nodes[proxmox_node]['maxcpu']),
+            'mem': sum(int(guest['config'].get('memory', 512)) * 1024 ** 2 for guest in running_guests) // 2
+        }
+
+
+    def __storage_usage(self):
+        # (node, storage) -> bytes used, in one pass over the guests; shared storage counts every guest on every node
+        storage_usage = {(proxmox_node, storage_id): 0 for proxmox_node in self.nodes for storage_id in self.storages}
+
+        for guest in self.guests.values():
+            for disk_storage_id, disk_size in self.__guest_disk_sizes(guest):
+                if not disk_storage_id in self.storages:
+                    continue
+
+                for proxmox_node in self.nodes if self.storages[disk_storage_id]['shared'] else [guest['node']]:
+                    storage_usage[(proxmox_node, disk_storage_id)] += disk_size
+
+        return storage_usage
+
+
+    def get_version(self, parameters):
+        return dict(proxmox_version)
+
+
+    def get_cluster_status(self, parameters):
+        cluster_status = [{'id': 'cluster', 'type': 'cluster', 'name': self.cluster_name, 'nodes': len(self.nodes), 'quorate': 1, 'version': 1}]
+
+        for node_index, proxmox_node in enumerate(sorted(self.nodes)):
+            cluster_status.append({'id': f"node/{proxmox_node}", 'type': 'node', 'name': proxmox_node, 'ip': self.nodes[proxmox_node]['ip'], 'online': 1, 'local': int(node_index == 0), 'nodeid': node_index + 1, 'level': ''})
+
+        return cluster_status
+
+
+    def get_cluster_resources(self, parameters):
+        resource_type = parameters.get('type')
+        cluster_resources = []
+
+        if resource_type in (None, 'node'):
+            for proxmox_node in sorted(self.nodes):
+                node_usage = self.__node_usage(proxmox_node)
+
+                cluster_resources.append({'id': f"node/{proxmox_node}", 'type': 'node', 'node': proxmox_node, 'status': 'online', 'maxcpu': self.nodes[proxmox_node]['maxcpu'], 'cpu': node_usage['cpu'], 'maxmem': self.nodes[proxmox_node]['maxmem'], 'mem': node_usage['mem'], 'maxdisk': 100 * 1024 ** 3, 'disk': 10 * 1024 ** 3, 'uptime': 86400})
+
+        if resource_type in (None, 'storage'):
+            storage_usage = self.__storage_usage()
+
+            for proxmox_node in sorted(self.nodes):
+                for storage_id in sorted(self.storages):
+                    cluster_resources.append({'id': f"storage/{proxmox_node}/{storage_id}", 'type': 'storage', 'node': proxmox_node, 'storage': storage_id, 'status': 'available', 'plugintype': self.storages[storage_id]['type'], 'content': self.storages[storage_id]['content'], 'shared': self.storages[storage_id]['shared'], 'maxdisk': 16 * 1024 ** 4, 'disk': storage_usage[(proxmox_node, storage_id)]})
+
+        if resource_type in (None, 'vm'):
+            cluster_resources.extend(self.__guest_resource(guest) for guest in self.guests.values())
+
+        return cluster_resources
+
+
+    def get_cluster_nextid(self, parameters):
+        if parameters.get('vmid'):
+            if int(parameters['vmid']) in self.guests:
+                raise FakeAPIError(400, 'Parameter verification failed.', {'vmid': f"VM {parameters['vmid']} already exists"})
+
+            return str(parameters['vmid'])
+
+        vmid = 100
+
+        while vmid in self.guests:
+            vmid += 1
+
+        return str(vmid)
+
+
+    def get_storages(self, parameters):
+        return [{'storage': storage_id, **self.storages[storage_id], 'digest': hashlib.sha1(storage_id.encode()).hexdigest()} for storage_id in sorted(self.storages)]
+
+
+    def get_storage(self, parameters, storage):
+        if not storage in self.storages:
+            raise FakeAPIError(500, f"storage '{storage}' does not exist")
+
+        return {'storage': storage, **self.storages[storage], 'digest': hashlib.sha1(storage.encode()).hexdigest()}
+
+
+    def get_nodes(self, parameters):
+        return [{'node': proxmox_node, 'status': 'online', 'maxcpu': self.nodes[proxmox_node]['maxcpu'], 'maxmem': self.nodes[proxmox_node]['maxmem'], **self.__node_usage(proxmox_node)} for proxmox_node in sorted(self.nodes)]
+
+
+    def get_node_version(self, parameters, node):
+        self.__node(node)
+
+        return dict(proxmox_version)
+
+
+    def get_node_status(self, parameters, node):
+        proxmox_node = self.__node(node)
+        node_usage = self.__node_usage(node)
+
+        return {
+            'cpu': node_usage['cpu'],
+            'cpuinfo': {'cpus': proxmox_node['maxcpu'], 'sockets': 2, 'model': 'Fake CPU'},
+            'memory': {'total': proxmox_node['maxmem'], 'used': node_usage['mem'], 'free': proxmox_node['maxmem'] - node_usage['mem']},
+            'uptime': 86400,
+            'pveversion': f"pve-manager/{proxmox_version['version']}/{proxmox_version['repoid']}"
+        }
+
+
+    def get_node_storage_status(self, parameters, node, storage):
+        self.__node(node)
+
+        if not storage in self.storages:
+            raise FakeAPIError(500, f"storage '{storage}' does not exist")
+
+        used = self.__storage_usage()[(node, storage)]
+
+        return {'storage': storage, 'type': self.storages[storage]['type'], 'content': self.storages[storage]['content'], 'shared': self.storages[storage]['shared'], 'active': 1, 'enabled': 1, 'total': 16 * 1024 ** 4, 'used': used, 'avail': 16 * 1024 ** 4 - used}
+
+
+    def get_node_storage_content(self, parameters, node, storage):
+        self.__node(node)
+
+        if not storage in self.storages:
+            raise FakeAPIError(500, f"storage '{storage}' does not exist")
+
+        if not 'vztmpl' in self.storages[storage]['content']:
+            return []
+
+        return [{'volid': f"{storage}:vztmpl/{template}", 'format': 'tzst', 'content': 'vztmpl', 'size': 130 * 1024 ** 2, 'ctime': 1730000000} for template in ('debian-12-standard_12.7-1_amd64.tar.zst', 'ubuntu-24.04-standard_24.04-2_amd64.tar.zst')]
+
+
+    def get_node_tasks(self, parameters, node):
+        self.__node(node)
+
+        since = int(parameters.get('since') or 0)
+        limit = int(parameters.get('limit') or 50)
+        task_entries = []
+
+        # newest first, like the real task listing
+        for upid in reversed(self.node_tasks[node]):
+            task = self.tasks[upid]
+
+            if task['starttime'] < since or len(task_entries) >= limit:
+                break
+
+            task_entries.append(self.__task_entry(task))
+
+        return task_entries
+
+
+    def get_task_status(self, parameters, node, upid):
+        self.__node(node)
+
+        if not upid in self.tasks:
+            raise FakeAPIError(500, 'no such task')
+
+        task_status = self.__task_entry(self.tasks[upid])
+        task_status.pop('endtime', None)
+        task_status['status'] = 'stopped' if self.__task_finished(self.tasks[upid]) else 'running'
+
+        if task_status['status'] == 'stopped':
+            task_status['exitstatus'] = self.tasks[upid]['exitstatus']
+
+        return task_status
+
+
+    def get_task_log(self, parameters, node, upid):
+        self.__node(node)
+
+        if not upid in self.tasks:
+            raise FakeAPIError(500, 'no such task')
+
+        task_log = [f"starting {self.tasks[upid]['type']} of {self.tasks[upid]['id']}"]
+
+        if self.__task_finished(self.tasks[upid]):
+            task_log.append(f"TASK {self.tasks[upid]['exitstatus']}")
+
+        start = int(parameters.get('start') or 0)
+        limit = int(parameters.get('limit') or 50)
+
+        return [{'n': line_number + 1, 't': line} for line_number, line in enumerate(task_log)][start:start + limit]
+
+
+    def create_lxc(self, parameters, node):
+        self.__node(node)
+
+        vmid = int(parameters['vmid'])
+
+        if vmid in self.guests:
+            raise FakeAPIError(500, f"unable to create CT {vmid} - CT {vmid} already exists on node '{self.guests[vmid]['node']}'")
+
+        lxc_config = {
+            'hostname': parameters.get('hostname', f"CT{vmid}"),
+            'cores': int(parameters.get('cores', 1)),
+            'memory': int(parameters.get('memory', 512)),
+            'swap': int(parameters.get('swap', 512)),
+            'rootfs': f"{parameters.get('storage', 'local-lvm')}:vm-{vmid}-disk-0,size=8G",
+            'ostype': 'ubuntu',
+            'arch': 'amd64',
+            'unprivileged': int(parameters.get('unprivileged', 0)),
+            'onboot': int(parameters.get('onboot', 0))
+        }
+
+        if parameters.get('net0'):
+            lxc_config['net0'] = parameters['net0']
+
+        self.__add_guest(vmid, 'lxc', node, 'stopped', lxc_config)
+
+        return self.__start_task(node, 'vzcreate', vmid)
+
+
+    def get_guest_config(self, parameters, node, guest_type, vmid):
+        guest = self.__guest(node, guest_type, vmid)
+
+        return {**guest['config'], 'digest': self.__guest_config_digest(guest)}
+
+
+    def __guest_config_digest(self, guest):
+        return hashlib.sha1(json.dumps(guest['config'], sort_keys=True).encode()).hexdigest()
+
+
+    def set_guest_config(self, parameters, node, guest_type, vmid):
+        guest = self.__guest(node, guest_type, vmid)
+
+        if parameters.get('digest') and parameters['digest'] != self.__guest_config_digest(guest):
+            raise FakeAPIError(500, 'detected modified configuration - file changed by other user? Try again.')
+
+        for config_key, config_value in parameters.items():
+            if config_key == 'delete':
+                for deleted_config_key in config_value.split(','):
+                    guest['config'].pop(deleted_config_key.strip(), None)
+            elif config_key in ('digest', 'skiplock', 'background_delay'):
+                continue
+            elif re.match(r'^\d+$', str(config_value)) and config_key in ('cores', 'sockets', 'memory', 'swap', 'balloon', 'onboot', 'unprivileged'):
+                guest['config'][config_key] = int(config_value)
+            else:
+                guest['config'][config_key] = config_value
+
+        return None
+
+
+    def set_guest_config_async(self, parameters, node, guest_type, vmid):
+        # POST runs as a task, PUT returns once the config is written
+        self.set_guest_config(parameters, node, guest_type, vmid)
+
+        return self.__start_task(node, 'qmconfig', vmid)
+
+
+    def get_guest_status(self, parameters, node, guest_type, vmid):
+        guest = self.__guest(node, guest_type, vmid)
+
+        return {'vmid': guest['vmid'], 'name': self.__guest_resource(guest)['name'], 'status': guest['status'], 'qmpstatus': guest['status'], 'uptime': 3600 if guest['status'] == 'running' else 0}
+
+
+    def set_guest_status(self, parameters, node, guest_type, vmid, action):
+        guest = self.__guest(node, guest_type, vmid)
+
+        guest['status'] = 'running' if action in ('start', 'reboot') else 'stopped'
+
+        return self.__start_task(node, f"{'qm' if guest_type == 'qemu' else 'vz'}{action}", vmid)
+
+
+    def delete_guest(self, parameters, node, guest_type, vmid):
+        guest = self.__guest(node, guest_type, vmid)
+
+        if guest['status'] == 'running':
+            raise FakeAPIError(500, f"{'VM' if guest_type == 'qemu' else 'CT'} {vmid} is running - destroy failed")
+
+        del self.guests[int(vmid)]
+
+        return self.__start_task(node, 'qmdestroy' if guest_type == 'qemu' else 'vzdestroy', vmid)
+
+
+    def clone_guest(self, parameters, node, guest_type, vmid):
+        template = self.__guest(node, guest_type, vmid)
+        newid = int(parameters['newid'])
+        target_node = parameters.get('target') or node
+
+        self.__node(target_node)
+
+        if newid in self.guests:
+            raise FakeAPIError(500, f"unable to create VM {newid} - VM {newid} already exists on node '{self.guests[newid]['node']}'")
+
+        clone_config = {}
+
+        for config_key, config_value in template['config'].items():
+            if config_key == 'template':
+                continue
+
+            if isinstance(config_value, str):
+                config_value = re.sub(rf'(base|vm)-{vmid}-', f"vm-{newid}-", config_value)
+
+                if parameters.get('storage') and str(parameters.get('full', '1')) == '1' and not 'media=cdrom' in config_value and re.match(r'^[^:,=]+:vm-', config_value):
+                    config_value = f"{parameters['storage']}:{config_value.split(':', 1)[1]}"
+
+            clone_config[config_key] = config_value
+
+        clone_config['name'] = parameters.get('name') or f"Copy-of-VM-{template['config'].get('name', vmid)}"
+
+        self.__add_guest(newid, guest_type, target_node, 'stopped', clone_config)
+
+        return self.__start_task(node, 'qmclone', vmid)
+
+
+    def resize_guest_disk(self, parameters, node, guest_type, vmid):
+        guest = self.__guest(node, guest_type, vmid)
+        disk = parameters.get('disk')
+
+        if not disk in guest['config']:
+            raise FakeAPIError(500, f"disk '{disk}' does not exist")
+
+        size_match = re.match(r'^(\+?)(\d+(?:\.\d+)?)([MGT]?)$', str(parameters.get('size', '')))
+
+        if not size_match:
+            raise FakeAPIError(400, 'Parameter verification failed.', {'size': 'value does not match the regex pattern'})
+
+        current_size_match = re.search(r'size=(\d+)G', guest['config'][disk])
+        new_size = float(size_match.group(2)) * {'M': 1 / 1024, 'G': 1, 'T': 1024, '': 1 / 1024 ** 3}[size_match.group(3)]
+
+        if size_match.group(1):
+            new_size += int(current_size_match.group(1)) if current_size_match else 0
+
+        guest['config'][disk] = re.sub(r'size=\d+[MGT]', f"size={max(1, int(round(new_size)))}G", guest['config'][disk])
+
+        return self.__start_task(node, 'resize', vmid)
+
+
+    def unlink_guest_disks(self, parameters, node, guest_type, vmid):
+        guest = self.__guest(node, guest_type, vmid)
+
+        for disk in str(parameters.get('idlist', '')).split(','):
+            guest['config'].pop(disk.strip(), None)
+
+        return None
+
+
+    def get_guest_migrate(self, parameters, node, guest_type, vmid):
+        guest = self.__guest(node, guest_type, vmid)
+
+        local_disks = [{'volid': str(config_value).split(',')[0], 'drivename': config_key, 'size': disk_size}
+                       for config_key, config_value in guest['config'].items()
+                       for disk_storage_id, disk_size in self.__guest_disk_sizes({'config': {config_key: config_value}})
+                       if not self.storages.get(disk_storage_id, {}).get('shared')]
+
+        return {'running': int(guest['status'] == 'running'), 'allowed_nodes': [proxmox_node for proxmox_node in sorted(self.nodes) if proxmox_node != node], 'not_allowed_nodes': {}, 'local_disks': local_disks, 'local_resources': []}
+
+
+    def migrate_guest(self, parameters, node, guest_type, vmid):
+        guest = self.__guest(node, guest_type, vmid)
+        target_node = parameters.get('target')
+
+        self.__node(target_node)
+
+        if target_node == node:
+            raise FakeAPIError(400, 'Parameter verification failed.', {'target': 'target is local node.'})
+
+        guest['node'] = target_node
+
+        return self.__start_task(node, 'qmigrate' if guest_type == 'qemu' else 'vzmigrate', vmid)
+
+
+    def __guest_agent(self, node, guest_type, vmid):
+        guest = self.__guest(node, guest_type, vmid)
+
+        if guest_type != 'qemu' or not re.match(r'^(1|enabled=1)', str(guest['config'].get('agent', '0'))):
+            raise FakeAPIError(500, 'No QEMU guest agent configured')
+
+        if guest['status'] != 'running':
+            raise FakeAPIError(500, f"VM {vmid} is not running")
+
+        return guest
+
+
+    def ping_guest_agent(self, parameters, node, guest_type, vmid):
+        self.__guest_agent(node, guest_type, vmid)
+
+        return None
+
+
+    def get_guest_agent_network_interfaces(self, parameters, node, guest_type, vmid):
+        guest = self.__guest_agent(node, guest_type, vmid)
+
+        network_interfaces = [{'name': 'lo', 'hardware-address': '00:00:00:00:00:00', 'ip-addresses': [{'ip-address-type': 'ipv4', 'ip-address': '127.0.0.1', 'prefix': 8}]}]
+
+        mac_address_match = re.search(r'=([0-9A-Fa-f]{2}(?::[0-9A-Fa-f]{2}){5})', str(guest['config'].get('net0', '')))
+        ip_address_match = re.search(r'ip=([0-9.]+)/(\d+)', str(guest['config'].get('ipconfig0', '')))
+
+        if mac_address_match:
+            network_interfaces.append({
+                'name': 'eth0',
+                'hardware-address': mac_address_match.group(1).lower(),
+                'ip-addresses': [{'ip-address-type': 'ipv4', 'ip-address': ip_address_match.group(1), 'prefix': int(ip_address_match.group(2))}] if ip_address_match else []
+            })
+
+        return {'result': network_interfaces}
+
+
+def get_fake_vm_config(vmid, name, guest_index, cores=2, memory=2048, disk_size=32, agent=True):
+    ip_address = get_fake_ip_address(guest_index)
+
+    vm_config = {
+        'name': name,
+        'cores': cores,
+        'sockets': 1,
+        'memory': memory,
+        'bootdisk': 'scsi0',
+        'scsihw': 'virtio-scsi-single',
+        'scsi0': f"local-lvm:vm-{vmid}-disk-0,size={disk_size}G",
+        'ide2': f"local-lvm:vm-{vmid}-cloudinit,media=cdrom",
+        'net0': f"virtio={get_fake_mac_address(guest_index)},bridge=vmbr0",
+        'ipconfig0': f"ip={ip_address}/24,gw={get_fake_gateway(ip_address)}",
+        'sshkeys': urllib.parse.quote(f"ssh-ed25519 AAAAC3NzaC1lZDI1NTE5AAAAIFakeKeyFakeKeyFakeKey{guest_index:05d} fake@benchmark\n", safe=''),
+        'ostype': 'l26'
+    }
+
+    if agent:
+        vm_config['agent'] = '1'
+
+    return vm_config
+
+
+def get_fake_lxc_config(vmid, hostname, guest_index, cores=1, memory=512, disk_size=8):
+    ip_address = get_fake_ip_address(guest_index)
+
+    return {
+        'hostname': hostname,
+        'cores': cores,
+        'memory': memory,
+        'swap': 0,
+        'rootfs': f"local-lvm:vm-{vmid}-disk-0,size={disk_size}G",
+        'net0': f"name=eth0,bridge=vmbr0,firewall=0,gw={get_fake_gateway(ip_address)},hwaddr={get_fake_mac_address(guest_index)},ip={ip_address}/24,type=veth",
+        'ostype': 'ubuntu',
+        'arch': 'amd64',
+        'unprivileged': 1,
+        'onboot': 1
+    }
+
+
+def get_fake_gateway(ip_address):
+    return '.'.join(ip_address.split('.')[0:3]) + '.1'
+
+
+def get_fake_ip_address(guest_index):
+    return str(ipaddress.IPv4Address('10.0.0.0') + 256 * (guest_index // 250) + 2 + guest_index % 250)
+
+
+def get_fake_mac_address(guest_index, prefix=0x11):
+    return f"BC:24:{prefix:02X}:{(guest_index >> 16) & 0xff:02X}:{(guest_index >> 8) & 0xff:02X}:{guest_index & 0xff:02X}"
+
+
+class FakeNetBoxServer(FakeAPIServer):
+    # The NetBox REST API (list, filter, paging, bulk create / update / delete) for the models the scripts use
+    def __init__(self, latency=0.0, page_size=50, max_page_size=1000):
+        super().__init__(latency)
+
+        self.page_size = page_size
+        self.max_page_size = max_page_size
+
+        self.lock = threading.Lock()
+        self.reset()
+
+
+    def reset(self):
+        with self.lock:
+            # model -> {id: object}, objects are kept with ids for foreign keys and rendered on the way out
+            self.objects = {model: {} for model in netbox_models}
+
+            # model -> field -> index key -> set of ids
+            self.indexes = {model: {} for model in netbox_models}
+            self.next_ids = {model: 1 for model in netbox_models}
+
+
+    def dispatch(self, request_handler, method, path, query, body):
+        if not str(request_handler.headers.get('Authorization', '')).startswith('Token '):
+            raise FakeAPIError(403, 'Forbidden', {'detail': 'Authentication credentials were not provided.'})
+
+        path_parts = path.strip('/').split('/')
+        headers = {'API-Version': '.'.join(netbox_version.split('.')[0:2])}
+
+        if path_parts == ['api']:
+            return 200, {model.split('/')[0]: f"{self.url}/api/{model.split('/')[0]}/" for model in netbox_models}, None, headers
+
+        if path_parts == ['api', 'status']:
+            return 200, {'django-version': '5.2', 'installed-apps': {}, 'netbox-version': netbox_version, 'plugins': {}, 'python-version': sys.version.split()[0], 'rq-workers-running': 1}, None, headers
+
+        if len(path_parts) < 3 or path_parts[0] != 'api' or not f"{path_parts[1]}/{path_parts[2]}" in netbox_models:
+            raise FakeAPIError(404, 'Not Found', {'detail': 'Not found.'})
+
+        model = f"{path_parts[1]}/{path_parts[2]}"
+        object_id = int(path_parts[3]) if len(path_parts) > 3 and path_parts[3].isdigit() else None
+        request_data = json.loads(body) if body else None
+
+        with self.lock:
+            if method == 'GET' and object_id:
+                return 200, self.__render(model, self.__get(model, object_id)), None, headers
+
+            if method == 'GET':
+                return 200, self.__list(model, path, query), None, headers
+
+            if method == 'POST' and not object_id:
+                if isinstance(request_data, list):
+                    return 201, [self.__render(model, self.__create(model, object_data)) for object_data in request_data], None, headers
+
+                return 201, self.__render(model, self.__create(model, request_data or {})), None, headers
+
+            if method in ('PATCH', 'PUT'):
+                if object_id:
+                    return 200, self.__render(model, self.__update(model, object_id, request_data or {})), None, headers
+
+                return 200, [self.__render(model, self.__update(model, object_data.get('id'), object_data)) for object_data in request_data or []], None, headers
+
+            if method == 'DELETE':
+                for deleted_object_id in [object_id] if object_id else [object_data.get('id') for object_data in request_data or []]:
+                    self.__delete(model, deleted_object_id)
+
+                return 204, None, None, headers
+
+        raise FakeAPIError(405, 'Method Not Allowed', {'detail': f"Method \"{method}\" not allowed."})
+
+
+    def error_response(self, e):
+        return e.status_code, e.errors or {'detail': e.message}, None, None
+
+
+    def create_object(self, model, object_data, object_id=None):
+        # object_id keeps the id of an object seen elsewhere (e.g. in a recorded webhook); the REST API always assigns one
+        with self.lock:
+            return self.__render(model, self.__create(model, object_data, object_id))
+
+
+    def update_object(self, model, object_id, object_data):
+        with self.lock:
+            return self.__render(model, self.__update(model, object_id, object_data))
+
+
+    def get_object(self, model, object_id):
+        with self.lock:
+            return self.__render(model, self.__get(model, object_id))
+
+
+    def find_objects(self, model, **filters):
+        with self.lock:
+            return [self.__render(model, netbox_object) for netbox_object in self.__filter(model, {filter_name: [filter_value] for filter_name, filter_value in filters.items()})]
+
+
+    def get_object_count(self, model):
+        with self.lock:
+            return len(self.objects[model])
+
+
+    def seed_from_proxmox(self, fake_proxmox, cluster_type_name='Proxmox'):
+        # NetBox as netbox-discover-proxmox-vms.py leaves it: one VM (with its disks) for each Proxmox guest
+        cluster_type = self.create_object('virtualization/cluster-types', {'name': cluster_type_name, 'slug': re.sub(r'\W+', '-', cluster_type_name).lower()})
+        cluster = self.create_object('virtualization/clusters', {'name': fake_proxmox.cluster_name, 'type': cluster_type['id'], 'status': 'active'})
+        vm_role = self.create_object('dcim/device-roles', {'name': 'Proxmox VM', 'slug': 'proxmox-vm', 'vm_role': True})
+        lxc_role = self.create_object('dcim/device-roles', {'name': 'Proxmox LXC', 'slug': 'proxmox-lxc', 'vm_role': True})
+
+        for guest in sorted(fake_proxmox.get_guests(), key=lambda guest: guest['vmid']):
+            if guest['config'].get('template'):
+                continue
+
+            netbox_vm = self.create_object('virtualization/virtual-machines', {
+                'name': guest['config'].get('name', guest['config'].get('hostname')),
+                'cluster': cluster['id'],
+                'role': vm_role['id'] if guest['type'] == 'qemu' else lxc_role['id'],
+                'status': 'active' if guest['status'] == 'running' else 'offline',
+                'vcpus': float(guest['config'].get('cores', 1)),
+                'memory': int(guest['config'].get('memory', 512)),
+                'custom_fields': {
+                    'proxmox_node': guest['node'],
+                    'proxmox_vmid': str(guest['vmid']),
+                    'proxmox_vm_type': 'vm' if guest['type'] == 'qemu' else 'lxc',
+                    'proxmox_vm_storage': 'local-lvm',
+                    'proxmox_public_ssh_key': urllib.parse.unquote(guest['config'].get('sshkeys', '')).rstrip() or None
+                }
+            })
+
+            for disk_name in ('scsi0', 'scsi1', 'rootfs'):
+                size_match = re.search(r'size=(\d+)G', str(guest['config'].get(disk_name, '')))
+
+                if size_match:
+                    self.create_object('virtualization/virtual-disks', {'virtual_machine': netbox_vm['id'], 'name': disk_name, 'size': int(size_match.group(1)) * 1000, 'custom_fields': {'proxmox_disk_storage_volume': guest['config'][disk_name].split(':')[0]}})
+
+        return cluster
+
+
+    def __get(self, model, object_id):
+        if not int(object_id or 0) in self.objects[model]:
+            raise FakeAPIError(404, 'Not Found', {'detail': f"No {model.split('/')[1]} matches the given query."})
+
+        return self.objects[model][int(object_id)]
+
+
+    def __index_key(self, field, value):
+        if value is None:
+            return None
+
+        if field == 'address':
+            return str(value).split('/')[0]
+
+        if field == 'mac_address':
+            return str(value).lower()
+
+        return str(value)
+
+
+    def __index(self, model, netbox_object, add=True):
+        for field in set(netbox_indexed_filters.values()):
+            if not field in netbox_models[model]['defaults']:
+                continue
+
+            index_key = self.__index_key(field, netbox_object.get(field))
+            field_index = self.indexes[model].setdefault(field, {})
+
+            if add:
+                field_index.setdefault(index_key, set()).add(netbox_object['id'])
+            elif index_key in field_index:
+                field_index[index_key].discard(netbox_object['id'])
+
+
+    def __reference(self, model, value):
+        # nested objects, ids and numeric strings all end up as the id of the referenced object
+        if isinstance(value, dict):
+            if value.get('id') is not None:
+                return int(value['id'])
+
+            referenced_objects = self.__filter(model, {key: [value[key]] for key in ('name', 'slug') if key in value})
+
+            return referenced_objects[0]['id'] if referenced_objects else None
+
+        if value is None or value == '':
+            return None
+
+        return int(value)
+
+
+    def __apply(self, model, netbox_object, object_data):
+        model_config = netbox_models[model]
+        foreign_keys = model_config.get('foreign_keys', {})
+
+        for key, value in object_data.items():
+            if key in ('id', 'url', 'display', 'created', 'last_updated'):
+                continue
+
+            if key in foreign_keys:
+                value = self.__reference(foreign_keys[key], value)
+
+                if value is not None and not value in self.objects[foreign_keys[key]]:
+                    raise FakeAPIError(400, 'Bad Request', {key: [f"Related object not found using the provided numeric ID: {value}"]})
+            elif key == 'tags':
+                value = [self.__reference('extras/tags', tag) for tag in value or []]
+            elif key == 'status' and isinstance(value, dict):
+                value = value.get('value')
+            elif key == 'assigned_object_id' and value is not None:
+                value = int(value)
+            elif key == 'custom_fields':
+                value = {**netbox_object.get('custom_fields', {}), **(value or {})}
+
+            netbox_object[key] = value
+
+
+    def __check_unique(self, model, netbox_object):
+        unique_fields = netbox_models[model].get('unique')
+
+        if not unique_fields:
+            return
+
+        field_index = self.indexes[model].get(unique_fields[0])
+
+        if field_index is not None:
+            candidate_ids = field_index.get(self.__index_key(unique_fields[0], netbox_object.get(unique_fields[0])), set())
+        else:
+            candidate_ids = list(self.objects[model])
+
+        for candidate_id in candidate_ids:
+            if candidate_id != netbox_object['id'] and all(self.objects[model][candidate_id].get(field) == netbox_object.get(field) for field in unique_fields):
+                raise FakeAPIError(400, 'Bad Request', {'__all__': [f"{model.split('/')[1]} with this {', '.join(unique_fields)} already exists."]})
+
+
+    def __create(self, model, object_data, object_id=None):
+        model_config = netbox_models[model]
+
+        required_field = next(iter(model_config['defaults']))
+
+        if model == 'virtualization/interfaces' or model == 'virtualization/virtual-disks':
+            required_field = 'name'
+
+        if not object_data.get(required_field):
+            raise FakeAPIError(400, 'Bad Request', {required_field: ['This field is required.']})
+
+        if object_id is not None and int(object_id) in self.objects[model]:
+            raise FakeAPIError(400, 'Bad Request', {'id': [f"{model.split('/')[1]} {object_id} already exists."]})
+
+        netbox_object = json.loads(json.dumps(model_config['defaults']))
+        netbox_object['id'] = int(object_id) if object_id is not None else self.next_ids[model]
+
+        self.__apply(model, netbox_object, object_data)
+        self.__check_unique(model, netbox_object)
+
+        netbox_object['created'] = netbox_object['last_updated'] = datetime.now(timezone.utc).isoformat()
+
+        self.next_ids[model] = max(self.next_ids[model], netbox_object['id'] + 1)
+        self.objects[model][netbox_object['id']] = netbox_object
+        self.__index(model, netbox_object)
+
+        return netbox_object
+
+
+    def __update(self, model, object_id, object_data):
+        netbox_object = self.__get(model, object_id)
+        updated_object = json.loads(json.dumps(netbox_object))
+
+        self.__apply(model, updated_object, object_data)
+        self.__check_unique(model, updated_object)
+
+        updated_object['last_updated'] = datetime.now(timezone.utc).isoformat()
+
+        self.__index(model, netbox_object, add=False)
+        self.objects[model][netbox_object['id']] = updated_object
+        self.__index(model, updated_object)
+
+        return updated_object
+
+
+    def __delete(self, model, object_id):
+        netbox_object = self.__get(model, object_id)
+
+        self.__index(model, netbox_object, add=False)
+        del self.objects[model][netbox_object['id']]
+
+
+    def __filter_values(self, model, netbox_object, filter_name):
+        # The values of netbox_object a filter compares with, or None for filters NetBox would ignore
+        foreign_keys = netbox_models[model].get('foreign_keys', {})
+
+        if filter_name == 'id':
+            return {str(netbox_object['id'])}
+
+        if filter_name == 'vminterface_id':
+            return {str(netbox_object.get('assigned_object_id'))} if netbox_object.get('assigned_object_type') == 'virtualization.vminterface' else set()
+
+        if filter_name == 'cluster_id' and model == 'virtualization/interfaces':
+            netbox_vm = self.objects['virtualization/virtual-machines'].get(netbox_object.get('virtual_machine'))
+            return {str(netbox_vm.get('cluster'))} if netbox_vm else set()
+
+        if filter_name == 'tag':
+            return {self.objects['extras/tags'][tag_id]['slug'] for tag_id in netbox_object.get('tags', []) if tag_id in self.objects['extras/tags']}
+
+        if filter_name.startswith('cf_'):
+            return {str(netbox_object.get('custom_fields', {}).get(filter_name[3:]))}
+
+        if filter_name.endswith('_id') and filter_name[:-3] in foreign_keys:
+            return {str(netbox_object.get(filter_name[:-3]))}
+
+        if filter_name in foreign_keys:
+            referenced_object = self.objects[foreign_keys[filter_name]].get(netbox_object.get(filter_name))
+
+            if not referenced_object:
+                return {'None', 'null'}
+
+            return {str(referenced_object['id'])} | {str(referenced_object[key]) for key in ('name', 'slug') if key in referenced_object}
+
+        if filter_name in netbox_object:
+            return {self.__index_key(filter_name, netbox_object[filter_name])} if filter_name in ('address', 'mac_address') else {str(netbox_object[filter_name])}
+
+        return None
+
+
+    def __filter(self, model, filters):
+        candidate_ids = None
+
+        for filter_name, filter_values in filters.items():
+            field = netbox_indexed_filters.get(filter_name)
+
+            if field and field in self.indexes[model]:
+                filter_ids = set()
+
+                for filter_value in filter_values:
+                    filter_ids |= self.indexes[model][field].get(self.__index_key(field, filter_value), set())
+
+                candidate_ids = filter_ids if candidate_ids is None else candidate_ids & filter_ids
+
+        netbox_objects = []
+
+        for object_id in sorted(candidate_ids) if candidate_ids is not None else list(self.objects[model]):
+            netbox_object = self.objects[model].get(object_id)
+
+            if not netbox_object:
+                continue
+
+            for filter_name, filter_values in filters.items():
+                object_values = self.__filter_values(model, netbox_object, filter_name)
+
+                if object_values is None:
+                    continue
+
+                if filter_name in ('address', 'mac_address'):
+                    filter_values = [self.__index_key(filter_name, filter_value) for filter_value in filter_values]
+
+                if not object_values & set(str(filter_value) for filter_value in filter_values):
+                    break
+            else:
+                netbox_objects.append(netbox_object)
+
+        return netbox_objects
+
+
+    def __list(self, model, path, query):
+        filters = {filter_name: filter_values for filter_name, filter_values in query.items() if not filter_name in netbox_control_parameters}
+        netbox_objects = self.__filter(model, filters)
+
+        limit = int((query.get('limit') or [self.page_size])[-1] or 0)
+        offset = int((query.get('offset') or [0])[-1] or 0)
+
+        # limit=0, like a limit above MAX_PAGE_SIZE, returns the largest page NetBox allows
+        if limit <= 0 or limit > self.max_page_size:
+            limit = self.max_page_size
+
+        next_url = None
+        previous_url = None
+
+        if offset + limit < len(netbox_objects):
+            next_url = f"{self.url}{path}?{urllib.parse.urlencode({**filters, 'limit': [limit], 'offset': [offset + limit]}, doseq=True)}"
+
+        if offset > 0:
+            previous_url = f"{self.url}{path}?{urllib.parse.urlencode({**filters, 'limit': [limit], 'offset': [max(0, offset - limit)]}, doseq=True)}"
+
+        return {'count': len(netbox_objects), 'next': next_url, 'previous': previous_url, 'results': [self.__render(model, netbox_object) for netbox_object in netbox_objects[offset:offset + limit]]}
+
+
+    def __render_nested(self, model, object_id):
+        netbox_object = self.objects[model].get(object_id)
+
+        if not netbox_object:
+            return None
+
+        nested_object = {'id': netbox_object['id'], 'url': f"{self.url}/api/{model}/{netbox_object['id']}/", 'display': self.__display(netbox_object)}
+
+        for key in ('name', 'slug', 'address', 'mac_address', 'color'):
+            if key in netbox_object:
+                nested_object[key] = netbox_object[key]
+
+        if model == 'virtualization/interfaces':
+            nested_object['virtual_machine'] = self.__render_nested('virtualization/virtual-machines', netbox_object.get('virtual_machine'))
+
+        return nested_object
+
+
+    def __display(self, netbox_object):
+        return str(netbox_object.get('name') or netbox_object.get('address') or netbox_object.get('mac_address') or netbox_object['id'])
+
+
+    def __render(self, model, netbox_object):
+        foreign_keys = netbox_models[model].get('foreign_keys', {})
+
+        rendered_object = {'id': netbox_object['id'], 'url': f"{self.url}/api/{model}/{netbox_object['id']}/", 'display': self.__display(netbox_object)}
+
+        for key, value in netbox_object.items():
+            if key == 'id':
+                continue
+
+            if key in foreign_keys:
+                rendered_object[key] = self.__render_nested(foreign_keys[key], value) if value is not None else None
+            elif key == 'tags':
+                rendered_object[key] = [self.__render_nested('extras/tags', tag_id) for tag_id in value if tag_id in self.objects['extras/tags']]
+            elif key == 'status':
+                rendered_object[key] = {'value': value, 'label': str(value).capitalize()}
+            elif isinstance(value, (dict, list)):
+                rendered_object[key] = json.loads(json.dumps(value))
+            else:
+                rendered_object[key] = value
+
+        if model == 'virtualization/virtual-machines':
+            rendered_object['primary_ip'] = rendered_object.get('primary_ip4') or rendered_object.get('primary_ip6')
+
+        if 'assigned_object_type' in netbox_object:
+            rendered_object['assigned_object'] = None
+
+            if netbox_object['assigned_object_type'] == 'virtualization.vminterface':
+                rendered_object['assigned_object'] = self.__render_nested('virtualization/interfaces', netbox_object.get('assigned_object_id'))
+
+        return rendered_object
+
+
+def merge_config(config, overrides):
+    for key, value in (overrides or {}).items():
+        if isinstance(value, dict) and isinstance(config.get(key), dict):
+            merge_config(config[key], value)
+        else:
+            config[key] = value
+
+    return config
+
+
+def get_stand_in_config(fake_proxmox, fake_netbox, overrides=None):
+    # app_config.yml for the Flask application, which netbox-discover-proxmox-vms.py reads as well
+    return merge_config({
+        'netbox_webhook_name': 'netbox-proxmox-webhook',
+        'proxmox_api_config': {'api_host': fake_proxmox.host, 'api_port': fake_proxmox.port, 'api_user': 'root@pam', 'api_token_id': 'fake', 'api_token_secret': 'fake-secret', 'verify_ssl': False},
+        'netbox_api_config': {'api_proto': 'http', 'api_host': fake_netbox.host, 'api_port': fake_netbox.port, 'api_token': 'fake-token', 'verify_ssl': False},
+        'proxmox': {'cluster_name': fake_proxmox.cluster_name},
+        'netbox': {'cluster_role': 'Proxmox', 'vm_role': 'Proxmox VM', 'lxc_role': 'Proxmox LXC'}
+    }, overrides)
+
+
+class FakeWebhookListener:
+    # The Flask application (Flask development server, in a subprocess) configured to talk to the stand-ins
+    def __init__(self, directory, app_config):
+        self.directory = directory
+        self.app_config = app_config
+        self.process = None
+        self.port = None
+        self.log_file = None
+
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}/{self.app_config['netbox_webhook_name']}/"
+
+
+    def start(self, timeout=30):
+        os.makedirs(self.directory, exist_ok=True)
+
+        with open(os.path.join(self.directory, 'app_config.yml'), 'w') as yaml_cfg:
+            yaml.safe_dump(self.app_config, yaml_cfg)
+
+        self.port = get_free_port()
+        self.log_file = open(os.path.join(self.directory, 'listener.log'), 'w')
+
+        self.process = subprocess.Popen([sys.executable, '-m', 'flask', '--app', os.path.join(app_directory, 'app.py'), 'run', '--host', '127.0.0.1', '--port', str(self.port), '--with-threads', '--no-reload', '--no-debugger'],
+                                        cwd=self.directory, stdout=self.log_file, stderr=subprocess.STDOUT)
+
+        deadline = time.monotonic() + timeout
+
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Webhook listener exited with {self.process.returncode}, see {os.path.join(self.directory, 'listener.log')}")
+
+            try:
+                if requests.get(f"{self.url}status/", timeout=1).status_code == 200:
+                    return self
+            except requests.exceptions.ConnectionError:
+                pass
+
+            time.sleep(0.1)
+
+        self.stop()
+        raise RuntimeError(f"Webhook listener did not start within {timeout} seconds, see {os.path.join(self.directory, 'listener.log')}")
+
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            # SIGINT, unlike SIGTERM, runs the atexit handlers of the Flask application (e.g. closing the webhook corpus)
+            self.process.send_signal(signal.SIGINT)
+
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+        if self.log_file:
+            self.log_file.close()
+            self.log_file = None
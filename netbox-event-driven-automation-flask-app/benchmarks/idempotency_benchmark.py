@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import argparse
+import shutil
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from helpers.idempotency import NetBoxProxmoxIdempotencyStore, get_idempotency_key
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description="Measure idempotency key lookups as the store fills up")
+    parser.add_argument("--max-entries", type=int, default=1000000, help="Size of the in-memory LRU (default: 1000000)")
+    parser.add_argument("--webhooks", type=int, default=1200000, help="Number of distinct webhooks to claim (default: 1200000)")
+    parser.add_argument("--sample", type=int, default=10000, help="Number of duplicate lookups timed at each report (default: 10000)")
+    parser.add_argument("--report-every", type=int, default=200000, help="Report after this many claimed webhooks (default: 200000)")
+    parser.add_argument("--directory", help="Directory for the SQLite store (default: a temporary directory)")
+
+    return parser.parse_args()
+
+
+def webhook_json_data(index):
+    return {'request_id': str(uuid.UUID(int=index)), 'model': 'virtualmachine', 'event': 'updated', 'data': {'id': index}, 'snapshots': {'postchange': {'id': index, 'vcpus': 2}}}
+
+
+def check_idempotency_keys():
+    # A bulk delete sends one webhook per object under one request_id, all with 'postchange: null'
+    deleted_vms = [{'request_id': 'r1', 'model': 'virtualmachine', 'event': 'deleted', 'data': {'id': vm_id}, 'snapshots': {'prechange': {'id': vm_id, 'name': f"vm-{vm_id}"}, 'postchange': None}} for vm_id in (1, 2)]
+
+    if get_idempotency_key(deleted_vms[0]) == get_idempotency_key(deleted_vms[1]):
+        sys.exit("Deletes of different objects in one request have the same idempotency key")
+
+    if get_idempotency_key(deleted_vms[0]) != get_idempotency_key(dict(deleted_vms[0])):
+        sys.exit("A redelivered webhook has a different idempotency key")
+
+
+if __name__ == "__main__":
+    args = get_arguments()
+
+    check_idempotency_keys()
+
+    directory = args.directory if args.directory else tempfile.mkdtemp(prefix='idempotency-benchmark-')
+
+    idempotency_store = NetBoxProxmoxIdempotencyStore({'idempotency': {'path': os.path.join(directory, 'idempotency.db'), 'max_entries': args.max_entries}})
+
+    print(f"{'claimed':>10} {'in LRU':>10} {'claim us':>10} {'duplicate us':>13}")
+
+    try:
+        claimed = 0
+        claim_time = 0
+
+        while claimed < args.webhooks:
+            batch_end = min(claimed + args.report_every, args.webhooks)
+
+            # keys are computed outside of the timing, only the store is measured
+            keys = [get_idempotency_key(webhook_json_data(index)) for index in range(claimed, batch_end)]
+
+            start = time.perf_counter()
+
+            for index, key in enumerate(keys):
+                idempotency_store.claim(key, str(claimed + index))
+
+            claim_time = (time.perf_counter() - start) / len(keys)
+            claimed = batch_end
+
+            # duplicates of the most recent webhooks, which are still in the LRU
+            duplicate_keys = keys[-args.sample:]
+
+            start = time.perf_counter()
+
+            for key in duplicate_keys:
+                idempotency_store.claim(key, 'duplicate')
+
+            duplicate_time = (time.perf_counter() - start) / len(duplicate_keys)
+
+            print(f"{claimed:>10} {idempotency_store.stats()['entries']:>10} {claim_time * 1000000:>10.1f} {duplicate_time * 1000000:>13.1f}")
+    finally:
+        idempotency_store.connection.close()
+
+        if not args.directory:
+            shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import argparse
+import random
+import re
+import shlex
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+import yaml
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from fake_servers import FakeProxmoxServer, FakeNetBoxServer, FakeWebhookListener, get_stand_in_config, merge_config
+
+discovery_script = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'setup', 'netbox-discover-proxmox-vms.py'))
+
+webhook_kinds = ('create', 'config', 'power', 'migrate')
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description="Measure discovery run time, webhook throughput and API calls against stand-in Proxmox and NetBox APIs")
+    parser.add_argument("--scale", type=int, action='append', help="Number of synthetic Proxmox guests, may be repeated (default: 100, 1000 and 10000)")
+    parser.add_argument("--nodes", type=int, default=3, help="Number of Proxmox nodes (default: 3)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every Proxmox and NetBox API request (default: 0)")
+    parser.add_argument("--task-duration", type=float, default=0.0, help="Seconds each Proxmox task runs (default: 0)")
+    parser.add_argument("--discovery", action='append', help="netbox-discover-proxmox-vms.py arguments of a discovery run, may be repeated (default: 'vm' and '--bulk --workers 8 vm'; 'none' skips discovery)")
+    parser.add_argument("--webhooks", type=int, default=200, help="Number of webhooks sent to the Flask application at each scale, 0 skips them (default: 200)")
+    parser.add_argument("--mix", default='create=10,config=30,power=40,migrate=20', help="Relative share of each kind of webhook (default: create=10,config=30,power=40,migrate=20)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent webhook requests (default: 8)")
+    parser.add_argument("--job-queue-workers", type=int, default=0, help="Run the Flask application with a job queue of this many workers, 0 processes webhooks synchronously (default: 0)")
+    parser.add_argument("--app-config", help="YAML file merged into the generated app_config.yml, e.g. to enable the Proxmox inventory or task tracker")
+    parser.add_argument("--timeout", type=float, default=3600, help="Seconds before a discovery run or the job queue is given up on (default: 3600)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for guests and webhooks (default: 0)")
+    parser.add_argument("--show-calls", action='store_true', default=False, help="Print the API calls of each run per endpoint")
+    parser.add_argument("--directory", help="Directory for configuration files and logs (default: a temporary directory)")
+
+    return parser.parse_args()
+
+
+def get_percentile(values, percentile):
+    if not values:
+        return 0.0
+
+    values = sorted(values)
+
+    return values[min(len(values) - 1, int(round(percentile / 100 * (len(values) - 1))))]
+
+
+def send_webhooks(url, webhooks, concurrency=1, rate=None, timeout=600):
+    # POST each webhook, with at most 'concurrency' in flight and (optionally) at no more than 'rate' per second.
+    # Returns [(status code, or exception name), latency in seconds] in the order of webhooks.
+    results = [None] * len(webhooks)
+    sessions = threading.local()
+    start_time = time.monotonic()
+
+    def send_webhook(webhook_index):
+        if rate:
+            delay = start_time + webhook_index / rate - time.monotonic()
+
+            if delay > 0:
+                time.sleep(delay)
+
+        if not hasattr(sessions, 'session'):
+            sessions.session = requests.Session()
+
+        request_start_time = time.monotonic()
+
+        try:
+            response = sessions.session.post(url, json=webhooks[webhook_index], timeout=timeout)
+            results[webhook_index] = (response.status_code, time.monotonic() - request_start_time)
+        except requests.exceptions.RequestException as e:
+            results[webhook_index] = (type(e).__name__, time.monotonic() - request_start_time)
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        list(executor.map(send_webhook, range(len(webhooks))))
+
+    return results
+
+
+def get_listener_metrics(listener):
+    # {(metric name, frozenset of labels): value} from the Prometheus text on /metrics
+    listener_metrics = {}
+
+    for line in requests.get(f"http://127.0.0.1:{listener.port}/metrics", timeout=10).text.splitlines():
+        metric_match = re.match(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})? (\S+)$', line)
+
+        if metric_match:
+            labels = frozenset(re.findall(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"', metric_match.group(2) or ''))
+            listener_metrics[(metric_match.group(1), labels)] = float(metric_match.group(3))
+
+    return listener_metrics
+
+
+def wait_for_job_queue(listener, timeout):
+    # The job queue is drained once nothing is queued and no worker is busy
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        listener_metrics = get_listener_metrics(listener)
+
+        if listener_metrics.get(('netbox_proxmox_job_queue_depth', frozenset()), 0) == 0 and listener_metrics.get(('netbox_proxmox_job_queue_workers_busy', frozenset()), 0) == 0:
+            return True
+
+        time.sleep(0.1)
+
+    return False
+
+
+def get_handler_results(listener):
+    # handler -> status code -> count, for every webhook that was processed (synchronously or as a job)
+    handler_results = {}
+
+    for (metric_name, labels), value in get_listener_metrics(listener).items():
+        if metric_name == 'netbox_proxmox_handler_duration_seconds_count':
+            labels = dict(labels)
+            handler_results.setdefault(labels['handler'], {})[labels['status_code']] = int(value)
+
+    return handler_results
+
+
+def get_snapshot(netbox_vm):
+    # NetBox snapshots carry plain values (status, ids of related objects), not nested objects
+    snapshot = {}
+
+    for key, value in netbox_vm.items():
+        if key in ('url', 'display', 'primary_ip'):
+            continue
+
+        if isinstance(value, dict) and 'value' in value and 'label' in value:
+            value = value['value']
+        elif isinstance(value, dict) and 'id' in value:
+            value = value['id']
+        elif key == 'tags':
+            value = [tag['name'] for tag in value]
+
+        snapshot[key] = value
+
+    return snapshot
+
+
+def get_webhook(event, netbox_vm, prechange_vm):
+    return {
+        'event': event,
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'model': 'virtualmachine',
+        'username': 'benchmark',
+        'request_id': str(uuid.uuid4()),
+        'data': netbox_vm,
+        'snapshots': {
+            'prechange': get_snapshot(prechange_vm) if prechange_vm else None,
+            'postchange': get_snapshot(netbox_vm) if event != 'deleted' else None
+        }
+    }
+
+
+def generate_webhooks(fake_proxmox, fake_netbox, webhook_count, mix, seed):
+    # Applies each change to the NetBox stand-in, the way a NetBox user would, and returns the webhooks NetBox would send.
+    # Every existing guest is changed at most once (while there are enough), so webhooks sent concurrently never race each other.
+    rng = random.Random(seed)
+    proxmox_nodes = sorted(fake_proxmox.nodes)
+
+    netbox_vms = fake_netbox.find_objects('virtualization/virtual-machines')
+    rng.shuffle(netbox_vms)
+
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+    webhooks = []
+    created = 0
+
+    for webhook_index in range(webhook_count):
+        kind = rng.choices(kinds, weights)[0]
+
+        if kind == 'create' or not netbox_vms:
+            vm_name = f"bench-vm-{seed}-{created:05d}"
+            created += 1
+
+            netbox_vm = fake_netbox.create_object('virtualization/virtual-machines', {
+                'name': vm_name,
+                'status': 'staged',
+                'cluster': {'name': fake_proxmox.cluster_name},
+                'role': {'name': 'Proxmox VM'},
+                'vcpus': 2.0,
+                'memory': 4096,
+                'custom_fields': {'proxmox_node': rng.choice(proxmox_nodes), 'proxmox_vm_type': 'vm', 'proxmox_vm_templates': '9000', 'proxmox_vm_storage': 'local-lvm'}
+            })
+
+            webhooks.append(get_webhook('created', netbox_vm, None))
+            continue
+
+        prechange_vm = netbox_vms[webhook_index % len(netbox_vms)] if webhook_count > len(netbox_vms) else netbox_vms.pop()
+
+        if prechange_vm['custom_fields']['proxmox_vm_type'] == 'lxc' and kind in ('config', 'migrate'):
+            kind = 'power'
+
+        if kind == 'config':
+            netbox_vm = fake_netbox.update_object('virtualization/virtual-machines', prechange_vm['id'], {'status': 'staged', 'vcpus': float(rng.choice((2, 4, 8))), 'memory': rng.choice((2048, 4096, 8192))})
+        elif kind == 'power':
+            netbox_vm = fake_netbox.update_object('virtualization/virtual-machines', prechange_vm['id'], {'status': 'offline' if prechange_vm['status']['value'] == 'active' else 'active'})
+        else:
+            target_node = rng.choice([proxmox_node for proxmox_node in proxmox_nodes if proxmox_node != prechange_vm['custom_fields']['proxmox_node']])
+            netbox_vm = fake_netbox.update_object('virtualization/virtual-machines', prechange_vm['id'], {'custom_fields': {'proxmox_node': target_node}})
+
+        if webhook_count > len(netbox_vms):
+            netbox_vms[webhook_index % len(netbox_vms)] = netbox_vm
+
+        webhooks.append(get_webhook('updated', netbox_vm, prechange_vm))
+
+    return webhooks
+
+
+def format_api_calls(api_calls):
+    return '\n'.join(f"    {count:>8} {method:<6} {endpoint}" for (method, endpoint), count in sorted(api_calls.items(), key=lambda api_call: -api_call[1]))
+
+
+def run_discovery(fake_proxmox, fake_netbox, config_file, discovery_arguments, directory, timeout):
+    fake_netbox.reset()
+    fake_proxmox.reset_api_calls()
+    fake_netbox.reset_api_calls()
+
+    with open(os.path.join(directory, 'discovery.log'), 'a') as discovery_log:
+        discovery_log.write(f"\n### {' '.join(discovery_arguments)}\n")
+        discovery_log.flush()
+
+        start = time.perf_counter()
+
+        # the state file of --incremental lands in directory
+        discovery_process = subprocess.run([sys.executable, discovery_script, *discovery_arguments, '--config', config_file],
+                                           cwd=directory, stdout=discovery_log, stderr=subprocess.STDOUT, timeout=timeout)
+
+        elapsed = time.perf_counter() - start
+
+    return {
+        'seconds': elapsed,
+        'returncode': discovery_process.returncode,
+        'netbox_vms': fake_netbox.get_object_count('virtualization/virtual-machines'),
+        'proxmox_calls': fake_proxmox.get_api_calls(),
+        'netbox_calls': fake_netbox.get_api_calls()
+    }
+
+
+def run_webhooks(fake_proxmox, fake_netbox, app_config, args, mix, directory):
+    fake_netbox.reset()
+    fake_netbox.seed_from_proxmox(fake_proxmox)
+
+    webhooks = generate_webhooks(fake_proxmox, fake_netbox, args.webhooks, mix, args.seed)
+
+    listener = FakeWebhookListener(directory, app_config).start()
+
+    try:
+        fake_proxmox.reset_api_calls()
+        fake_netbox.reset_api_calls()
+
+        start = time.perf_counter()
+        results = send_webhooks(listener.url, webhooks, args.concurrency)
+        accepted = time.perf_counter() - start
+
+        drained = wait_for_job_queue(listener, args.timeout) if args.job_queue_workers else True
+        elapsed = time.perf_counter() - start
+
+        handler_results = get_handler_results(listener)
+    finally:
+        listener.stop()
+
+    return {
+        'seconds': elapsed,
+        'accepted_seconds': accepted,
+        'drained': drained,
+        'latencies': [latency for _, latency in results],
+        'errors': len([status_code for status_code, _ in results if not isinstance(status_code, int) or status_code >= 400]),
+        'handler_results': handler_results,
+        'proxmox_calls': fake_proxmox.get_api_calls(),
+        'netbox_calls': fake_netbox.get_api_calls()
+    }
+
+
+if __name__ == "__main__":
+    args = get_arguments()
+
+    scales = args.scale if args.scale else [100, 1000, 10000]
+    discovery_runs = [shlex.split(discovery) for discovery in (args.discovery if args.discovery else ['vm', '--bulk --workers 8 vm']) if discovery != 'none']
+    mix = {kind: float(weight) for kind, weight in (kind_weight.split('=') for kind_weight in args.mix.split(','))}
+
+    if not set(mix) <= set(webhook_kinds):
+        sys.exit(f"Unknown kind of webhook in --mix, use {', '.join(webhook_kinds)}")
+
+    app_config_overrides = {}
+
+    if args.app_config:
+        with open(args.app_config) as yaml_cfg:
+            app_config_overrides = yaml.safe_load(yaml_cfg) or {}
+
+    directory = args.directory if args.directory else tempfile.mkdtemp(prefix='load-benchmark-')
+
+    print(f"{'guests':>7} {'run':<28} {'seconds':>9} {'per sec':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7} {'proxmox':>8} {'netbox':>8}")
+
+    try:
+        for scale in scales:
+            fake_proxmox = FakeProxmoxServer(args.nodes, args.latency, args.task_duration).start()
+            fake_netbox = FakeNetBoxServer(args.latency).start()
+
+            try:
+                fake_proxmox.populate(scale, args.seed)
+
+                scale_directory = os.path.join(directory, str(scale))
+                os.makedirs(scale_directory, exist_ok=True)
+
+                # webhook outcomes and the job queue depth are read from /metrics
+                app_config_settings = {'metrics': {'enabled': True}}
+
+                if args.job_queue_workers:
+                    app_config_settings['job_queue'] = {'enabled': True, 'workers': args.job_queue_workers, 'max_queue_size': max(500, args.webhooks)}
+
+                app_config = get_stand_in_config(fake_proxmox, fake_netbox, merge_config(app_config_settings, app_config_overrides))
+                config_file = os.path.join(scale_directory, 'discovery_config.yml')
+
+                with open(config_file, 'w') as yaml_cfg:
+                    yaml.safe_dump(app_config, yaml_cfg)
+
+                for discovery_arguments in discovery_runs:
+                    discovery = run_discovery(fake_proxmox, fake_netbox, config_file, discovery_arguments, scale_directory, args.timeout)
+                    run_name = f"discover {' '.join(discovery_arguments)}"
+
+                    print(f"{scale:>7} {run_name[:28]:<28} {discovery['seconds']:>9.2f} {scale / discovery['seconds']:>9.1f} {'':>8} {'':>8} {'':>8} {'' if discovery['returncode'] == 0 else 'exit ' + str(discovery['returncode']):>7} {sum(discovery['proxmox_calls'].values()):>8} {sum(discovery['netbox_calls'].values()):>8}")
+
+                    if args.show_calls:
+                        print(format_api_calls(discovery['proxmox_calls']))
+                        print(format_api_calls(discovery['netbox_calls']))
+
+                if args.webhooks:
+                    webhook_run = run_webhooks(fake_proxmox, fake_netbox, app_config, args, mix, scale_directory)
+                    run_name = f"webhooks ({'queued, ' + str(args.job_queue_workers) + ' workers' if args.job_queue_workers else 'synchronous'})"
+                    failed_handlers = sum(count for handler_result in webhook_run['handler_results'].values() for status_code, count in handler_result.items() if status_code == 'exception' or int(status_code) >= 400)
+
+                    print(f"{scale:>7} {run_name[:28]:<28} {webhook_run['seconds']:>9.2f} {args.webhooks / webhook_run['seconds']:>9.1f} {get_percentile(webhook_run['latencies'], 50) * 1000:>8.1f} {get_percentile(webhook_run['latencies'], 95) * 1000:>8.1f} {get_percentile(webhook_run['latencies'], 99) * 1000:>8.1f} {max(webhook_run['errors'], failed_handlers):>7} {sum(webhook_run['proxmox_calls'].values()):>8} {sum(webhook_run['netbox_calls'].values()):>8}")
+
+                    if not webhook_run['drained']:
+                        print(f"        job queue was not drained within {args.timeout} seconds")
+
+                    if args.show_calls:
+                        for handler, handler_result in sorted(webhook_run['handler_results'].items()):
+                            print(f"    {handler}: {', '.join(f'{count} x {status_code}' for status_code, count in sorted(handler_result.items()))}")
+
+                        print(format_api_calls(webhook_run['proxmox_calls']))
+                        print(format_api_calls(webhook_run['netbox_calls']))
+            finally:
+                fake_proxmox.stop()
+                fake_netbox.stop()
+    finally:
+        if not args.directory:
+            shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import argparse
+import random
+import statistics
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from helpers.placement import ProxmoxPlacementEngine, placement_scorers
+
+GiB = 1024 * 1024 * 1024
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description="Compare placement scorers against synthetic Proxmox cluster snapshots")
+    parser.add_argument("--nodes", type=int, default=8, help="Number of Proxmox nodes in each snapshot (default: 8)")
+    parser.add_argument("--guests", type=int, default=50, help="Number of new guests to place in each snapshot (default: 50)")
+    parser.add_argument("--snapshots", type=int, default=20, help="Number of synthetic cluster snapshots (default: 20)")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed (default: 42)")
+    parser.add_argument("--storage", default='local-lvm', help="Storage to place the guests on (default: local-lvm)")
+    parser.add_argument("--memory-headroom", type=float, default=0.1, help="Fraction of memory to keep free on each node (default: 0.1)")
+    parser.add_argument("--scorer", action='append', default=[], help="Only benchmark this scorer (can be repeated)")
+
+    return parser.parse_args()
+
+
+def generate_snapshot(rng, node_count, storage):
+    # cluster/resources-like listing of nodes and storages, with skewed load
+    node_resources = {}
+    storage_resources = {}
+
+    for node_index in range(node_count):
+        node = f"pve{node_index + 1}"
+        maxmem = rng.choice([64, 128, 256]) * GiB
+        maxcpu = rng.choice([16, 32, 64])
+        maxdisk = rng.choice([1024, 2048, 4096]) * GiB
+
+        node_resources[node] = {
+            'type': 'node',
+            'node': node,
+            'status': 'online' if rng.random() > 0.05 else 'offline',
+            'mem': int(maxmem * rng.uniform(0.1, 0.8)),
+            'maxmem': maxmem,
+            'cpu': rng.uniform(0.02, 0.7),
+            'maxcpu': maxcpu
+        }
+
+        storage_resources[(node, storage)] = {
+            'type': 'storage',
+            'node': node,
+            'storage': storage,
+            'status': 'available',
+            'disk': int(maxdisk * rng.uniform(0.1, 0.8)),
+            'maxdisk': maxdisk
+        }
+
+    return node_resources, storage_resources
+
+
+def generate_guests(rng, guest_count, storage):
+    return [{
+        'memory': rng.choice([1, 2, 4, 8, 16]) * GiB,
+        'vcpus': float(rng.choice([1, 2, 4, 8])),
+        'disk': rng.choice([16, 32, 64, 128]) * GiB,
+        'storage': storage,
+        'nodes': None
+    } for _ in range(guest_count)]
+
+
+def simulate(placement_engine, node_states, guests):
+    # Every placed guest stays reserved, as if none of the creates had finished yet
+    reservations = []
+    failures = 0
+    decision_times = []
+
+    for guest in guests:
+        start = time.perf_counter()
+        node = placement_engine.select_node(node_states, guest, reservations)
+        decision_times.append(time.perf_counter() - start)
+
+        if not node:
+            failures += 1
+            continue
+
+        reservations.append({'node': node, 'storage': guest['storage'], 'memory': guest['memory'], 'vcpus': guest['vcpus'], 'disk': guest['disk']})
+
+    memory_used = {node: node_states[node]['mem'] for node in node_states}
+
+    for reservation in reservations:
+        memory_used[reservation['node']] += reservation['memory']
+
+    memory_utilisation = [memory_used[node] / node_states[node]['maxmem'] for node in node_states]
+
+    return {
+        'failures': failures,
+        'memory_stddev': statistics.pstdev(memory_utilisation),
+        'memory_max': max(memory_utilisation),
+        'decision_times': decision_times
+    }
+
+
+if __name__ == "__main__":
+    args = get_arguments()
+
+    scorers = args.scorer if args.scorer else sorted(placement_scorers)
+
+    print(f"{args.snapshots} snapshots, {args.nodes} nodes, {args.guests} guests per snapshot")
+    print(f"{'scorer':<12} {'failures':>9} {'mem stddev':>11} {'mem max':>8} {'us/decision':>12}")
+
+    for scorer in scorers:
+        placement_engine = ProxmoxPlacementEngine({'placement': {'enabled': True, 'scorer': scorer, 'memory_headroom': args.memory_headroom}})
+
+        # same snapshots and guests for every scorer
+        rng = random.Random(args.seed)
+
+        failures = 0
+        memory_stddevs = []
+        memory_maxes = []
+        decision_times = []
+
+        for _ in range(args.snapshots):
+            node_resources, storage_resources = generate_snapshot(rng, args.nodes, args.storage)
+            guests = generate_guests(rng, args.guests, args.storage)
+
+            node_states = ProxmoxPlacementEngine.get_node_states(node_resources, storage_resources, args.storage)
+            result = simulate(placement_engine, node_states, guests)
+
+            failures += result['failures']
+            memory_stddevs.append(result['memory_stddev'])
+            memory_maxes.append(result['memory_max'])
+            decision_times.extend(result['decision_times'])
+
+        print(f"{scorer:<12} {failures:>9} {statistics.mean(memory_stddevs):>11.4f} {statistics.mean(memory_maxes):>8.3f} {statistics.mean(decision_times) * 1000000:>12.1f}")
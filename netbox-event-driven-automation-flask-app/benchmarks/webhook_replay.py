@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import argparse
+import re
+import shutil
+import tempfile
+import time
+import yaml
+
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from helpers.webhook_recorder import read_webhook_corpus
+from fake_servers import FakeAPIError, FakeProxmoxServer, FakeNetBoxServer, FakeWebhookListener, get_stand_in_config, get_fake_vm_config, get_fake_lxc_config, merge_config
+from load_benchmark import send_webhooks, wait_for_job_queue, get_handler_results, get_percentile, format_api_calls
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description="Replay a recorded webhook corpus against the Flask application backed by stand-in Proxmox and NetBox APIs")
+    parser.add_argument("corpus", nargs='+', help="Corpus files (or glob patterns) written by the webhook_recorder section of app_config.yml")
+    parser.add_argument("--rate", type=float, default=0, help="Webhooks sent per second, 0 sends as fast as --concurrency allows (default: 0)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Maximum number of webhook requests in flight (default: 8)")
+    parser.add_argument("--limit", type=int, default=0, help="Only replay the first N webhooks of the corpus, 0 replays all of them (default: 0)")
+    parser.add_argument("--job-queue-workers", type=int, default=0, help="Run the Flask application with a job queue of this many workers, 0 processes webhooks synchronously (default: 0)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every Proxmox and NetBox API request (default: 0)")
+    parser.add_argument("--task-duration", type=float, default=0.0, help="Seconds each Proxmox task runs (default: 0)")
+    parser.add_argument("--app-config", help="YAML file merged into the generated app_config.yml, e.g. to replay with the same sections enabled as in production")
+    parser.add_argument("--timeout", type=float, default=3600, help="Seconds before the job queue is given up on (default: 3600)")
+    parser.add_argument("--show-calls", action='store_true', default=False, help="Print the Proxmox and NetBox API calls per endpoint")
+    parser.add_argument("--directory", help="Directory for the generated app_config.yml and the listener logs (default: a temporary directory)")
+
+    return parser.parse_args()
+
+
+def get_disk_size(netbox_size):
+    # NetBox virtual disk sizes are in MB, Proxmox disk sizes in GB here
+    return max(1, int(netbox_size or 0) // 1000)
+
+
+def seed_stand_ins(fake_proxmox, fake_netbox, webhooks):
+    # Proxmox guests, NetBox VMs (with the ids NetBox sent) and templates as they were before the first webhook for each of them
+    cluster = fake_netbox.seed_from_proxmox(fake_proxmox)
+
+    for webhook_index, webhook_json_data in enumerate(webhooks):
+        webhook_data = webhook_json_data.get('data') or {}
+        prechange = (webhook_json_data.get('snapshots') or {}).get('prechange') or {}
+
+        if webhook_json_data.get('model') == 'virtualmachine':
+            netbox_vm = webhook_data
+            custom_fields = {**(netbox_vm.get('custom_fields') or {}), **(prechange.get('custom_fields') or {})}
+        elif webhook_json_data.get('model') == 'virtualdisk' and isinstance(webhook_data.get('virtual_machine'), dict):
+            netbox_vm = webhook_data['virtual_machine']
+            custom_fields = netbox_vm.get('custom_fields') or {}
+        else:
+            continue
+
+        if netbox_vm.get('id') is None or not netbox_vm.get('name'):
+            continue
+
+        try:
+            netbox_vm = fake_netbox.get_object('virtualization/virtual-machines', netbox_vm['id'])
+        except FakeAPIError:
+            status = prechange.get('status') or netbox_vm.get('status') or 'active'
+
+            netbox_vm = fake_netbox.create_object('virtualization/virtual-machines', {
+                'name': netbox_vm['name'],
+                'cluster': cluster['id'],
+                'status': status.get('value') if isinstance(status, dict) else status,
+                'vcpus': prechange.get('vcpus', netbox_vm.get('vcpus')),
+                'memory': prechange.get('memory', netbox_vm.get('memory')),
+                'custom_fields': {custom_field: custom_fields.get(custom_field) for custom_field in custom_fields if custom_field.startswith('proxmox_')}
+            }, netbox_vm['id'])
+
+        proxmox_node = netbox_vm['custom_fields'].get('proxmox_node')
+
+        if not proxmox_node:
+            continue
+
+        fake_proxmox.add_node(proxmox_node)
+
+        proxmox_template = str(netbox_vm['custom_fields'].get('proxmox_vm_templates') or '')
+
+        if proxmox_template.isdigit() and not int(proxmox_template) in fake_proxmox.guests:
+            template_config = get_fake_vm_config(int(proxmox_template), f"template-{proxmox_template}", webhook_index)
+            template_config['template'] = 1
+
+            fake_proxmox.add_guest(int(proxmox_template), 'qemu', proxmox_node, 'stopped', template_config)
+
+        proxmox_vmid = str(netbox_vm['custom_fields'].get('proxmox_vmid') or '')
+
+        # a VM created in NetBox only exists in Proxmox once the listener cloned it
+        if not proxmox_vmid.isdigit() or (webhook_json_data.get('model') == 'virtualmachine' and webhook_json_data.get('event') == 'created'):
+            continue
+
+        proxmox_vmid = int(proxmox_vmid)
+
+        if not proxmox_vmid in fake_proxmox.guests:
+            proxmox_status = 'running' if netbox_vm['status']['value'] == 'active' else 'stopped'
+            cores = int(float(netbox_vm.get('vcpus') or 1))
+            memory = int(netbox_vm.get('memory') or 1024)
+
+            if netbox_vm['custom_fields'].get('proxmox_vm_type') == 'lxc':
+                fake_proxmox.add_guest(proxmox_vmid, 'lxc', proxmox_node, proxmox_status, get_fake_lxc_config(proxmox_vmid, netbox_vm['name'], webhook_index, cores, memory))
+            else:
+                fake_proxmox.add_guest(proxmox_vmid, 'qemu', proxmox_node, proxmox_status, get_fake_vm_config(proxmox_vmid, netbox_vm['name'], webhook_index, cores, memory))
+
+        # disks which are resized or deleted have to exist first
+        if webhook_json_data.get('model') == 'virtualdisk' and webhook_json_data.get('event') in ('updated', 'deleted') and re.match(r'^(scsi|virtio|sata)\d+$', str(webhook_data.get('name'))):
+            guest = fake_proxmox.guests[proxmox_vmid]
+            disk_size = get_disk_size(prechange.get('size', webhook_data.get('size')))
+
+            if not webhook_data['name'] in guest['config']:
+                guest['config'][webhook_data['name']] = f"local-lvm:vm-{proxmox_vmid}-disk-{len(guest['config'])},size={disk_size}G"
+
+
+def print_latencies(title, latencies):
+    print(f"{title[:32]:<32} {len(latencies):>8} {get_percentile(latencies, 50) * 1000:>9.1f} {get_percentile(latencies, 95) * 1000:>9.1f} {get_percentile(latencies, 99) * 1000:>9.1f} {max(latencies) * 1000 if latencies else 0:>9.1f}")
+
+
+if __name__ == "__main__":
+    args = get_arguments()
+
+    corpus_records = read_webhook_corpus(args.corpus)
+
+    if args.limit:
+        corpus_records = corpus_records[:args.limit]
+
+    if not corpus_records:
+        sys.exit(f"No webhooks in {', '.join(args.corpus)}")
+
+    webhooks = [corpus_record['webhook'] for corpus_record in corpus_records]
+
+    app_config_overrides = {}
+
+    if args.app_config:
+        with open(args.app_config) as yaml_cfg:
+            app_config_overrides = yaml.safe_load(yaml_cfg) or {}
+
+    directory = args.directory if args.directory else tempfile.mkdtemp(prefix='webhook-replay-')
+
+    fake_proxmox = FakeProxmoxServer(1, args.latency, args.task_duration).start()
+    fake_netbox = FakeNetBoxServer(args.latency).start()
+
+    try:
+        seed_stand_ins(fake_proxmox, fake_netbox, webhooks)
+
+        # webhook outcomes and the job queue depth are read from /metrics; the replay itself is never recorded again
+        app_config_settings = {'metrics': {'enabled': True}}
+
+        if args.job_queue_workers:
+            app_config_settings['job_queue'] = {'enabled': True, 'workers': args.job_queue_workers, 'max_queue_size': max(500, len(webhooks))}
+
+        app_config = get_stand_in_config(fake_proxmox, fake_netbox, merge_config(merge_config(app_config_settings, app_config_overrides), {'webhook_recorder': {'enabled': False}}))
+
+        listener = FakeWebhookListener(directory, app_config).start()
+
+        try:
+            fake_proxmox.reset_api_calls()
+            fake_netbox.reset_api_calls()
+
+            recorded_seconds = corpus_records[-1]['received'] - corpus_records[0]['received']
+            print(f"Replaying {len(webhooks)} webhooks (recorded over {recorded_seconds:.1f}s) with {args.concurrency} in flight{f' at {args.rate:g}/s' if args.rate else ''}")
+
+            start = time.perf_counter()
+            results = send_webhooks(listener.url, webhooks, args.concurrency, args.rate)
+            sent = time.perf_counter() - start
+
+            drained = wait_for_job_queue(listener, args.timeout) if args.job_queue_workers else True
+            elapsed = time.perf_counter() - start
+
+            handler_results = get_handler_results(listener)
+        finally:
+            listener.stop()
+
+        latencies_by_event = {}
+
+        for webhook_json_data, (_, latency) in zip(webhooks, results):
+            latencies_by_event.setdefault(f"{webhook_json_data.get('model')} {webhook_json_data.get('event')}", []).append(latency)
+
+        print()
+        print(f"{'webhooks':<32} {'count':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+        print_latencies('all', [latency for _, latency in results])
+
+        for model_event, latencies in sorted(latencies_by_event.items()):
+            print_latencies(f"  {model_event}", latencies)
+
+        print()
+        print(f"sent in {sent:.2f}s ({len(webhooks) / sent:.1f} webhooks/s), processed in {elapsed:.2f}s ({len(webhooks) / elapsed:.1f} webhooks/s)")
+
+        if not drained:
+            print(f"job queue was not drained within {args.timeout} seconds")
+
+        # the listener answers synchronous webhooks with HTTP 200 and the handler status code in the body, so
+        # handler results (from /metrics) tell how each webhook went, response codes tell whether it was accepted
+        print()
+        print('responses:', ', '.join(f"{count} x {status_code}" for status_code, count in sorted(Counter(str(status_code) for status_code, _ in results).items())))
+
+        handler_errors = Counter()
+
+        for handler, handler_result in handler_results.items():
+            for status_code, count in handler_result.items():
+                if status_code == 'exception' or int(status_code) >= 400:
+                    handler_errors[f"{handler} {status_code}"] += count
+
+        print(f"{'handler errors':<32} {'count':>8}")
+
+        for handler_error, count in handler_errors.most_common():
+            print(f"  {handler_error[:30]:<30} {count:>8}")
+
+        unhandled = len(webhooks) - sum(count for handler_result in handler_results.values() for count in handler_result.values())
+
+        if unhandled:
+            print(f"  {'no handler (model / event)':<30} {unhandled:>8}")
+
+        if args.show_calls:
+            print()
+            print(format_api_calls(fake_proxmox.get_api_calls()))
+            print(format_api_calls(fake_netbox.get_api_calls()))
+    finally:
+        fake_proxmox.stop()
+        fake_netbox.stop()
+
+        if not args.directory:
+            shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+import sys
+import argparse
+import json
+import yaml
+
+from helpers.bulk_migration import NetBoxProxmoxBulkMigration
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description="Migrate (or drain a node of) Proxmox VMs and LXCs, and update NetBox in one batch")
+    parser.add_argument("--debug", action='store_true', default=False, help="Enable debug (verbose) output")
+    parser.add_argument("--config", default='app_config.yml', help="YAML file containing the Flask application configuration (default: app_config.yml)")
+    parser.add_argument("--source-node", help="Migrate every VM and LXC away from this Proxmox node")
+    parser.add_argument("--vmid", type=int, action='append', default=[], help="Migrate this VM or LXC (can be repeated)")
+    parser.add_argument("--target-node", action='append', default=[], help="Only migrate to this Proxmox node (can be repeated)")
+    parser.add_argument("--exclude-node", action='append', default=[], help="Never migrate to this Proxmox node (can be repeated)")
+    parser.add_argument("--max-parallel", type=int, help="Maximum number of migrations at the same time")
+    parser.add_argument("--max-per-source", type=int, help="Maximum number of migrations at the same time away from one node")
+    parser.add_argument("--max-per-target", type=int, help="Maximum number of migrations at the same time to one node")
+    parser.add_argument("--dry-run", action='store_true', default=False, help="Only show the migration plan")
+
+    args = parser.parse_args()
+
+    if not args.source_node and not args.vmid:
+        parser.error("one of --source-node or --vmid is required")
+
+    return args
+
+
+if __name__ == "__main__":
+    args = get_arguments()
+
+    with open(args.config) as yaml_cfg:
+        try:
+            app_config = yaml.safe_load(yaml_cfg)
+        except yaml.YAMLError as exc:
+            print(exc)
+            sys.exit(1)
+
+    migration_request = {
+        'source_node': args.source_node,
+        'vmids': args.vmid,
+        'target_nodes': args.target_node,
+        'exclude_nodes': args.exclude_node
+    }
+
+    for limit in ('max_parallel', 'max_per_source', 'max_per_target'):
+        if getattr(args, limit) is not None:
+            migration_request[limit] = getattr(args, limit)
+
+    bulk_migration = NetBoxProxmoxBulkMigration(app_config, migration_request, args.debug)
+    bulk_migration.plan()
+
+    migration_status = bulk_migration.status()
+
+    for migration in migration_status['migrations']:
+        print(f"{migration['type']} {migration['vmid']} ({migration['name']}): {migration['source_node']} -> {migration['target_node']}")
+
+    for unplaced in migration_status['unplaced']:
+        print(f"{unplaced['vmid']} ({unplaced.get('name')}): not migrated, {unplaced['reason']}")
+
+    if args.dry_run:
+        sys.exit(0)
+
+    migration_status = bulk_migration.run()
+
+    if args.debug:
+        print(json.dumps(migration_status, indent=4))
+
+    for migration in migration_status['migrations']:
+        print(f"{migration['type']} {migration['vmid']} ({migration['name']}): {migration['status']}, {migration['result']}")
+
+    print(f"Updated proxmox_node for {migration_status['netbox_updated']} VMs in NetBox")
+
+    sys.exit(0 if migration_status['status'] == 'finished' else 1)
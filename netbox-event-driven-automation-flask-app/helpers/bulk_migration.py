@@ -0,0 +1,244 @@
+import logging
+import threading
+import uuid
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from . client_registry import get_client_registry
+from . netbox_proxmox import NetBoxProxmoxHelperMigrate
+
+logger = logging.getLogger('netbox-proxmox-webhook-listener.bulk_migration')
+
+bulk_migrations = OrderedDict()
+bulk_migrations_lock = threading.Lock()
+
+
+def start_bulk_migration(cfg_data, migration_request, debug=False):
+    bulk_migration = NetBoxProxmoxBulkMigration(cfg_data, migration_request, debug)
+    bulk_migration.plan()
+
+    with bulk_migrations_lock:
+        bulk_migrations[bulk_migration.migration_id] = bulk_migration
+
+        # only keep the last 100 bulk migrations around for lookups
+        while len(bulk_migrations) > 100:
+            bulk_migrations.popitem(last=False)
+
+    if not migration_request.get('dry_run', False):
+        threading.Thread(target=bulk_migration.run, name=f"bulk-migration-{bulk_migration.migration_id}", daemon=True).start()
+
+    return bulk_migration.status()
+
+
+def get_bulk_migration(migration_id):
+    with bulk_migrations_lock:
+        bulk_migration = bulk_migrations.get(migration_id)
+
+    return bulk_migration.status() if bulk_migration else None
+
+
+class NetBoxProxmoxBulkMigration:
+    def __init__(self, cfg_data, migration_request, debug=False):
+        self.debug = debug
+        self.cfg_data = cfg_data
+
+        bulk_migration_config = cfg_data.get('bulk_migration', {}) or {}
+
+        # limits in the request win over the ones in app_config.yml
+        self.bulk_migration_config = {
+            'max_parallel': int(migration_request.get('max_parallel', bulk_migration_config.get('max_parallel', 4))),
+            'max_per_source': int(migration_request.get('max_per_source', bulk_migration_config.get('max_per_source', 2))),
+            'max_per_target': int(migration_request.get('max_per_target', bulk_migration_config.get('max_per_target', 2))),
+            'memory_headroom': float(migration_request.get('memory_headroom', bulk_migration_config.get('memory_headroom', 0.1)))
+        }
+
+        for limit in ('max_parallel', 'max_per_source', 'max_per_target'):
+            if self.bulk_migration_config[limit] < 1:
+                raise ValueError(f"'{limit}' must be at least 1")
+
+        self.source_node = migration_request.get('source_node')
+        self.vmids = [int(vmid) for vmid in migration_request.get('vmids', []) or []]
+        self.target_nodes = migration_request.get('target_nodes', []) or []
+        self.exclude_nodes = migration_request.get('exclude_nodes', []) or []
+
+        if not self.source_node and not self.vmids:
+            raise ValueError("Either 'source_node' or 'vmids' is required")
+
+        client_registry = get_client_registry(cfg_data, debug)
+
+        self.proxmox_api = client_registry.proxmox_api()
+        self.netbox_api = client_registry.netbox_api()
+
+        self.migration_id = str(uuid.uuid4())
+        self.state = 'planned'
+        self.created = datetime.now().isoformat()
+        self.finished = None
+
+        self.migrations = []
+        self.unplaced = []
+        self.netbox_updated = 0
+
+        self.lock = threading.Lock()
+
+
+    def status(self):
+        with self.lock:
+            return {
+                'id': self.migration_id,
+                'status': self.state,
+                'created': self.created,
+                'finished': self.finished,
+                'source_node': self.source_node,
+                'limits': self.bulk_migration_config,
+                'migrations': [dict(migration) for migration in self.migrations],
+                'unplaced': list(self.unplaced),
+                'netbox_updated': self.netbox_updated
+            }
+
+
+    def plan(self):
+        # One cluster/resources call gives us the load of every node and the size of every guest
+        proxmox_resources = self.proxmox_api.cluster.resources.get()
+
+        nodes = {}
+
+        for proxmox_resource in proxmox_resources:
+            if proxmox_resource.get('type') == 'node' and proxmox_resource.get('status') == 'online':
+                nodes[proxmox_resource['node']] = {
+                    'mem': int(proxmox_resource.get('mem', 0) or 0),
+                    'maxmem': int(proxmox_resource.get('maxmem', 0) or 0),
+                    'cpu': float(proxmox_resource.get('cpu', 0) or 0) * int(proxmox_resource.get('maxcpu', 0) or 0),
+                    'maxcpu': int(proxmox_resource.get('maxcpu', 0) or 0)
+                }
+
+        guests = []
+
+        for proxmox_resource in proxmox_resources:
+            if not proxmox_resource.get('type') in ('qemu', 'lxc') or proxmox_resource.get('template'):
+                continue
+
+            if self.vmids:
+                if int(proxmox_resource['vmid']) in self.vmids:
+                    guests.append(proxmox_resource)
+            elif proxmox_resource.get('node') == self.source_node:
+                guests.append(proxmox_resource)
+
+        missing_vmids = set(self.vmids) - set(int(guest['vmid']) for guest in guests)
+
+        for missing_vmid in sorted(missing_vmids):
+            self.unplaced.append({'vmid': missing_vmid, 'reason': 'Not found in Proxmox'})
+
+        candidate_nodes = [node for node in nodes if node != self.source_node and not node in self.exclude_nodes and (not self.target_nodes or node in self.target_nodes)]
+
+        # Place the largest guests first, each one on the node with the most free memory (then the least CPU load) after placement
+        for guest in sorted(guests, key=lambda guest: int(guest.get('maxmem', 0) or 0), reverse=True):
+            guest_mem = int(guest.get('maxmem', 0) or 0)
+            guest_cpu = float(guest.get('cpu', 0) or 0) * int(guest.get('maxcpu', 0) or 0)
+
+            fitting_nodes = [node for node in candidate_nodes if node != guest['node'] and nodes[node]['mem'] + guest_mem <= nodes[node]['maxmem'] * (1 - self.bulk_migration_config['memory_headroom'])]
+
+            if not fitting_nodes:
+                self.unplaced.append({'vmid': int(guest['vmid']), 'name': guest.get('name'), 'reason': f"No target node with {guest_mem} bytes of free memory"})
+                continue
+
+            target_node = max(fitting_nodes, key=lambda node: ((nodes[node]['maxmem'] - nodes[node]['mem'] - guest_mem) / max(nodes[node]['maxmem'], 1), -(nodes[node]['cpu'] + guest_cpu) / max(nodes[node]['maxcpu'], 1)))
+
+            nodes[target_node]['mem'] += guest_mem
+            nodes[target_node]['cpu'] += guest_cpu
+
+            if guest['node'] in nodes:
+                nodes[guest['node']]['mem'] -= guest_mem
+                nodes[guest['node']]['cpu'] -= guest_cpu
+
+            self.migrations.append({
+                'vmid': int(guest['vmid']),
+                'name': guest.get('name'),
+                'type': guest['type'],
+                'source_node': guest['node'],
+                'target_node': target_node,
+                'status': 'planned',
+                'result': None
+            })
+
+        if self.debug:
+            print(f"BULK MIGRATION {self.migration_id} PLAN", self.migrations, self.unplaced)
+
+
+    def __migrate(self, migration, source_semaphore, target_semaphore):
+        # source before target, for every migration, so that no two migrations wait on each other
+        with source_semaphore, target_semaphore:
+            with self.lock:
+                migration['status'] = 'running'
+
+            try:
+                pxmx_migrate = NetBoxProxmoxHelperMigrate(self.cfg_data, None, self.debug)
+
+                if migration['type'] == 'lxc':
+                    status_code, result = pxmx_migrate.migrate_lxc(migration['vmid'], migration['source_node'], migration['target_node'])
+                else:
+                    status_code, result = pxmx_migrate.migrate_vm(migration['vmid'], migration['source_node'], migration['target_node'])
+            except Exception as e:
+                logger.exception(f"Bulk migration {self.migration_id}: migrating {migration['vmid']} failed")
+                status_code, result = 500, {'result': f"{type(e).__name__}: {e}"}
+
+            with self.lock:
+                migration['status'] = 'finished' if status_code < 400 else 'failed'
+                migration['result'] = result['result']
+
+
+    def __update_netbox(self):
+        migrated_guests = {migration['vmid']: migration for migration in self.migrations if migration['status'] == 'finished'}
+
+        if not migrated_guests:
+            return
+
+        netbox_vm_updates = []
+
+        for netbox_vm in self.netbox_api.virtualization.virtual_machines.filter(cf_proxmox_vmid=[str(vmid) for vmid in migrated_guests]):
+            netbox_vm_custom_fields = dict(netbox_vm)['custom_fields']
+
+            try:
+                migration = migrated_guests.get(int(netbox_vm_custom_fields.get('proxmox_vmid')))
+            except (TypeError, ValueError):
+                continue
+
+            # the same vmid can exist in other clusters, so only touch VMs on the source node
+            if migration and netbox_vm_custom_fields.get('proxmox_node') == migration['source_node']:
+                netbox_vm_updates.append({'id': netbox_vm.id, 'custom_fields': {'proxmox_node': migration['target_node']}})
+
+        if netbox_vm_updates:
+            self.netbox_api.virtualization.virtual_machines.update(netbox_vm_updates)
+
+        with self.lock:
+            self.netbox_updated = len(netbox_vm_updates)
+
+
+    def run(self):
+        with self.lock:
+            self.state = 'running'
+
+        source_semaphores = {node: threading.BoundedSemaphore(self.bulk_migration_config['max_per_source']) for node in set(migration['source_node'] for migration in self.migrations)}
+        target_semaphores = {node: threading.BoundedSemaphore(self.bulk_migration_config['max_per_target']) for node in set(migration['target_node'] for migration in self.migrations)}
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.bulk_migration_config['max_parallel'], thread_name_prefix=f"bulk-migration-{self.migration_id[:8]}") as executor:
+                for migration in self.migrations:
+                    executor.submit(self.__migrate, migration, source_semaphores[migration['source_node']], target_semaphores[migration['target_node']])
+
+            # one batch update in NetBox once every migration is done
+            self.__update_netbox()
+
+            state = 'finished' if all(migration['status'] == 'finished' for migration in self.migrations) else 'failed'
+        except Exception as e:
+            logger.exception(f"Bulk migration {self.migration_id} failed: {e}")
+            state = 'failed'
+
+        with self.lock:
+            self.state = state
+            self.finished = datetime.now().isoformat()
+
+        logger.info(f"Bulk migration {self.migration_id} {state}: {len(self.migrations)} migrations, {len(self.unplaced)} unplaced, {self.netbox_updated} NetBox VMs updated")
+
+        return self.status()
@@ -0,0 +1,147 @@
+import logging
+import pynetbox
+import threading
+import time
+
+from proxmoxer import ProxmoxAPI
+
+from . metrics import InstrumentedHTTPAdapter
+
+logger = logging.getLogger('netbox-proxmox-webhook-listener.client_registry')
+
+client_registries = {}
+client_registries_lock = threading.Lock()
+
+
+def get_client_registry(cfg_data, debug=False):
+    registry_key = (
+        cfg_data['proxmox_api_config']['api_host'],
+        cfg_data['proxmox_api_config']['api_port'],
+        cfg_data['proxmox_api_config']['api_user'],
+        cfg_data['proxmox_api_config']['api_token_id'],
+        cfg_data['netbox_api_config']['api_proto'],
+        cfg_data['netbox_api_config']['api_host'],
+        cfg_data['netbox_api_config']['api_port']
+    )
+
+    with client_registries_lock:
+        if not registry_key in client_registries:
+            client_registries[registry_key] = NetBoxProxmoxClientRegistry(cfg_data, debug)
+
+        return client_registries[registry_key]
+
+
+class NetBoxProxmoxClientRegistry:
+    def __init__(self, cfg_data, debug=False):
+        self.debug = debug
+        self.cfg_data = cfg_data
+
+        client_pool_config = cfg_data.get('client_pool', {}) or {}
+        job_queue_config = cfg_data.get('job_queue', {}) or {}
+
+        self.client_pool_config = {
+            'scope': client_pool_config.get('scope', 'process'),
+            'pool_connections': int(client_pool_config.get('pool_connections', 10)),
+            'pool_maxsize': int(client_pool_config.get('pool_maxsize', max(10, int(job_queue_config.get('workers', 4))))),
+            'max_retries': int(client_pool_config.get('max_retries', 0)),
+            'health_check_interval': float(client_pool_config.get('health_check_interval', 60))
+        }
+
+        if not self.client_pool_config['scope'] in ('process', 'thread'):
+            raise ValueError(f"Unknown client_pool.scope '{self.client_pool_config['scope']}' (choices are: process, thread)")
+
+        self.lock = threading.Lock()
+        self.process_clients = {}
+        self.thread_clients = threading.local()
+
+
+    def __mount_connection_pool(self, http_session, api_name):
+        # keep-alive connection pool shared by every helper borrowing this client; it also counts and times each API call
+        http_adapter = InstrumentedHTTPAdapter(
+            api_name,
+            pool_connections=self.client_pool_config['pool_connections'],
+            pool_maxsize=self.client_pool_config['pool_maxsize'],
+            max_retries=self.client_pool_config['max_retries']
+        )
+
+        http_session.mount('https://', http_adapter)
+        http_session.mount('http://', http_adapter)
+
+
+    def __build_proxmox_api(self):
+        proxmox_api_config = self.cfg_data['proxmox_api_config']
+
+        proxmox_api = ProxmoxAPI(
+            proxmox_api_config['api_host'],
+            port=proxmox_api_config['api_port'],
+            user=proxmox_api_config['api_user'],
+            token_name=proxmox_api_config['api_token_id'],
+            token_value=proxmox_api_config['api_token_secret'],
+            verify_ssl=False
+        )
+
+        self.__mount_connection_pool(proxmox_api._store['session'], 'proxmox')
+
+        return proxmox_api
+
+
+    def __build_netbox_api(self):
+        netbox_api_config = self.cfg_data['netbox_api_config']
+
+        nb_url = f"{netbox_api_config['api_proto']}://{netbox_api_config['api_host']}:{netbox_api_config['api_port']}"
+
+        netbox_api = pynetbox.api(
+            nb_url,
+            token=netbox_api_config['api_token']
+        )
+
+        netbox_api.http_session.verify = netbox_api_config['verify_ssl']
+        self.__mount_connection_pool(netbox_api.http_session, 'netbox')
+
+        return netbox_api
+
+
+    def __check_health(self, client_type, client):
+        if client_type == 'proxmox':
+            client.version.get()
+        else:
+            client.status()
+
+
+    def __borrow(self, client_type, build_client):
+        if self.client_pool_config['scope'] == 'thread':
+            clients = self.thread_clients.__dict__
+        else:
+            clients = self.process_clients
+
+        with self.lock:
+            if not client_type in clients:
+                if self.debug:
+                    print(f"CLIENT REGISTRY: building {client_type} client ({self.client_pool_config['scope']} scope)")
+
+                clients[client_type] = {'client': build_client(), 'last_health_check': time.monotonic()}
+
+            client_entry = clients[client_type]
+
+            if time.monotonic() - client_entry['last_health_check'] < self.client_pool_config['health_check_interval']:
+                return client_entry['client']
+
+            client_entry['last_health_check'] = time.monotonic()
+
+        try:
+            self.__check_health(client_type, client_entry['client'])
+        except Exception as e:
+            logger.warning(f"Health check for {client_type} client failed, rebuilding client: {e}")
+
+            with self.lock:
+                client_entry['client'] = build_client()
+
+        return client_entry['client']
+
+
+    def proxmox_api(self):
+        return self.__borrow('proxmox', self.__build_proxmox_api)
+
+
+    def netbox_api(self):
+        return self.__borrow('netbox', self.__build_netbox_api)
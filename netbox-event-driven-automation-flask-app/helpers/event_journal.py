@@ -0,0 +1,242 @@
+import atexit
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+from concurrent.futures import Future
+
+logger = logging.getLogger('netbox-proxmox-webhook-listener.event_journal')
+
+event_journals = {}
+event_journals_lock = threading.Lock()
+
+
+class NetBoxProxmoxEventJournalError(Exception):
+    pass
+
+
+def get_event_journal(cfg_data, debug=False):
+    event_journal_config = cfg_data.get('event_journal', {}) or {}
+
+    if not event_journal_config.get('enabled', False):
+        return None
+
+    # One journal (and one writer thread) per journal file
+    event_journal_key = event_journal_config.get('path', 'event_journal.db')
+
+    with event_journals_lock:
+        if not event_journal_key in event_journals:
+            event_journals[event_journal_key] = NetBoxProxmoxEventJournal(cfg_data, debug)
+
+        return event_journals[event_journal_key]
+
+
+class NetBoxProxmoxEventJournal:
+    # states after which an event is never replayed
+    done_states = ('finished', 'failed', 'coalesced')
+
+    def __init__(self, cfg_data, debug=False):
+        self.debug = debug
+
+        event_journal_config = cfg_data.get('event_journal', {}) or {}
+
+        self.event_journal_config = {
+            'path': event_journal_config.get('path', 'event_journal.db'),
+            'synchronous': str(event_journal_config.get('synchronous', 'full')).upper(),
+            'group_commit_interval': float(event_journal_config.get('group_commit_interval', 0)),
+            'group_commit_max_events': int(event_journal_config.get('group_commit_max_events', 256)),
+            'retention': float(event_journal_config.get('retention', 86400)),
+            'max_replays': int(event_journal_config.get('max_replays', 3))
+        }
+
+        if not self.event_journal_config['synchronous'] in ('FULL', 'NORMAL', 'OFF'):
+            raise ValueError(f"'event_journal.synchronous' must be full, normal or off, not {self.event_journal_config['synchronous'].lower()}")
+
+        if self.event_journal_config['group_commit_max_events'] < 1:
+            raise ValueError("'event_journal.group_commit_max_events' must be at least 1")
+
+        if self.event_journal_config['max_replays'] < 0:
+            raise ValueError("'event_journal.max_replays' must be at least 0")
+
+        connection = self.__connect()
+
+        with connection:
+            connection.execute("""CREATE TABLE IF NOT EXISTS event_journal (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                event_id TEXT NOT NULL,
+                request_id TEXT,
+                model TEXT,
+                event TEXT,
+                state TEXT NOT NULL,
+                status_code INTEGER,
+                payload TEXT,
+                result TEXT,
+                recorded REAL NOT NULL
+            )""")
+            connection.execute("CREATE INDEX IF NOT EXISTS event_journal_event_id ON event_journal (event_id)")
+
+        self.__prune(connection)
+        connection.close()
+
+        self.appended = 0
+        self.commits = 0
+
+        # (record, future or None); None as record stops the writer
+        self.pending = queue.Queue()
+
+        self.writer_thread = threading.Thread(target=self.__writer, name='netbox-proxmox-event-journal', daemon=True)
+        self.writer_thread.start()
+
+        atexit.register(self.close)
+
+
+    def __connect(self):
+        connection = sqlite3.connect(self.event_journal_config['path'], timeout=30, check_same_thread=False)
+
+        # WAL: appends do not block readers, and a commit is one sequential write (plus fsync) to the WAL file
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(f"PRAGMA synchronous={self.event_journal_config['synchronous']}")
+
+        return connection
+
+
+    def __prune(self, connection):
+        # Drop events which are done and older than 'retention' seconds, so that the journal does not grow forever
+        cutoff = time.time() - self.event_journal_config['retention']
+
+        with connection:
+            pruned = connection.execute(f"""DELETE FROM event_journal WHERE event_id IN (
+                SELECT event_id FROM event_journal WHERE state IN ({','.join('?' * len(self.done_states))}) AND recorded < ?
+            )""", (*self.done_states, cutoff)).rowcount
+
+        if pruned:
+            logger.info(f"Pruned {pruned} event journal records older than {self.event_journal_config['retention']} seconds")
+
+
+    def __writer(self):
+        connection = self.__connect()
+
+        while True:
+            batch = [self.pending.get()]
+
+            # Group commit: collect more records for up to 'group_commit_interval' seconds, then write them in one transaction (one fsync)
+            deadline = time.monotonic() + self.event_journal_config['group_commit_interval']
+
+            while batch[-1][0] is not None and len(batch) < self.event_journal_config['group_commit_max_events']:
+                try:
+                    batch.append(self.pending.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+
+            stop = batch[-1][0] is None
+            records = [record for record, committed in batch if record is not None]
+
+            error = None
+
+            if records:
+                try:
+                    with connection:
+                        connection.executemany("INSERT INTO event_journal (event_id, request_id, model, event, state, status_code, payload, result, recorded) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", records)
+
+                    self.appended += len(records)
+                    self.commits += 1
+                except sqlite3.Error as e:
+                    logger.exception(f"Unable to write {len(records)} records to the event journal")
+                    error = NetBoxProxmoxEventJournalError(f"Unable to write to the event journal: {e}")
+
+            for record, committed in batch:
+                if committed:
+                    if error:
+                        committed.set_exception(error)
+                    else:
+                        committed.set_result(True)
+
+            if stop:
+                connection.close()
+                return
+
+
+    def __append(self, event_id, state, webhook_json_data=None, status_code=None, result=None, wait=False):
+        webhook_json_data = webhook_json_data or {}
+
+        record = (
+            event_id,
+            webhook_json_data.get('request_id'),
+            webhook_json_data.get('model'),
+            webhook_json_data.get('event'),
+            state,
+            status_code,
+            json.dumps(webhook_json_data) if webhook_json_data else None,
+            json.dumps(result, default=str) if result is not None else None,
+            time.time()
+        )
+
+        if not self.writer_thread.is_alive():
+            raise NetBoxProxmoxEventJournalError("The event journal is closed")
+
+        committed = Future()
+
+        self.pending.put((record, committed))
+
+        if wait:
+            committed.result()
+
+        return committed
+
+
+    def accept(self, event_id, webhook_json_data, wait=True):
+        # By default only returns once the event is on disk, so that an accepted webhook survives a restart
+        committed = self.__append(event_id, 'accepted', webhook_json_data, wait=wait)
+
+        if self.debug:
+            print(f"JOURNALED EVENT {event_id} ({webhook_json_data.get('model')} {webhook_json_data.get('event')})")
+
+        return committed
+
+
+    def transition(self, event_id, state, status_code=None, result=None, wait=False):
+        # Returns a future which is done once the transition is on disk
+        return self.__append(event_id, state, status_code=status_code, result=result, wait=wait)
+
+
+    def get_unfinished(self):
+        # [(event_id, webhook_json_data)] of events accepted but never finished, in the order they were accepted.
+        # An event accepted more than once (its payload was updated by coalescing) is replayed with its latest payload.
+        connection = self.__connect()
+
+        try:
+            # every replay appends a 'replayed' record, so those count the earlier attempts
+            rows = connection.execute(f"""SELECT event_id, payload, (
+                SELECT COUNT(*) FROM event_journal AS replays WHERE replays.event_id = event_journal.event_id AND replays.state = 'replayed'
+            ) FROM event_journal WHERE state = 'accepted' AND event_id NOT IN (
+                SELECT event_id FROM event_journal WHERE state IN ({','.join('?' * len(self.done_states))})
+            ) ORDER BY seq""", self.done_states).fetchall()
+        finally:
+            connection.close()
+
+        unfinished_events = {}
+        replays = {}
+
+        for event_id, payload, event_replays in rows:
+            unfinished_events[event_id] = json.loads(payload)
+            replays[event_id] = event_replays
+
+        for event_id in list(unfinished_events):
+            # A webhook which takes the Flask application down every time it runs is given up on, instead of being replayed on every restart
+            if replays[event_id] >= self.event_journal_config['max_replays']:
+                logger.warning(f"Not replaying event {event_id} ({unfinished_events[event_id].get('model')} {unfinished_events[event_id].get('event')}) again, it was replayed {replays[event_id]} times without finishing")
+                self.transition(event_id, 'failed', 500, {'result': f"Gave up after {replays[event_id]} replays"})
+
+                del unfinished_events[event_id]
+
+        return list(unfinished_events.items())
+
+
+    def close(self):
+        # Write out whatever is still pending and stop the writer
+        if self.writer_thread.is_alive():
+            self.pending.put((None, None))
+            self.writer_thread.join(timeout=10)
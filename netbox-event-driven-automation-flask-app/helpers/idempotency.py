@@ -0,0 +1,194 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from collections import OrderedDict
+
+logger = logging.getLogger('netbox-proxmox-webhook-listener.idempotency')
+
+idempotency_stores = {}
+idempotency_stores_lock = threading.Lock()
+
+
+def get_idempotency_store(cfg_data, debug=False):
+    idempotency_config = cfg_data.get('idempotency', {}) or {}
+
+    if not idempotency_config.get('enabled', False):
+        return None
+
+    idempotency_store_key = idempotency_config.get('path', 'idempotency.db')
+
+    with idempotency_stores_lock:
+        if not idempotency_store_key in idempotency_stores:
+            idempotency_stores[idempotency_store_key] = NetBoxProxmoxIdempotencyStore(cfg_data, debug)
+
+        return idempotency_stores[idempotency_store_key]
+
+
+def get_idempotency_key(webhook_json_data):
+    # NetBox sends the same request_id with every webhook for one change (e.g. a VM and its disks, or every object of
+    # a bulk delete), so model, event, object id and snapshot are part of the key.  Deletes have no postchange
+    # snapshot, so their prechange snapshot is used instead.  Webhooks without a request_id are never treated as duplicates.
+    if not webhook_json_data.get('request_id'):
+        return None
+
+    snapshots = webhook_json_data.get('snapshots') or {}
+    snapshot = snapshots.get('postchange') if snapshots.get('postchange') is not None else snapshots.get('prechange')
+    snapshot_digest = hashlib.sha256(json.dumps(snapshot, sort_keys=True, default=str).encode()).hexdigest()
+
+    object_id = (webhook_json_data.get('data') or {}).get('id')
+
+    # 16 bytes are plenty to tell webhooks apart, and keep a million keys small
+    return hashlib.sha256(f"{webhook_json_data['request_id']}|{webhook_json_data.get('model')}|{webhook_json_data.get('event')}|{object_id}|{snapshot_digest}".encode()).digest()[:16]
+
+
+class NetBoxProxmoxIdempotencyStore:
+    def __init__(self, cfg_data, debug=False):
+        self.debug = debug
+
+        idempotency_config = cfg_data.get('idempotency', {}) or {}
+
+        self.idempotency_config = {
+            'path': idempotency_config.get('path', 'idempotency.db'),
+            'max_entries': int(idempotency_config.get('max_entries', 1000000)),
+            'retention': float(idempotency_config.get('retention', 86400)),
+            'in_flight_ttl': float(idempotency_config.get('in_flight_ttl', 3600)),
+            'retry_failed': bool(idempotency_config.get('retry_failed', False))
+        }
+
+        if self.idempotency_config['max_entries'] < 1:
+            raise ValueError("'idempotency.max_entries' must be at least 1")
+
+        # key -> {'job_id', 'status_code', 'result', 'claimed'}, least recently used first.  Keys which fell out of it
+        # are still found in the SQLite store until 'retention' runs out.
+        self.entries = OrderedDict()
+
+        # job id -> [keys] of entries which are still in flight
+        self.in_flight = {}
+
+        self.lock = threading.Lock()
+
+        self.connection = sqlite3.connect(self.idempotency_config['path'], timeout=30, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+
+        with self.connection:
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS idempotency (
+                key BLOB PRIMARY KEY,
+                job_id TEXT,
+                status_code INTEGER,
+                result TEXT,
+                claimed REAL NOT NULL
+            ) WITHOUT ROWID""")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS idempotency_job_id ON idempotency (job_id)")
+
+            pruned = self.connection.execute("DELETE FROM idempotency WHERE claimed < ?", (time.time() - self.idempotency_config['retention'],)).rowcount
+
+        if pruned:
+            logger.info(f"Pruned {pruned} idempotency keys older than {self.idempotency_config['retention']} seconds")
+
+        self.hits = 0
+        self.misses = 0
+
+
+    def __remember(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+
+        if entry['status_code'] is None and entry['job_id']:
+            self.in_flight.setdefault(entry['job_id'], []).append(key)
+
+        while len(self.entries) > self.idempotency_config['max_entries']:
+            self.entries.popitem(last=False)
+
+
+    def __forget_in_flight(self, key, job_id):
+        if job_id in self.in_flight:
+            self.in_flight[job_id] = [in_flight_key for in_flight_key in self.in_flight[job_id] if in_flight_key != key]
+
+            if not self.in_flight[job_id]:
+                del self.in_flight[job_id]
+
+
+    def __get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        row = self.connection.execute("SELECT job_id, status_code, result, claimed FROM idempotency WHERE key = ?", (key,)).fetchone()
+
+        if not row:
+            return None
+
+        entry = {'job_id': row[0], 'status_code': row[1], 'result': json.loads(row[2]) if row[2] else None, 'claimed': row[3]}
+
+        self.__remember(key, entry)
+
+        return entry
+
+
+    def claim(self, key, job_id):
+        # Returns None when the webhook is new (and from now on in flight as job_id), or the entry of the earlier webhook
+        with self.lock:
+            entry = self.__get(key)
+
+            # an in-flight entry whose job never finished (e.g. lost in a restart without the event journal) is given up on
+            if entry and (entry['status_code'] is not None or time.time() - entry['claimed'] < self.idempotency_config['in_flight_ttl']):
+                self.hits += 1
+                return dict(entry)
+
+            self.misses += 1
+
+            if entry:
+                self.__forget_in_flight(key, entry['job_id'])
+
+            entry = {'job_id': job_id, 'status_code': None, 'result': None, 'claimed': time.time()}
+
+            with self.connection:
+                self.connection.execute("INSERT OR REPLACE INTO idempotency (key, job_id, status_code, result, claimed) VALUES (?, ?, NULL, NULL, ?)", (key, job_id, entry['claimed']))
+
+            self.__remember(key, entry)
+
+        return None
+
+
+    def release(self, key):
+        # The webhook was claimed, but never accepted (e.g. the job queue was full): let a retry through
+        with self.lock:
+            entry = self.entries.pop(key, None)
+
+            if entry:
+                self.__forget_in_flight(key, entry['job_id'])
+
+            with self.connection:
+                self.connection.execute("DELETE FROM idempotency WHERE key = ?", (key,))
+
+
+    def complete(self, job_ids, status_code, result):
+        # Store the result for every webhook which was run (or merged into) one of job_ids
+        forget = status_code >= 400 and self.idempotency_config['retry_failed']
+
+        with self.lock:
+            for job_id in job_ids:
+                for key in self.in_flight.pop(job_id, []):
+                    if forget:
+                        self.entries.pop(key, None)
+                    elif key in self.entries:
+                        self.entries[key].update(status_code=status_code, result=result)
+
+            with self.connection:
+                if forget:
+                    self.connection.executemany("DELETE FROM idempotency WHERE job_id = ?", [(job_id,) for job_id in job_ids])
+                else:
+                    self.connection.executemany("UPDATE idempotency SET status_code = ?, result = ? WHERE job_id = ?", [(status_code, json.dumps(result, default=str), job_id) for job_id in job_ids])
+
+        if self.debug:
+            print(f"IDEMPOTENCY: completed jobs {job_ids} with {status_code}")
+
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'in_flight': sum(len(keys) for keys in self.in_flight.values()), 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,300 @@
+import logging
+import queue
+import threading
+import time
+import uuid
+
+from collections import OrderedDict, deque
+from datetime import datetime
+
+from . metrics import metrics
+
+logger = logging.getLogger('netbox-proxmox-webhook-listener.job_queue')
+
+
+class NetBoxProxmoxJobQueueFull(Exception):
+    pass
+
+
+def get_lane_key(webhook_json_data):
+    # Events for one NetBox VM, and for the disks, interfaces and IP addresses attached to it, share a lane
+    webhook_data = webhook_json_data.get('data') or {}
+    model = webhook_json_data.get('model')
+
+    if model == 'virtualmachine' and webhook_data.get('id') is not None:
+        return f"virtualmachine:{webhook_data['id']}"
+
+    if isinstance(webhook_data.get('virtual_machine'), dict) and webhook_data['virtual_machine'].get('id') is not None:
+        return f"virtualmachine:{webhook_data['virtual_machine']['id']}"
+
+    assigned_object = webhook_data.get('assigned_object')
+
+    if isinstance(assigned_object, dict) and isinstance(assigned_object.get('virtual_machine'), dict) and assigned_object['virtual_machine'].get('id') is not None:
+        return f"virtualmachine:{assigned_object['virtual_machine']['id']}"
+
+    if webhook_data.get('id') is not None:
+        return f"{model}:{webhook_data['id']}"
+
+    return f"request:{webhook_json_data.get('request_id')}"
+
+
+def get_dispatch_fields(webhook_json_data):
+    webhook_data = webhook_json_data.get('data') or {}
+    status = webhook_data.get('status')
+
+    return (status.get('value') if isinstance(status, dict) else status, (webhook_data.get('custom_fields') or {}).get('proxmox_node'))
+
+
+class NetBoxProxmoxJobQueue:
+    def __init__(self, handler, cfg_data, debug=False, event_journal=None, on_finished=None):
+        self.debug = debug
+        self.handler = handler
+        self.event_journal = event_journal
+
+        # on_finished(job) is called with a copy of each finished (or failed) job
+        self.on_finished = on_finished
+
+        job_queue_config = cfg_data.get('job_queue', {}) or {}
+
+        self.job_queue_config = {
+            'workers': int(job_queue_config.get('workers', 4)),
+            'max_queue_size': int(job_queue_config.get('max_queue_size', 500)),
+            'max_finished_jobs': int(job_queue_config.get('max_finished_jobs', 1000)),
+            'coalesce_window': float(job_queue_config.get('coalesce_window', 0))
+        }
+
+        if self.job_queue_config['workers'] < 1:
+            raise ValueError("'job_queue.workers' must be at least 1")
+
+        self.jobs = OrderedDict()
+        self.jobs_lock = threading.Lock()
+
+        # One ordered lane (deque of pending jobs) per lane key.  A lane key is only ever in ready_lanes,
+        # or held by one worker, at a time: jobs in a lane run strictly in order, different lanes run in parallel.
+        self.lanes = {}
+        self.lanes_lock = threading.Lock()
+        self.pending_job_count = 0
+
+        self.ready_lanes = queue.Queue()
+        self.worker_threads = []
+
+        for worker_id in range(self.job_queue_config['workers']):
+            worker_thread = threading.Thread(target=self.__worker, name=f"netbox-proxmox-job-worker-{worker_id}", daemon=True)
+            worker_thread.start()
+            self.worker_threads.append(worker_thread)
+
+
+    def submit(self, webhook_json_data, job_id=None, replayed=False):
+        job = {
+            'id': job_id or str(uuid.uuid4()),
+            'status': 'queued',
+            'model': webhook_json_data.get('model'),
+            'event': webhook_json_data.get('event'),
+            'request_id': webhook_json_data.get('request_id'),
+            'lane': get_lane_key(webhook_json_data),
+            'coalesced_events': 0,
+            'coalesced_job_ids': [],
+            'submitted': datetime.now().isoformat(),
+            'started': None,
+            'finished': None,
+            'status_code': None,
+            'result': None
+        }
+
+        if self.event_journal and not replayed:
+            if self.queue_depth() >= self.job_queue_config['max_queue_size']:
+                raise NetBoxProxmoxJobQueueFull(f"Job queue is full ({self.job_queue_config['max_queue_size']} pending jobs)")
+
+            # on disk before the job is queued; outside of the lanes lock, so that concurrent webhooks share one commit
+            self.event_journal.accept(job['id'], webhook_json_data)
+
+        with self.lanes_lock:
+            # replayed jobs were accepted before the restart, so they are never rejected
+            if self.pending_job_count >= self.job_queue_config['max_queue_size'] and not replayed:
+                if self.event_journal:
+                    self.event_journal.transition(job['id'], 'failed', 503, {'result': 'Job queue is full'})
+
+                raise NetBoxProxmoxJobQueueFull(f"Job queue is full ({self.job_queue_config['max_queue_size']} pending jobs)")
+
+            with self.jobs_lock:
+                self.jobs[job['id']] = job
+
+            coalesced_job_id = self.__coalesce(job['lane'], webhook_json_data)
+
+            if coalesced_job_id:
+                if self.event_journal:
+                    # Journal records are written in order, so this event is never marked as merged before the merged payload of the pending job is on disk
+                    self.event_journal.accept(coalesced_job_id, self.lanes[job['lane']][-1][1], wait=False)
+                    self.event_journal.transition(job['id'], 'coalesced', result={'result': f"Merged into job {coalesced_job_id}"})
+
+                with self.jobs_lock:
+                    del self.jobs[job['id']]
+                    self.jobs[coalesced_job_id]['coalesced_events'] += 1
+                    self.jobs[coalesced_job_id]['coalesced_job_ids'].append(job['id'])
+
+                    coalesced_job = dict(self.jobs[coalesced_job_id])
+
+                if self.debug:
+                    print(f"COALESCED {job['model']} {job['event']} into pending job {coalesced_job_id} in lane {job['lane']}")
+
+                return coalesced_job
+
+            self.pending_job_count += 1
+
+            if job['lane'] in self.lanes:
+                # lane is already queued or running; its worker picks this job up after the earlier ones
+                self.lanes[job['lane']].append((job['id'], webhook_json_data))
+            else:
+                self.lanes[job['lane']] = deque([(job['id'], webhook_json_data)])
+
+                if self.job_queue_config['coalesce_window'] > 0 and webhook_json_data.get('event') == 'updated':
+                    # hold the lane back for the coalescing window, so that a burst of updates is merged into this job
+                    coalesce_timer = threading.Timer(self.job_queue_config['coalesce_window'], self.ready_lanes.put, args=(job['lane'],))
+                    coalesce_timer.daemon = True
+                    coalesce_timer.start()
+                else:
+                    self.ready_lanes.put(job['lane'])
+
+        if self.debug:
+            print(f"QUEUED JOB {job['id']} ({job['model']} {job['event']}) in lane {job['lane']}")
+
+        return dict(job)
+
+
+    def __coalesce(self, lane_key, webhook_json_data):
+        # Merge an 'updated' event into the last pending job of its lane, if that is an 'updated' event for the same object.
+        # The latest data wins, the earliest prechange snapshot is kept, so the merged job sees every change of the burst.
+        if self.job_queue_config['coalesce_window'] <= 0 or webhook_json_data.get('event') != 'updated':
+            return None
+
+        if not lane_key in self.lanes or not self.lanes[lane_key]:
+            return None
+
+        pending_job_id, pending_webhook_json_data = self.lanes[lane_key][-1]
+
+        if pending_webhook_json_data.get('event') != 'updated' or pending_webhook_json_data.get('model') != webhook_json_data.get('model'):
+            return None
+
+        if (pending_webhook_json_data.get('data') or {}).get('id') != (webhook_json_data.get('data') or {}).get('id'):
+            return None
+
+        # The handler picks its branch (config change, start / stop, migration) from status and proxmox_node,
+        # so events which change either of them run as jobs of their own, or one of the branches would be lost
+        if get_dispatch_fields(pending_webhook_json_data) != get_dispatch_fields(webhook_json_data):
+            return None
+
+        merged_webhook_json_data = dict(webhook_json_data)
+        merged_webhook_json_data['snapshots'] = dict(webhook_json_data.get('snapshots') or {})
+
+        if 'prechange' in (pending_webhook_json_data.get('snapshots') or {}):
+            merged_webhook_json_data['snapshots']['prechange'] = pending_webhook_json_data['snapshots']['prechange']
+
+        self.lanes[lane_key][-1] = (pending_job_id, merged_webhook_json_data)
+
+        return pending_job_id
+
+
+    def replay(self):
+        # Re-queue the jobs which were accepted, but never finished, before the last restart
+        if not self.event_journal:
+            return []
+
+        replayed_jobs = []
+
+        for job_id, webhook_json_data in self.event_journal.get_unfinished():
+            self.event_journal.transition(job_id, 'replayed')
+            replayed_jobs.append(self.submit(webhook_json_data, job_id, replayed=True))
+
+        if replayed_jobs:
+            logger.info(f"Replayed {len(replayed_jobs)} unfinished jobs from the event journal")
+
+        return replayed_jobs
+
+
+    def get_job(self, job_id):
+        with self.jobs_lock:
+            if not job_id in self.jobs:
+                return None
+
+            return dict(self.jobs[job_id])
+
+
+    def queue_depth(self):
+        with self.lanes_lock:
+            return self.pending_job_count
+
+
+    def active_lanes(self):
+        with self.lanes_lock:
+            return len(self.lanes)
+
+
+    def __update_job(self, job_id, **job_settings):
+        # Returns a copy of the updated job, taken in the same critical section, so that a concurrent prune cannot lose it
+        with self.jobs_lock:
+            if not job_id in self.jobs:
+                return {'id': job_id, **job_settings}
+
+            self.jobs[job_id].update(job_settings)
+
+            return dict(self.jobs[job_id])
+
+
+    def __prune_finished_jobs(self):
+        # Only keep the last 'max_finished_jobs' finished jobs around for /jobs/<id> lookups
+        with self.jobs_lock:
+            finished_job_ids = [job_id for job_id in self.jobs if self.jobs[job_id]['status'] in ('finished', 'failed')]
+
+            for job_id in finished_job_ids[:max(0, len(finished_job_ids) - self.job_queue_config['max_finished_jobs'])]:
+                del self.jobs[job_id]
+
+
+    def __worker(self):
+        while True:
+            lane_key = self.ready_lanes.get()
+
+            with self.lanes_lock:
+                job_id, webhook_json_data = self.lanes[lane_key].popleft()
+                self.pending_job_count -= 1
+
+            self.__update_job(job_id, status='running', started=datetime.now().isoformat())
+
+            if self.event_journal:
+                self.event_journal.transition(job_id, 'running')
+
+            start_time = time.monotonic()
+            metrics.workers_busy.inc()
+
+            try:
+                status_code, result = self.handler(webhook_json_data)
+                job_status = 'finished' if status_code < 400 else 'failed'
+            except Exception as e:
+                logger.exception(f"Job {job_id} raised an exception")
+                metrics.errors.inc(source='job_queue', exception=type(e).__name__)
+                status_code, result = 500, {'result': f"{type(e).__name__}: {e}"}
+                job_status = 'failed'
+            finally:
+                metrics.workers_busy.dec()
+
+            if self.debug:
+                print(f"JOB {job_id} {job_status} in {time.monotonic() - start_time:.2f}s", status_code, result)
+
+            finished_job = self.__update_job(job_id, status=job_status, finished=datetime.now().isoformat(), status_code=status_code, result=result)
+
+            if self.event_journal:
+                self.event_journal.transition(job_id, job_status, status_code, result)
+
+            if self.on_finished:
+                try:
+                    self.on_finished(finished_job)
+                except Exception:
+                    logger.exception(f"on_finished for job {job_id} raised an exception")
+
+            # only after on_finished, which gets the job even if it is pruned right away
+            self.__prune_finished_jobs()
+
+            with self.lanes_lock:
+                if self.lanes[lane_key]:
+                    self.ready_lanes.put(lane_key)
+                else:
+                    del self.lanes[lane_key]
@@ -0,0 +1,286 @@
+import functools
+import logging
+import re
+import threading
+import time
+
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger('netbox-proxmox-webhook-listener.metrics')
+
+# seconds; Proxmox operations (clones, migrations) take minutes, API calls take milliseconds
+handler_buckets = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+api_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def escape_label_value(label_value):
+    return str(label_value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(labels):
+    labels = list(labels)
+
+    if not labels:
+        return ''
+
+    return '{' + ','.join(f'{label_name}="{escape_label_value(label_value)}"' for label_name, label_value in labels) + '}'
+
+
+class NetBoxProxmoxMetric:
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+
+        # label values -> value
+        self.values = {}
+        self.lock = threading.Lock()
+
+
+    def label_values(self, labels):
+        return tuple(str(labels.get(label_name, '')) for label_name in self.label_names)
+
+
+class NetBoxProxmoxCounter(NetBoxProxmoxMetric):
+    metric_type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        label_values = self.label_values(labels)
+
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+
+    def render(self):
+        with self.lock:
+            values = dict(self.values)
+
+        return [f"{self.name}_total{format_labels(zip(self.label_names, label_values))} {value}" for label_values, value in sorted(values.items())]
+
+
+class NetBoxProxmoxGauge(NetBoxProxmoxMetric):
+    metric_type = 'gauge'
+
+    def __init__(self, name, documentation, label_names=(), callback=None):
+        super().__init__(name, documentation, label_names)
+
+        # callback() returns the value of a gauge without labels when it is rendered
+        self.callback = callback
+
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.label_values(labels)] = value
+
+
+    def inc(self, amount=1, **labels):
+        label_values = self.label_values(labels)
+
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+    def render(self):
+        if self.callback:
+            try:
+                return [f"{self.name} {self.callback()}"]
+            except Exception as e:
+                logger.warning(f"Unable to read gauge {self.name}: {e}")
+                return []
+
+        with self.lock:
+            values = dict(self.values)
+
+        return [f"{self.name}{format_labels(zip(self.label_names, label_values))} {value}" for label_values, value in sorted(values.items())]
+
+
+class NetBoxProxmoxHistogram(NetBoxProxmoxMetric):
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, label_names=(), buckets=handler_buckets):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+
+    def observe(self, value, **labels):
+        label_values = self.label_values(labels)
+
+        with self.lock:
+            if not label_values in self.values:
+                # [count per bucket (not cumulative)..., +Inf], sum
+                self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+
+            bucket_counts, _ = self.values[label_values]
+
+            for bucket_index, bucket in enumerate(self.buckets):
+                if value <= bucket:
+                    bucket_counts[bucket_index] += 1
+                    break
+            else:
+                bucket_counts[-1] += 1
+
+            self.values[label_values][1] += value
+
+
+    def render(self):
+        with self.lock:
+            values = {label_values: (list(bucket_counts), total) for label_values, (bucket_counts, total) in self.values.items()}
+
+        lines = []
+
+        for label_values, (bucket_counts, total) in sorted(values.items()):
+            labels = list(zip(self.label_names, label_values))
+            cumulative_count = 0
+
+            for bucket, bucket_count in zip(self.buckets + ('+Inf',), bucket_counts):
+                cumulative_count += bucket_count
+                lines.append(f"{self.name}_bucket{format_labels(labels + [('le', bucket)])} {cumulative_count}")
+
+            lines.append(f"{self.name}_count{format_labels(labels)} {cumulative_count}")
+            lines.append(f"{self.name}_sum{format_labels(labels)} {total}")
+
+        return lines
+
+
+class NetBoxProxmoxMetrics:
+    def __init__(self):
+        self.enabled = False
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+        self.webhooks = self.counter('netbox_proxmox_webhooks', 'Webhooks received from NetBox', ('model', 'event', 'status_code'))
+        self.webhook_duplicates = self.counter('netbox_proxmox_webhook_duplicates', 'Webhooks answered from the idempotency store', ('model', 'event'))
+        self.status_requests = self.counter('netbox_proxmox_status_requests', 'Requests to the /status/ endpoint')
+        self.handler_duration = self.histogram('netbox_proxmox_handler_duration_seconds', 'Time spent in each webhook handler', ('handler', 'status_code'), handler_buckets)
+        self.api_requests = self.counter('netbox_proxmox_api_requests', 'Proxmox and NetBox API requests', ('api', 'method', 'endpoint', 'status_code'))
+        self.api_duration = self.histogram('netbox_proxmox_api_request_duration_seconds', 'Proxmox and NetBox API request latency', ('api', 'method', 'endpoint'), api_buckets)
+        self.task_wait_duration = self.histogram('netbox_proxmox_task_wait_duration_seconds', 'Time spent waiting for Proxmox tasks', ('operation', 'exitstatus'), handler_buckets)
+        self.errors = self.counter('netbox_proxmox_errors', 'Errors by where they were raised and exception type', ('source', 'exception'))
+        self.workers_busy = self.gauge('netbox_proxmox_job_queue_workers_busy', 'Job queue workers running a job')
+
+
+    def __register(self, metric):
+        with self.lock:
+            if not metric.name in self.metrics:
+                self.metrics[metric.name] = metric
+
+            return self.metrics[metric.name]
+
+
+    def counter(self, name, documentation, label_names=()):
+        return self.__register(NetBoxProxmoxCounter(name, documentation, label_names))
+
+
+    def gauge(self, name, documentation, label_names=(), callback=None):
+        return self.__register(NetBoxProxmoxGauge(name, documentation, label_names, callback))
+
+
+    def histogram(self, name, documentation, label_names=(), buckets=handler_buckets):
+        return self.__register(NetBoxProxmoxHistogram(name, documentation, label_names, buckets))
+
+
+    def render(self):
+        # Prometheus text exposition format (version 0.0.4)
+        with self.lock:
+            metrics = list(self.metrics.values())
+
+        lines = []
+
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.metric_type}")
+            lines.extend(metric.render())
+
+        return '\n'.join(lines) + '\n'
+
+
+metrics = NetBoxProxmoxMetrics()
+
+
+def get_metrics(cfg_data=None):
+    # One set of metrics per process; app.py turns them on with the 'metrics' section of app_config.yml
+    if cfg_data is not None:
+        metrics.enabled = bool((cfg_data.get('metrics', {}) or {}).get('enabled', False))
+
+    return metrics
+
+
+def instrument_handler(handler):
+    # Times a webhook handler (e.g. proxmox_clone_vm), labelled with its name without the 'proxmox_' prefix
+    handler_name = re.sub(r'^proxmox_', '', handler.__name__)
+
+    @functools.wraps(handler)
+    def instrumented_handler(*args, **kwargs):
+        if not metrics.enabled:
+            return handler(*args, **kwargs)
+
+        start_time = time.monotonic()
+
+        try:
+            results = handler(*args, **kwargs)
+        except Exception as e:
+            metrics.handler_duration.observe(time.monotonic() - start_time, handler=handler_name, status_code='exception')
+            metrics.errors.inc(source=handler_name, exception=type(e).__name__)
+            raise
+
+        metrics.handler_duration.observe(time.monotonic() - start_time, handler=handler_name, status_code=results[0])
+
+        if results[0] >= 400:
+            metrics.errors.inc(source=handler_name, exception=f"http_{results[0]}")
+
+        return results
+
+    return instrumented_handler
+
+
+def get_endpoint_template(path):
+    # /api2/json/nodes/pve1/qemu/100/status/current -> /api2/json/nodes/{node}/qemu/{vmid}/status/current, so that
+    # endpoints are labelled per kind of call and not per node, guest or object
+    path_parts = path.split('?')[0].rstrip('/').split('/')
+
+    for path_index in range(1, len(path_parts)):
+        previous_part = path_parts[path_index - 1]
+
+        if previous_part == 'nodes':
+            path_parts[path_index] = '{node}'
+        elif previous_part in ('qemu', 'lxc') and path_parts[path_index].isdigit():
+            path_parts[path_index] = '{vmid}'
+        elif previous_part == 'storage' and path_parts[path_index - 2] == '{node}':
+            path_parts[path_index] = '{storage}'
+        elif previous_part == 'tasks' and path_parts[path_index].startswith('UPID'):
+            path_parts[path_index] = '{upid}'
+        elif path_parts[path_index].isdigit():
+            path_parts[path_index] = '{id}'
+
+    return '/'.join(path_parts) or '/'
+
+
+class InstrumentedHTTPAdapter(HTTPAdapter):
+    # Counts and times every request of a Proxmox or NetBox client, so that every helper method is covered
+    def __init__(self, api_name, *args, **kwargs):
+        self.api_name = api_name
+        super().__init__(*args, **kwargs)
+
+
+    def send(self, request, *args, **kwargs):
+        if not metrics.enabled:
+            return super().send(request, *args, **kwargs)
+
+        endpoint = get_endpoint_template(request.path_url)
+        start_time = time.monotonic()
+
+        try:
+            response = super().send(request, *args, **kwargs)
+        except Exception as e:
+            metrics.api_requests.inc(api=self.api_name, method=request.method, endpoint=endpoint, status_code='error')
+            metrics.errors.inc(source=f"{self.api_name}_api", exception=type(e).__name__)
+            raise
+
+        metrics.api_duration.observe(time.monotonic() - start_time, api=self.api_name, method=request.method, endpoint=endpoint)
+        metrics.api_requests.inc(api=self.api_name, method=request.method, endpoint=endpoint, status_code=response.status_code)
+
+        return response
@@ -8,6 +8,17 @@ import urllib
 from proxmoxer import ProxmoxAPI, ResourceException
 import logging
 
+from . client_registry import get_client_registry
+from . proxmox_task_waiter import ProxmoxTaskWaiter, ProxmoxTaskTimeout, ProxmoxTaskFailed
+from . proxmox_task_tracker import get_proxmox_task_tracker
+from . warm_pool import get_warm_pool
+from . proxmox_storage_cache import get_proxmox_storage_cache
+from . vmid_allocator import get_proxmox_vmid_allocator
+from . proxmox_inventory import get_proxmox_inventory
+from . metrics import instrument_handler
+
+logger = logging.getLogger('netbox-proxmox-webhook-listener.netbox_proxmox')
+
 class NetBoxProxmoxHelper:
     def __init__(self, cfg_data, proxmox_node, debug=False):
         self.debug = debug
@@ -30,23 +41,26 @@ class NetBoxProxmoxHelper:
             'verify_ssl': cfg_data['proxmox_api_config']['verify_ssl']
         }
 
-        self.proxmox_api = ProxmoxAPI(
-            self.proxmox_api_config['api_host'],
-            port=self.proxmox_api_config['api_port'],
-            user=self.proxmox_api_config['api_user'],
-            token_name=self.proxmox_api_config['api_token_id'],
-            token_value=self.proxmox_api_config['api_token_secret'],
-            verify_ssl=False
-        )
+        # Borrow process-wide (or per-thread) clients instead of opening new sessions for every webhook
+        client_registry = get_client_registry(cfg_data, debug)
 
-        nb_url = f"{self.netbox_api_config['api_proto']}://{self.netbox_api_config['api_host']}:{self.netbox_api_config['api_port']}"
+        self.proxmox_api = client_registry.proxmox_api()
+        self.netbox_api = client_registry.netbox_api()
 
-        self.netbox_api = pynetbox.api(
-            nb_url,
-            token=self.netbox_api_config['api_token']
-        )
+        self.task_waiter = ProxmoxTaskWaiter(self.proxmox_api, cfg_data, debug, get_proxmox_task_tracker(self.proxmox_api, cfg_data, debug))
 
-        self.netbox_api.http_session.verify = self.netbox_api_config['verify_ssl']
+        self.warm_pool = get_warm_pool(cfg_data, debug)
+
+        clone_config = cfg_data.get('proxmox_clone', {}) or {}
+
+        self.clone_config = {
+            'mode': clone_config.get('mode', 'full'),
+            'linked_templates': [str(template) for template in clone_config.get('linked_templates', []) or []]
+        }
+
+        self.storage_cache = get_proxmox_storage_cache(cfg_data, debug)
+        self.vmid_allocator = get_proxmox_vmid_allocator(cfg_data, debug)
+        self.inventory = get_proxmox_inventory(cfg_data, debug)
 
 
     def json_data_check_proxmox_vmid_exists(self, json_in):
@@ -82,36 +96,72 @@ class NetBoxProxmoxHelper:
             raise pynetbox.core.query.RequestError(e)
     
 
-    def proxmox_job_get_status(self, job_in):
-        try:
-            while True:
-                task_status = self.proxmox_api.nodes(self.proxmox_api_config['node']).tasks(job_in).status.get()
+    def proxmox_task_progress(self, upid, task_log_lines):
+        if task_log_lines:
+            logger.info(f"Proxmox task {upid}: {task_log_lines[-1]}")
 
-                if self.debug:
-                    print("RAW TASK STATUS", task_status)
 
-                if 'status' in task_status and task_status['status'] == 'stopped':
-                    break
-        except ResourceException as e:
-            raise ResourceException(e)
+    def proxmox_job_get_status(self, job_in, operation='default'):
+        exitstatus = self.task_waiter.wait(job_in, self.proxmox_api_config['node'], operation, progress_callback=self.proxmox_task_progress)
+
+        # 'WARNINGS: n' means that the task completed, but logged warnings
+        if exitstatus != 'OK' and not str(exitstatus).startswith('WARNINGS'):
+            raise ProxmoxTaskFailed(job_in, exitstatus)
+
+        return exitstatus
         
 
+    def netbox_get_tenant_slug(self, json_in):
+        tenant = json_in['data'].get('tenant')
+
+        if isinstance(tenant, dict):
+            return tenant.get('slug')
+
+        return tenant
+
+
+    def proxmox_allocate_vmid(self, json_in):
+        if self.vmid_allocator:
+            return self.vmid_allocator.allocate(self.proxmox_api, self.netbox_get_tenant_slug(json_in))
+
+        return self.proxmox_api.cluster.get('nextid')
+
+
+    def proxmox_create_guest(self, json_in, vmid, vmid_allocated, create_guest, operation):
+        # create_guest(vmid) starts the clone / create task.  A vmid handed out by the allocator which Proxmox
+        # rejects (because it was taken outside of this process) is replaced by a fresh one.
+        max_attempts = self.vmid_allocator.vmid_allocator_config['max_attempts'] if self.vmid_allocator and vmid_allocated else 1
+
+        for attempt in range(1, max_attempts + 1):
+            try:
+                self.proxmox_job_get_status(create_guest(vmid), operation)
+                break
+            except ResourceException as e:
+                if attempt < max_attempts and re.search(r'already\s+exists', str(e.content)):
+                    self.vmid_allocator.reject(self.proxmox_api, vmid)
+                    vmid = self.vmid_allocator.allocate(self.proxmox_api, self.netbox_get_tenant_slug(json_in))
+                    continue
+
+                if self.vmid_allocator and vmid_allocated:
+                    self.vmid_allocator.release(vmid)
+
+                raise
+
+        if self.vmid_allocator:
+            self.vmid_allocator.commit(vmid)
+
+        self.inventory.invalidate()
+
+        return vmid
+
+
     def generate_gateway_from_ip_address(self, ip_address, last_quad=1):
         return '.'.join(''.join(ip_address.split('/')[0]).split('.')[0:3]) + f'.{last_quad}'
     
 
     def proxmox_get_vms(self):
         try:
-            proxmox_vms = {}
-
-            proxmox_get_vms = self.proxmox_api.cluster.resources.get(type='vm')
-
-            for proxmox_vm in proxmox_get_vms:
-                if not proxmox_vm['template']:
-                    if 'name' in proxmox_vm and 'vmid' in proxmox_vm:
-                        proxmox_vms[proxmox_vm['name']] = proxmox_vm['vmid']
-
-            return proxmox_vms
+            return self.inventory.get_vmids_by_name(self.proxmox_api)
         except ResourceException as e:
             return ResourceException(e)
         
@@ -153,7 +203,7 @@ class NetBoxProxmoxHelperVM(NetBoxProxmoxHelper):
                 memory=int(memory)
             )
 
-            self.proxmox_job_get_status(update_vm_vcpus)
+            self.proxmox_job_get_status(update_vm_vcpus, 'config')
 
             return 200, {'result': f"Updated CPU information (cpus: {vcpus}, memory: {memory}) for {vmid}"}
         except ResourceException as e:
@@ -171,7 +221,71 @@ class NetBoxProxmoxHelperVM(NetBoxProxmoxHelper):
         return vm_exists
  
  
+    def proxmox_claim_warm_pool_vm(self, json_in):
+        # The pooled VM is renamed and loses its pool markers in a single config write
+        pooled_vm_id = self.warm_pool.acquire(json_in['data']['custom_fields']['proxmox_vm_templates'], json_in['data']['custom_fields']['proxmox_vm_storage'], json_in['data']['custom_fields']['proxmox_node'], json_in['data']['name'])
+
+        if not pooled_vm_id:
+            return None
+
+        self.inventory.invalidate()
+
+        if self.debug:
+            print(f"Claimed warm pool VM {pooled_vm_id} for {json_in['data']['name']}")
+
+        return pooled_vm_id
+
+
+    def proxmox_vm_clone_mode(self, json_in):
+        # The NetBox custom field wins over the per-template and default settings in app_config.yml
+        clone_mode = json_in['data']['custom_fields'].get('proxmox_vm_clone_mode')
+
+        if clone_mode in ('full', 'linked'):
+            return clone_mode
+
+        if str(json_in['data']['custom_fields']['proxmox_vm_templates']) in self.clone_config['linked_templates']:
+            return 'linked'
+
+        return self.clone_config['mode']
+
+
+    def proxmox_get_template_node(self, template_vmid):
+        # the template may live on another node than the one the VM is created on
+        return self.inventory.get_node_of_vmid(self.proxmox_api, template_vmid) or self.proxmox_api_config['node']
+
+
+    def proxmox_linked_clone_unsupported_reason(self, template_vmid, storage_id, target_node):
+        template_node = self.proxmox_get_template_node(template_vmid)
+        template_config = self.proxmox_api.nodes(template_node).qemu(template_vmid).config.get()
+
+        for config_key in sorted(template_config):
+            if not re.match(r'^(scsi|virtio|sata|ide|efidisk|tpmstate)\d+$', config_key):
+                continue
+
+            volume = str(template_config[config_key]).split(',')[0]
+
+            if 'media=cdrom' in str(template_config[config_key]) or not ':' in volume:
+                continue
+
+            volume_storage_id, volume_name = volume.split(':', 1)
+
+            # A linked clone always lives on the storage of its template
+            if volume_storage_id != storage_id:
+                return f"disk {config_key} of template {template_vmid} is on {volume_storage_id}, not on {storage_id}"
+
+            if not self.storage_cache.supports_linked_clone(self.proxmox_api, volume_storage_id, 'qcow2' if volume_name.endswith('.qcow2') else None):
+                return f"storage {volume_storage_id} does not support linked clones of {volume_name}"
+
+            if target_node != template_node and not self.storage_cache.get_storage(self.proxmox_api, volume_storage_id)['shared']:
+                return f"storage {volume_storage_id} is not shared with {target_node}"
+
+        return None
+
+
+    @instrument_handler
     def proxmox_clone_vm(self, json_in):
+        clone_metrics = {}
+
         try:
             for required_netbox_object in ['proxmox_vm_templates', 'proxmox_vm_storage']:
                 if not required_netbox_object in json_in['data']['custom_fields']:
@@ -197,29 +311,64 @@ class NetBoxProxmoxHelperVM(NetBoxProxmoxHelper):
                     netbox_collected_vms[nbo_settings['name']]['tenant'].append(nbo_settings['tenant'])
 
             if json_in['data']['tenant'] not in netbox_collected_vms[json_in['data']['name']]['tenant'] or not self.proxmox_check_if_vm_exists(json_in['data']['name']):
-                try:
-                    if 'data' in json_in and 'custom_fields' in json_in['data'] and 'proxmox_vmid' in json_in['data']['custom_fields'] and json_in['data']['custom_fields']['proxmox_vmid']:
-                        self.proxmox_api.nodes(self.proxmox_api_config['node']).qemu(int(json_in['data']['custom_fields']['proxmox_vmid'])).config.get()
-                    else:
-                        new_vm_id = self.proxmox_api.cluster.get('nextid')
-                except ResourceException as e:
-                    if re.search(r'does\s+not\s+exist$', e.content):                
-                        new_vm_id = int(json_in['data']['custom_fields']['proxmox_vmid'])
-                    else:
-                        return 500, {'result': e.content}
-                
+                new_vm_id = None
+
+                # A VM id chosen in NetBox is honoured, so only take a pre-cloned VM when Proxmox may pick the id
+                if self.warm_pool and not json_in['data']['custom_fields'].get('proxmox_vmid'):
+                    clone_started = time.monotonic()
+                    new_vm_id = self.proxmox_claim_warm_pool_vm(json_in)
+
+                    if new_vm_id:
+                        clone_metrics = {'clone_mode': 'warm_pool', 'clone_seconds': round(time.monotonic() - clone_started, 3)}
+
                 if not new_vm_id:
-                    raise ValueError(f"Unable to create VM id for {json_in['data']['name']}")
-
-                clone_data = self.proxmox_api.nodes(self.proxmox_api_config['node']).qemu(int(json_in['data']['custom_fields']['proxmox_vm_templates'])).clone.post(
-                    newid=new_vm_id,
-                    full=1,
-                    name=json_in['data']['name'],
-                    storage=json_in['data']['custom_fields']['proxmox_vm_storage'],
-                    target=json_in['data']['custom_fields']['proxmox_node']
-                )
+                    vmid_allocated = False
+
+                    try:
+                        if 'data' in json_in and 'custom_fields' in json_in['data'] and 'proxmox_vmid' in json_in['data']['custom_fields'] and json_in['data']['custom_fields']['proxmox_vmid']:
+                            self.proxmox_api.nodes(self.proxmox_api_config['node']).qemu(int(json_in['data']['custom_fields']['proxmox_vmid'])).config.get()
+                        else:
+                            new_vm_id = self.proxmox_allocate_vmid(json_in)
+                            vmid_allocated = True
+                    except ResourceException as e:
+                        if re.search(r'does\s+not\s+exist$', e.content):                
+                            new_vm_id = int(json_in['data']['custom_fields']['proxmox_vmid'])
+                        else:
+                            return 500, {'result': e.content}
+                    
+                    if not new_vm_id:
+                        raise ValueError(f"Unable to create VM id for {json_in['data']['name']}")
+
+                    clone_started = time.monotonic()
+                    clone_mode = self.proxmox_vm_clone_mode(json_in)
+
+                    clone_settings = {
+                        'newid': new_vm_id,
+                        'name': json_in['data']['name'],
+                        'target': json_in['data']['custom_fields']['proxmox_node']
+                    }
+
+                    if clone_mode == 'linked':
+                        linked_clone_unsupported_reason = self.proxmox_linked_clone_unsupported_reason(int(json_in['data']['custom_fields']['proxmox_vm_templates']), json_in['data']['custom_fields']['proxmox_vm_storage'], json_in['data']['custom_fields']['proxmox_node'])
+
+                        if linked_clone_unsupported_reason:
+                            logger.info(f"Using a full clone for {json_in['data']['name']}: {linked_clone_unsupported_reason}")
+
+                            clone_mode = 'full'
+                            clone_metrics['linked_clone_fallback'] = linked_clone_unsupported_reason
+
+                    if clone_mode == 'linked':
+                        clone_settings['full'] = 0
+                    else:
+                        clone_settings['full'] = 1
+                        clone_settings['storage'] = json_in['data']['custom_fields']['proxmox_vm_storage']
+
+                    new_vm_id = self.proxmox_create_guest(json_in, new_vm_id, vmid_allocated, lambda vmid: self.proxmox_api.nodes(self.proxmox_get_template_node(int(json_in['data']['custom_fields']['proxmox_vm_templates']))).qemu(int(json_in['data']['custom_fields']['proxmox_vm_templates'])).clone.post(**{**clone_settings, 'newid': vmid}), 'clone')
 
-                self.proxmox_job_get_status(clone_data)
+                    clone_metrics['clone_mode'] = clone_mode
+                    clone_metrics['clone_seconds'] = round(time.monotonic() - clone_started, 3)
+
+                logger.info(f"Cloned {json_in['data']['name']} (vmid {new_vm_id}): {clone_metrics}")
 
                 # set vmid in NetBox
                 try:
@@ -252,10 +401,16 @@ class NetBoxProxmoxHelperVM(NetBoxProxmoxHelper):
                 if not 'custom_fields' in json_in['data']:
                     json_in['data']['custom_fields'] = {}
 
-                if not 'proxmox_vmid' in json_in['data']['custom_fields']:
+                if not json_in['data']['custom_fields'].get('proxmox_vmid'):
                     json_in['data']['custom_fields']['proxmox_vmid'] = new_vm_id
 
-                return self.proxmox_update_vm_vcpus_and_memory(json_in)
+                results = self.proxmox_update_vm_vcpus_and_memory(json_in)
+
+                # report how the VM was cloned, and how long that took, with the job result
+                if results and clone_metrics:
+                    results[1]['metrics'] = clone_metrics
+
+                return results
         except ResourceException as e:
             return 500, {'result': e.content}
 
@@ -270,32 +425,81 @@ class NetBoxProxmoxHelperVM(NetBoxProxmoxHelper):
         return 500, {'result': f"Unable to update vcpus (json_in['snapshots']['postchange']['vcpus']) and/or memory (json_in['snapshots']['postchange']['memory']) for {json_in['data']['custom_fields']['proxmox_vmid']}"}
 
 
+    def proxmox_desired_vm_config(self, json_in):
+        # Proxmox config keys for everything NetBox manages on a staged VM
+        desired_vm_config = {}
+
+        if json_in['snapshots']['postchange']['vcpus'] and json_in['snapshots']['postchange']['memory']:
+            desired_vm_config['cores'] = int(float(json_in['snapshots']['postchange']['vcpus']))
+            desired_vm_config['memory'] = int(json_in['snapshots']['postchange']['memory'])
+
+        if json_in['data']['primary_ip'] and json_in['data']['primary_ip']['address']:
+            primary_ip = json_in['data']['primary_ip']['address']
+            desired_vm_config['ipconfig0'] = f"ip={primary_ip},gw={self.generate_gateway_from_ip_address(primary_ip)}"
+
+        if 'proxmox_public_ssh_key' in json_in['data']['custom_fields'] and json_in['data']['custom_fields']['proxmox_public_ssh_key']:
+            desired_vm_config['sshkeys'] = urllib.parse.quote(json_in['data']['custom_fields']['proxmox_public_ssh_key'].rstrip(), safe='')
+
+        return desired_vm_config
+
+
+    @instrument_handler
+    def proxmox_update_vm_config(self, json_in):
+        try:
+            self.json_data_check_proxmox_vmid_exists(json_in)
+        except ValueError as e:
+            return 500, {'result': str(e)}
+
+        proxmox_vmid = json_in['data']['custom_fields']['proxmox_vmid']
+
+        try:
+            desired_vm_config = self.proxmox_desired_vm_config(json_in)
+            current_vm_config = self.proxmox_api.nodes(json_in['data']['custom_fields']['proxmox_node']).qemu(proxmox_vmid).config.get()
+
+            # Only write what differs from the current Proxmox config, in one config change (and one task wait)
+            changed_vm_config = {key: desired_vm_config[key] for key in desired_vm_config if str(current_vm_config.get(key)) != str(desired_vm_config[key])}
+
+            if not changed_vm_config:
+                return 200, {'result': f"No configuration changes for VM {proxmox_vmid}"}
+
+            update_vm_config = self.proxmox_api.nodes(json_in['data']['custom_fields']['proxmox_node']).qemu(proxmox_vmid).config.post(**changed_vm_config)
+
+            self.proxmox_job_get_status(update_vm_config, 'config')
+
+            return 200, {'result': f"Updated {', '.join(sorted(changed_vm_config))} for VM {proxmox_vmid}"}
+        except ResourceException as e:
+            return 500, {'result': e.content}
+
+
+    @instrument_handler
     def proxmox_start_vm(self, json_in):
         try:
             self.json_data_check_proxmox_vmid_exists(json_in)
 
             start_data = self.proxmox_api.nodes(json_in['data']['custom_fields']['proxmox_node']).qemu(json_in['data']['custom_fields']['proxmox_vmid']).status.start.post()
 
-            self.proxmox_job_get_status(start_data)
+            self.proxmox_job_get_status(start_data, 'start')
 
             return 200, {'result': f"VM {json_in['data']['custom_fields']['proxmox_vmid']} started successfully"}
         except ResourceException as e:
             return 500, {'result': e.content}
 
 
+    @instrument_handler
     def proxmox_stop_vm(self, json_in):
         try: 
             self.json_data_check_proxmox_vmid_exists(json_in)
 
             stop_data = self.proxmox_api.nodes(json_in['data']['custom_fields']['proxmox_node']).qemu(json_in['data']['custom_fields']['proxmox_vmid']).status.stop.post()
 
-            self.proxmox_job_get_status(stop_data)
+            self.proxmox_job_get_status(stop_data, 'stop')
 
             return 200, {'result': f"VM {json_in['data']['custom_fields']['proxmox_vmid']} stopped successfully"}
         except ResourceException as e:
             return 500, {'result': e.content}
 
 
+    @instrument_handler
     def proxmox_delete_vm(self, json_in):
         try:
             self.json_data_check_proxmox_vmid_exists(json_in)
@@ -304,7 +508,9 @@ class NetBoxProxmoxHelperVM(NetBoxProxmoxHelper):
 
             delete_data = self.proxmox_api.nodes(json_in['data']['custom_fields']['proxmox_node']).qemu(json_in['data']['custom_fields']['proxmox_vmid']).delete()
 
-            self.proxmox_job_get_status(delete_data)
+            self.proxmox_job_get_status(delete_data, 'delete')
+
+            self.inventory.invalidate()
 
             return 200, {'result': f"VM {json_in['data']['custom_fields']['proxmox_vmid']} deleted successfully"}
         except ResourceException as e:
@@ -322,7 +528,7 @@ class NetBoxProxmoxHelperVM(NetBoxProxmoxHelper):
                 ipconfig0=f"ip={primary_ip},gw={gateway}"
             )
 
-            self.proxmox_job_get_status(create_ipconfig0)
+            self.proxmox_job_get_status(create_ipconfig0, 'config')
 
             return 200, {'result': f"ipconfig0 set for VM {json_in['data']['custom_fields']['proxmox_vmid']} successfully"}
         except ResourceException as e:
@@ -339,13 +545,14 @@ class NetBoxProxmoxHelperVM(NetBoxProxmoxHelper):
                 sshkeys=f"{proxmox_public_ssh_key}"
             )
 
-            self.proxmox_job_get_status(create_ssh_public_key)
+            self.proxmox_job_get_status(create_ssh_public_key, 'config')
 
             return 200, {'result': f"SSH public key for VM {json_in['data']['custom_fields']['proxmox_vmid']} set successfully"}
         except ResourceException as e:
             return 500, {'result': e.content}
 
 
+    @instrument_handler
     def proxmox_add_disk(self, json_in):
         the_proxmox_vmid = ''
 
@@ -364,7 +571,7 @@ class NetBoxProxmoxHelperVM(NetBoxProxmoxHelper):
                     **config_data
                 )
 
-                self.proxmox_job_get_status(add_disk_data)
+                self.proxmox_job_get_status(add_disk_data, 'config')
 
                 the_proxmox_vmid = proxmox_vmid
 
@@ -373,6 +580,7 @@ class NetBoxProxmoxHelperVM(NetBoxProxmoxHelper):
             return 500, {'result': e.content}
 
 
+    @instrument_handler
     def proxmox_resize_disk(self, json_in):
         try:
             proxmox_vmid = self.netbox_get_proxmox_vmid(json_in['data']['virtual_machine']['id'])
@@ -382,13 +590,14 @@ class NetBoxProxmoxHelperVM(NetBoxProxmoxHelper):
                 size=f"{int(json_in['data']['size'])/1000}G"
             )
 
-            self.proxmox_job_get_status(disk_resize_info)
+            self.proxmox_job_get_status(disk_resize_info, 'resize')
 
             return 200, {'result': f"Disk {json_in['data']['name']} for VM {proxmox_vmid} resized successfully"}
         except ResourceException as e:
             return 500, {'result': e.content}
 
 
+    @instrument_handler
     def proxmox_delete_disk(self, json_in):
         try:
             if json_in['data']['name'] == 'scsi0':
@@ -418,10 +627,13 @@ class NetBoxProxmoxHelperLXC(NetBoxProxmoxHelper):
             return 500, {'result': e.content}
         
 
+    @instrument_handler
     def proxmox_create_lxc(self, json_in):
         try:
             # json_in['data']['name']
             # json_in['data']['custom_fields']['proxmox_lxc_template']
+            vmid_allocated = False
+
             try:
                 if self.debug:
                     print("JSON IN", json_in['data'])
@@ -429,7 +641,8 @@ class NetBoxProxmoxHelperLXC(NetBoxProxmoxHelper):
                 if 'data' in json_in and 'custom_fields' in json_in['data'] and 'proxmox_vmid' in json_in['data']['custom_fields'] and json_in['data']['custom_fields']['proxmox_vmid']:
                     self.proxmox_api.nodes(json_in['data']['custom_fields']['proxmox_node']).qemu(json_in['data']['custom_fields']['proxmox_vmid']).config.get()
                 else:
-                    new_vm_id = self.proxmox_api.cluster.get('nextid')
+                    new_vm_id = self.proxmox_allocate_vmid(json_in)
+                    vmid_allocated = True
             except ResourceException as e:
                 if re.search(r'does\s+not\s+exist$', e.content):
                     if self.debug:
@@ -463,9 +676,7 @@ class NetBoxProxmoxHelperLXC(NetBoxProxmoxHelper):
             if self.debug:
                 print("LXC CREATE DATA", lxc_create_data, new_vm_id)
 
-            create_lxc_data = self.proxmox_api.nodes(json_in['data']['custom_fields']['proxmox_node']).lxc.create(**lxc_create_data)
-
-            self.proxmox_job_get_status(create_lxc_data)
+            new_vm_id = self.proxmox_create_guest(json_in, new_vm_id, vmid_allocated, lambda vmid: self.proxmox_api.nodes(json_in['data']['custom_fields']['proxmox_node']).lxc.create(**{**lxc_create_data, 'vmid': vmid}), 'create')
 
             try:
                 nb_obj_update_vmid = self.netbox_api.virtualization.virtual_machines.get(name=json_in['data']['name'])
@@ -514,6 +725,71 @@ class NetBoxProxmoxHelperLXC(NetBoxProxmoxHelper):
         return 500, {'result': f"Unable to set vcpus ({json_in['data']['vcpus']}) and/or memory ({json_in['data']['memory']}) for LXC (vmid: {json_in['data']['custom_fields']['proxmox_vmid']})"}
 
 
+    def proxmox_desired_lxc_config(self, json_in, current_lxc_config=None):
+        # Proxmox config keys for everything NetBox manages on an LXC.  Changes are found by diffing these against the
+        # live Proxmox config (current_lxc_config), not NetBox's prechange snapshot, so that drift in Proxmox is corrected too.
+        if current_lxc_config is None:
+            current_lxc_config = {}
+
+        desired_lxc_config = {}
+
+        if json_in['snapshots']['postchange']['vcpus'] and json_in['snapshots']['postchange']['memory']:
+            desired_lxc_config['cores'] = int(float(json_in['snapshots']['postchange']['vcpus']))
+            desired_lxc_config['memory'] = int(json_in['snapshots']['postchange']['memory'])
+
+        if json_in['data']['primary_ip'] and json_in['data']['primary_ip']['address']:
+            primary_ip = json_in['data']['primary_ip']['address']
+            gateway = self.generate_gateway_from_ip_address(primary_ip)
+
+            desired_net0 = {
+                'name': 'net0',
+                'bridge': 'vmbr0',
+                'ip': primary_ip,
+                'gw': gateway,
+                'firewall': '1'
+            }
+
+            current_net0 = dict(option.split('=', 1) for option in str(current_lxc_config.get('net0', '')).split(',') if '=' in option)
+
+            if any(current_net0.get(key) != desired_net0[key] for key in desired_net0):
+                # keep the LXC's MAC address when its network settings change
+                if 'hwaddr' in current_net0:
+                    desired_net0['hwaddr'] = current_net0['hwaddr']
+
+                desired_lxc_config['net0'] = ','.join(f"{key}={desired_net0[key]}" for key in desired_net0)
+            else:
+                desired_lxc_config['net0'] = current_lxc_config['net0']
+
+        return desired_lxc_config
+
+
+    @instrument_handler
+    def proxmox_update_lxc_config(self, json_in):
+        try:
+            self.json_data_check_proxmox_vmid_exists(json_in)
+        except ValueError as e:
+            return 500, {'result': str(e)}
+
+        proxmox_vmid = json_in['data']['custom_fields']['proxmox_vmid']
+
+        try:
+            current_lxc_config = self.proxmox_api.nodes(json_in['data']['custom_fields']['proxmox_node']).lxc(proxmox_vmid).config.get()
+            desired_lxc_config = self.proxmox_desired_lxc_config(json_in, current_lxc_config)
+
+            changed_lxc_config = {key: desired_lxc_config[key] for key in desired_lxc_config if str(current_lxc_config.get(key)) != str(desired_lxc_config[key])}
+
+            if not changed_lxc_config:
+                return 200, {'result': 'No resources to change'}
+
+            update_lxc_config = self.proxmox_api.nodes(json_in['data']['custom_fields']['proxmox_node']).lxc(proxmox_vmid).config.put(**changed_lxc_config)
+
+            self.proxmox_job_get_status(update_lxc_config, 'config')
+
+            return 200, {'result': f"Updated {', '.join(sorted(changed_lxc_config))} for LXC (vmid: {proxmox_vmid})"}
+        except ResourceException as e:
+            return 500, {'result': e.content}
+
+
     def proxmox_lxc_set_net0(self, json_in):
         try:
             self.json_data_check_proxmox_vmid_exists(json_in)
@@ -530,6 +806,7 @@ class NetBoxProxmoxHelperLXC(NetBoxProxmoxHelper):
             return 500, {'result': e.content}
 
 
+    @instrument_handler
     def proxmox_lxc_resize_disk(self, json_in):
         if self.debug:
             print("PROXMOX LXC RESIZE DISK")
@@ -547,39 +824,42 @@ class NetBoxProxmoxHelperLXC(NetBoxProxmoxHelper):
 
             disk_resize_info = self.proxmox_api.nodes(json_in['data']['custom_fields']['proxmox_node']).lxc(proxmox_vmid).resize.put(**lxc_disk_size_info)
 
-            self.proxmox_job_get_status(disk_resize_info)
+            self.proxmox_job_get_status(disk_resize_info, 'resize')
 
             return 200, {'result': f"Disk rootfs resized to {disk_size}"}
         except ResourceException as e:
             return 500, {'result': e.content}
 
 
+    @instrument_handler
     def proxmox_start_lxc(self, json_in):
         try:
             self.json_data_check_proxmox_vmid_exists(json_in)
 
             start_data = self.proxmox_api.nodes(json_in['data']['custom_fields']['proxmox_node']).lxc(json_in['data']['custom_fields']['proxmox_vmid']).status.start.post()
 
-            self.proxmox_job_get_status(start_data)
+            self.proxmox_job_get_status(start_data, 'start')
 
             return 200, {'result': f"LXC (vmid: {json_in['data']['custom_fields']['proxmox_vmid']}) has been started"}
         except ResourceException as e:
             return 500, {'result': e.content}
 
 
+    @instrument_handler
     def proxmox_stop_lxc(self, json_in):
         try: 
             self.json_data_check_proxmox_vmid_exists(json_in)
 
             stop_data = self.proxmox_api.nodes(json_in['data']['custom_fields']['proxmox_node']).lxc(json_in['data']['custom_fields']['proxmox_vmid']).status.stop.post()
 
-            self.proxmox_job_get_status(stop_data)
+            self.proxmox_job_get_status(stop_data, 'stop')
 
             return 200, {'result': f"LXC (vmid: {json_in['data']['custom_fields']['proxmox_vmid']}) has been stopped"}
         except ResourceException as e:
             return 500, {'result': e.content}
 
 
+    @instrument_handler
     def proxmox_delete_lxc(self, json_in):
         try:
             self.json_data_check_proxmox_vmid_exists(json_in)
@@ -588,7 +868,9 @@ class NetBoxProxmoxHelperLXC(NetBoxProxmoxHelper):
 
             delete_data = self.proxmox_api.nodes(json_in['data']['custom_fields']['proxmox_node']).lxc.delete(json_in['data']['custom_fields']['proxmox_vmid'])
 
-            self.proxmox_job_get_status(delete_data)
+            self.proxmox_job_get_status(delete_data, 'delete')
+
+            self.inventory.invalidate()
 
             return 200, {'result': f"LXC (vmid: {json_in['data']['custom_fields']['proxmox_vmid']}) has been deleted"}
         except ResourceException as e:
@@ -599,32 +881,49 @@ class NetBoxProxmoxHelperMigrate(NetBoxProxmoxHelper):
     def __init__(self, cfg_data, proxmox_node, debug=False):
         super().__init__(cfg_data, proxmox_node, debug)
 
-        self.proxmox_cluster_name = 'default-proxmox-cluster-name'
-        self.proxmox_nodes = {}
-        self.proxmox_vms = {}
-        self.proxmox_lxc = {}
+        # Cluster, node and guest information is only loaded when it is used, migrations run pre-flight checks instead
+        self.__proxmox_cluster_name = None
+        self.__proxmox_nodes = None
+        self.__proxmox_vms = None
+        self.__proxmox_lxc = None
+
+
+    @property
+    def proxmox_cluster_name(self):
+        if self.__proxmox_cluster_name is None:
+            self.__get_cluster_name_and_nodes()
+
+        return self.__proxmox_cluster_name
+
+
+    @property
+    def proxmox_nodes(self):
+        if self.__proxmox_nodes is None:
+            self.__get_cluster_name_and_nodes()
+
+        return self.__proxmox_nodes
+
+
+    @property
+    def proxmox_vms(self):
+        if self.__proxmox_vms is None:
+            self.__get_proxmox_vms()
+
+        return self.__proxmox_vms
+
+
+    @property
+    def proxmox_lxc(self):
+        if self.__proxmox_lxc is None:
+            self.__get_proxmox_lxcs()
 
-        self.__get_cluster_name_and_nodes()
-        self.__get_proxmox_vms()
-        self.__get_proxmox_lxcs()
+        return self.__proxmox_lxc
 
 
     def __get_cluster_name_and_nodes(self):
         try:
-            cluster_status = self.proxmox_api.cluster.status.get()
-
-            for resource in cluster_status:
-                if not 'type' in resource:
-                    raise ValueError(f"Missing 'type' in Proxmox cluster resource {resource}")
-                
-                if resource['type'] == 'cluster':
-                    self.proxmox_cluster_name = resource['name']
-                elif resource['type'] == 'node':
-                    if not resource['name'] in self.proxmox_nodes:
-                        self.proxmox_nodes[resource['name']] = {}
-
-                    self.proxmox_nodes[resource['name']]['ip'] = resource['ip']
-                    self.proxmox_nodes[resource['name']]['online'] = resource['online']
+            self.__proxmox_cluster_name = self.inventory.get_cluster_name(self.proxmox_api) or 'default-proxmox-cluster-name'
+            self.__proxmox_nodes = self.inventory.get_nodes(self.proxmox_api)
         except ResourceException as e:
             raise RuntimeError(f"Proxmox API error: {e}") from e
         except requests.exceptions.ConnectionError:
@@ -636,17 +935,19 @@ class NetBoxProxmoxHelperMigrate(NetBoxProxmoxHelper):
 
     def __get_proxmox_vms(self):
         try:
-            for proxmox_node in self.proxmox_nodes:
-                all_vm_settings = self.proxmox_api.nodes(proxmox_node).get('qemu')
-                for vm_setting in all_vm_settings:
-                    if 'template' in vm_setting and vm_setting['template'] == 1:
-                        continue
+            proxmox_vms = {}
 
-                    if not vm_setting['name'] in self.proxmox_vms:
-                        self.proxmox_vms[vm_setting['name']] = {}
+            for vm_setting in self.inventory.get_guests(self.proxmox_api, 'qemu'):
+                if 'template' in vm_setting and vm_setting['template'] == 1:
+                    continue
 
-                    self.proxmox_vms[vm_setting['name']]['vmid'] = vm_setting['vmid']
-                    self.proxmox_vms[vm_setting['name']]['node'] = proxmox_node
+                if not vm_setting['name'] in proxmox_vms:
+                    proxmox_vms[vm_setting['name']] = {}
+
+                proxmox_vms[vm_setting['name']]['vmid'] = vm_setting['vmid']
+                proxmox_vms[vm_setting['name']]['node'] = vm_setting['node']
+
+            self.__proxmox_vms = proxmox_vms
         except ResourceException as e:
             raise RuntimeError(f"Proxmox API error: {e}") from e
         except requests.exceptions.ConnectionError:
@@ -658,17 +959,19 @@ class NetBoxProxmoxHelperMigrate(NetBoxProxmoxHelper):
 
     def __get_proxmox_lxcs(self):
         try:
-            for proxmox_node in self.proxmox_nodes:
-                all_lxc_settings = self.proxmox_api.nodes(proxmox_node).get('lxc')
-                for lxc_setting in all_lxc_settings:
-                    if 'template' in lxc_setting and lxc_setting['template'] == 1:
-                        continue
+            proxmox_lxc = {}
+
+            for lxc_setting in self.inventory.get_guests(self.proxmox_api, 'lxc'):
+                if 'template' in lxc_setting and lxc_setting['template'] == 1:
+                    continue
 
-                    if not lxc_setting['name'] in self.proxmox_lxc:
-                        self.proxmox_lxc[lxc_setting['name']] = {}
+                if not lxc_setting['name'] in proxmox_lxc:
+                    proxmox_lxc[lxc_setting['name']] = {}
 
-                    self.proxmox_lxc[lxc_setting['name']]['vmid'] = lxc_setting['vmid']
-                    self.proxmox_lxc[lxc_setting['name']]['node'] = proxmox_node
+                proxmox_lxc[lxc_setting['name']]['vmid'] = lxc_setting['vmid']
+                proxmox_lxc[lxc_setting['name']]['node'] = lxc_setting['node']
+
+            self.__proxmox_lxc = proxmox_lxc
         except ResourceException as e:
             raise RuntimeError(f"Proxmox API error: {e}") from e
         except requests.exceptions.ConnectionError:
@@ -680,34 +983,119 @@ class NetBoxProxmoxHelperMigrate(NetBoxProxmoxHelper):
 
     def __wait_for_migration_task(self, proxmox_node: str, proxmox_task_id: int):
         try:
-            start_time = int(time.time())
-
-            while True:
-                current_time = int(time.time())
-                elapsed_seconds = current_time - start_time
+            exitstatus = self.task_waiter.wait(proxmox_task_id, proxmox_node, 'migrate', progress_callback=self.proxmox_task_progress)
 
-                if elapsed_seconds >= 600: # 10 minutes
-                    return 500, {'content': f"Unable to complete task {proxmox_task_id} in defined time"}
-                
-                task_status = self.proxmox_api.nodes(proxmox_node).tasks(proxmox_task_id).status.get()
+            # the guest has moved (or may have, if the task failed half way)
+            self.inventory.invalidate()
 
-                if task_status['status'] == 'stopped':
-                    if 'exitstatus' in task_status and task_status['exitstatus'] == 'OK':
-                        return 200, {'result': "Proxmox node migration successful"}
-                    else:
-                        return 500, {'result': f"Task {proxmox_task_id} is stopped but exit status does not appear to be successful: {task_status['exit_status']}"}
+            if exitstatus == 'OK':
+                return 200, {'result': "Proxmox node migration successful"}
+            else:
+                return 500, {'result': f"Task {proxmox_task_id} is stopped but exit status does not appear to be successful: {exitstatus}"}
+        except ProxmoxTaskTimeout as e:
+            logging.error(f"Proxmox migration task timed out: {e.content}")
+            return 500, {'result': e.content}
         except ResourceException as e:
             logging.error(f"Proxmox API ResourceException: {e}")
-            return 500, {'content': "Proxmox API error occurred."}
+            return 500, {'result': "Proxmox API error occurred."}
         except requests.exceptions.ConnectionError as e:
             logging.error(f"Proxmox API ConnectionError: {e}")
-            return 500, {'content': "Failed to connect to Proxmox API."}
+            return 500, {'result': "Failed to connect to Proxmox API."}
         except requests.exceptions.HTTPError as e:
             status = e.response.status_code
             logging.error(f"Proxmox API HTTPError {status}: {e.response.text}")
-            return 500, {'content': f"Proxmox API HTTP error occurred (code {status})."}
+            return 500, {'result': f"Proxmox API HTTP error occurred (code {status})."}
+
+
+    def __check_target_node(self, proxmox_node: str, proxmox_target_node: str):
+        if proxmox_node == proxmox_target_node:
+            return f"Source and target node are both {proxmox_target_node}"
+
+        # a single status call, which fails for unknown and offline nodes
+        try:
+            self.proxmox_api.nodes(proxmox_target_node).status.get()
+        except ResourceException as e:
+            return f"Target node {proxmox_target_node} is not available: {e}"
+
+        return None
+
+
+    def __is_on_node(self, guest_type: str, proxmox_vmid: int, proxmox_node: str):
+        try:
+            if guest_type == 'lxc':
+                self.proxmox_api.nodes(proxmox_node).lxc(proxmox_vmid).status.current.get()
+            else:
+                self.proxmox_api.nodes(proxmox_node).qemu(proxmox_vmid).status.current.get()
+        except ResourceException:
+            return False
+
+        return True
+
+
+    def migrate_vm_preflight(self, proxmox_vmid: int, proxmox_node: str, proxmox_target_node: str):
+        # Returns (reason why the migration cannot run, or None, extra migrate settings)
+        target_node_error = self.__check_target_node(proxmox_node, proxmox_target_node)
+
+        if target_node_error:
+            return target_node_error, {}
+
+        # Proxmox checks storage on the target node, local disks and local resources for us in one call
+        migrate_precondition = self.proxmox_api.nodes(proxmox_node).qemu(proxmox_vmid).migrate.get(target=proxmox_target_node)
+
+        not_allowed_nodes = migrate_precondition.get('not_allowed_nodes', {}) or {}
+
+        if proxmox_target_node in not_allowed_nodes:
+            unavailable_storages = not_allowed_nodes[proxmox_target_node].get('unavailable_storages', [])
+
+            if unavailable_storages:
+                return f"Storage {', '.join(unavailable_storages)} is not available on node {proxmox_target_node}", {}
+
+            return f"VM {proxmox_vmid} cannot be migrated to node {proxmox_target_node}: {not_allowed_nodes[proxmox_target_node]}", {}
+
+        local_resources = migrate_precondition.get('local_resources', []) or []
+
+        if local_resources:
+            return f"VM {proxmox_vmid} uses local resources ({', '.join(str(local_resource) for local_resource in local_resources)})", {}
 
+        migrate_settings = {}
 
+        if [local_disk for local_disk in migrate_precondition.get('local_disks', []) or [] if not local_disk.get('cdrom')]:
+            migrate_settings['with-local-disks'] = 1
+
+        return None, migrate_settings
+
+
+    def migrate_lxc_preflight(self, proxmox_vmid: int, proxmox_node: str, proxmox_target_node: str):
+        target_node_error = self.__check_target_node(proxmox_node, proxmox_target_node)
+
+        if target_node_error:
+            return target_node_error
+
+        lxc_config = self.proxmox_api.nodes(proxmox_node).lxc(proxmox_vmid).config.get()
+
+        lxc_storage_ids = set()
+
+        for lxc_config_key in lxc_config:
+            if lxc_config_key == 'rootfs' or re.match(r'^mp\d+$', lxc_config_key):
+                lxc_volume = str(lxc_config[lxc_config_key]).split(',')[0]
+
+                # bind mounts (/path) have no storage
+                if ':' in lxc_volume and not lxc_volume.startswith('/'):
+                    lxc_storage_ids.add(lxc_volume.split(':')[0])
+
+        for lxc_storage_id in sorted(lxc_storage_ids):
+            try:
+                lxc_storage_status = self.proxmox_api.nodes(proxmox_target_node).storage(lxc_storage_id).status.get()
+            except ResourceException as e:
+                return f"Storage {lxc_storage_id} is not available on node {proxmox_target_node}: {e}"
+
+            if not lxc_storage_status.get('active', 1) or not lxc_storage_status.get('enabled', 1):
+                return f"Storage {lxc_storage_id} is not active on node {proxmox_target_node}"
+
+        return None
+
+
+    @instrument_handler
     def migrate_vm(self, proxmox_vmid: int, proxmox_node: str, proxmox_target_node: str):
         migrate_vm_data = {
             'target': proxmox_target_node,
@@ -715,6 +1103,18 @@ class NetBoxProxmoxHelperMigrate(NetBoxProxmoxHelper):
         }
 
         try:
+            # e.g. the NetBox update at the end of a bulk migration
+            if self.__is_on_node('qemu', proxmox_vmid, proxmox_target_node):
+                return 200, {'result': f"VM (vmid: {proxmox_vmid}) is already on node {proxmox_target_node}"}
+
+            preflight_error, migrate_settings = self.migrate_vm_preflight(proxmox_vmid, proxmox_node, proxmox_target_node)
+
+            if preflight_error:
+                logging.error(f"Pre-flight check for migrating VM {proxmox_vmid} failed: {preflight_error}")
+                return 500, {'result': f"Pre-flight check failed: {preflight_error}"}
+
+            migrate_vm_data.update(migrate_settings)
+
             migrate_vm_task_id = self.proxmox_api.nodes(proxmox_node).qemu(proxmox_vmid).migrate.post(**migrate_vm_data)
             return self.__wait_for_migration_task(proxmox_node, migrate_vm_task_id)
         except ResourceException as e:
@@ -729,6 +1129,7 @@ class NetBoxProxmoxHelperMigrate(NetBoxProxmoxHelper):
             return 500, {'result': f"Proxmox API HTTP error occurred (code {status})."}
 
 
+    @instrument_handler
     def migrate_lxc(self, proxmox_vmid: int, proxmox_node: str, proxmox_target_node: str):
         migrate_lxc_data = {
             'target': proxmox_target_node,
@@ -736,8 +1137,21 @@ class NetBoxProxmoxHelperMigrate(NetBoxProxmoxHelper):
         }
 
         try:
+            if self.__is_on_node('lxc', proxmox_vmid, proxmox_target_node):
+                return 200, {'result': f"LXC (vmid: {proxmox_vmid}) is already on node {proxmox_target_node}"}
+
+            preflight_error = self.migrate_lxc_preflight(proxmox_vmid, proxmox_node, proxmox_target_node)
+
+            if preflight_error:
+                logging.error(f"Pre-flight check for migrating LXC {proxmox_vmid} failed: {preflight_error}")
+                return 500, {'result': f"Pre-flight check failed: {preflight_error}"}
+
             migrate_lxc_task_id = self.proxmox_api.nodes(proxmox_node).lxc(proxmox_vmid).migrate.post(**migrate_lxc_data)
-            self.__wait_for_migration_task(proxmox_node, migrate_lxc_task_id)
+            migrate_lxc_status = self.__wait_for_migration_task(proxmox_node, migrate_lxc_task_id)
+
+            if migrate_lxc_status[0] != 200:
+                return migrate_lxc_status
+
             return 200, {'result': f"LXC (vmid: {proxmox_vmid}) has been migrated to node {proxmox_target_node}"}
         except ResourceException as e:
             logging.error(f"Proxmox API ResourceException: {e}")
@@ -0,0 +1,271 @@
+import logging
+import re
+import threading
+import time
+import uuid
+
+from . client_registry import get_client_registry
+from . proxmox_inventory import get_proxmox_inventory
+
+logger = logging.getLogger('netbox-proxmox-webhook-listener.placement')
+
+placement_engines = {}
+placement_engines_lock = threading.Lock()
+
+# Node scorers: scorer(node_state, placement_request, weights) returns a score (higher is better).
+# node_state and placement_request are plain dicts, see ProxmoxPlacementEngine.get_node_states and get_placement_request.
+placement_scorers = {}
+
+
+def register_placement_scorer(name, scorer):
+    placement_scorers[name] = scorer
+
+
+def score_balanced(node_state, placement_request, weights):
+    free_memory = (node_state['maxmem'] - node_state['mem'] - placement_request['memory']) / max(node_state['maxmem'], 1)
+    free_cpu = 1 - (node_state['cpu'] + placement_request['vcpus']) / max(node_state['maxcpu'], 1)
+
+    score = weights.get('memory', 1.0) * free_memory + weights.get('cpu', 1.0) * free_cpu
+
+    if node_state['storage_maxdisk']:
+        score += weights.get('storage', 0.5) * (node_state['storage_maxdisk'] - node_state['storage_disk'] - placement_request['disk']) / node_state['storage_maxdisk']
+
+    return score
+
+
+def score_most_free_memory(node_state, placement_request, weights):
+    return node_state['maxmem'] - node_state['mem']
+
+
+def score_least_cpu_load(node_state, placement_request, weights):
+    return -node_state['cpu'] / max(node_state['maxcpu'], 1)
+
+
+register_placement_scorer('balanced', score_balanced)
+register_placement_scorer('memory', score_most_free_memory)
+register_placement_scorer('cpu', score_least_cpu_load)
+
+
+def get_placement_engine(cfg_data, debug=False):
+    placement_config = cfg_data.get('placement', {}) or {}
+
+    if not placement_config.get('enabled', False):
+        return None
+
+    # One placement engine per Proxmox API endpoint, so that reservations are seen by every handler in this process
+    placement_engine_key = (cfg_data['proxmox_api_config']['api_host'], cfg_data['proxmox_api_config']['api_port'])
+
+    with placement_engines_lock:
+        if not placement_engine_key in placement_engines:
+            placement_engines[placement_engine_key] = ProxmoxPlacementEngine(cfg_data, debug)
+
+        return placement_engines[placement_engine_key]
+
+
+class ProxmoxPlacementEngine:
+    auto_placement_values = (None, '', 'auto')
+
+    def __init__(self, cfg_data, debug=False):
+        self.debug = debug
+        self.cfg_data = cfg_data
+
+        placement_config = cfg_data.get('placement', {}) or {}
+
+        self.placement_config = {
+            'scorer': placement_config.get('scorer', 'balanced'),
+            'weights': placement_config.get('weights', {}) or {},
+            'memory_headroom': float(placement_config.get('memory_headroom', 0.1)),
+            'reservation_ttl': float(placement_config.get('reservation_ttl', 600)),
+            'exclude_nodes': placement_config.get('exclude_nodes', []) or []
+        }
+
+        if not self.placement_config['scorer'] in placement_scorers:
+            raise ValueError(f"Unknown placement scorer '{self.placement_config['scorer']}' (known: {', '.join(sorted(placement_scorers))})")
+
+        # {reservation_id: {'node', 'storage', 'memory', 'vcpus', 'disk', 'expires'}}
+        self.reservations = {}
+        self.lock = threading.Lock()
+
+
+    @classmethod
+    def needs_placement(cls, webhook_json_data):
+        # Only guests the webhook handler goes on to clone or create: staged VMs and LXCs
+        if webhook_json_data.get('model') != 'virtualmachine' or webhook_json_data.get('event') != 'created':
+            return False
+
+        webhook_data = webhook_json_data.get('data') or {}
+        custom_fields = webhook_data.get('custom_fields') or {}
+        status = webhook_data.get('status')
+
+        if (status.get('value') if isinstance(status, dict) else status) != 'staged' or not custom_fields.get('proxmox_vm_type') in ('vm', 'lxc'):
+            return False
+
+        return custom_fields.get('proxmox_node') in cls.auto_placement_values
+
+
+    @staticmethod
+    def get_placement_request(webhook_json_data):
+        webhook_data = webhook_json_data['data']
+
+        return {
+            'memory': int(webhook_data.get('memory') or 0) * 1024 * 1024,
+            'vcpus': float(webhook_data.get('vcpus') or 1),
+            'disk': int(webhook_data.get('disk') or 0) * 1024 * 1024,
+            'storage': webhook_data['custom_fields'].get('proxmox_vm_storage'),
+            'nodes': None
+        }
+
+
+    @staticmethod
+    def get_node_states(node_resources, storage_resources, storage=None):
+        node_states = {}
+
+        for node in node_resources:
+            if node_resources[node].get('status') != 'online':
+                continue
+
+            node_state = {
+                'node': node,
+                'mem': int(node_resources[node].get('mem', 0) or 0),
+                'maxmem': int(node_resources[node].get('maxmem', 0) or 0),
+                'cpu': float(node_resources[node].get('cpu', 0) or 0) * int(node_resources[node].get('maxcpu', 0) or 0),
+                'maxcpu': int(node_resources[node].get('maxcpu', 0) or 0),
+                'storage_disk': 0,
+                'storage_maxdisk': 0
+            }
+
+            if storage:
+                storage_resource = storage_resources.get((node, storage))
+
+                # the requested storage has to be available on the node
+                if not storage_resource or storage_resource.get('status') != 'available':
+                    continue
+
+                node_state['storage_disk'] = int(storage_resource.get('disk', 0) or 0)
+                node_state['storage_maxdisk'] = int(storage_resource.get('maxdisk', 0) or 0)
+
+            node_states[node] = node_state
+
+        return node_states
+
+
+    def select_node(self, node_states, placement_request, reservations=[]):
+        # Pure function of its arguments, so that it can be benchmarked against synthetic cluster snapshots
+        node_states = {node: dict(node_states[node]) for node in node_states if not node in self.placement_config['exclude_nodes'] and (not placement_request.get('nodes') or node in placement_request['nodes'])}
+
+        for reservation in reservations:
+            if reservation['node'] in node_states:
+                node_states[reservation['node']]['mem'] += reservation['memory']
+                node_states[reservation['node']]['cpu'] += reservation['vcpus']
+
+                if reservation['storage'] == placement_request['storage']:
+                    node_states[reservation['node']]['storage_disk'] += reservation['disk']
+
+        scorer = placement_scorers[self.placement_config['scorer']]
+
+        best_node = None
+        best_score = None
+
+        for node in sorted(node_states):
+            node_state = node_states[node]
+
+            if node_state['mem'] + placement_request['memory'] > node_state['maxmem'] * (1 - self.placement_config['memory_headroom']):
+                continue
+
+            if node_state['storage_maxdisk'] and node_state['storage_disk'] + placement_request['disk'] > node_state['storage_maxdisk']:
+                continue
+
+            score = scorer(node_state, placement_request, self.placement_config['weights'])
+
+            if best_score is None or score > best_score:
+                best_node = node
+                best_score = score
+
+        return best_node
+
+
+    def place(self, placement_request):
+        proxmox_api = get_client_registry(self.cfg_data, self.debug).proxmox_api()
+        inventory = get_proxmox_inventory(self.cfg_data, self.debug)
+
+        node_states = self.get_node_states(inventory.get_node_resources(proxmox_api), inventory.get_storage_resources(proxmox_api), placement_request['storage'])
+
+        # select and reserve under one lock, so that parallel creates see each other's reservations
+        with self.lock:
+            now = time.monotonic()
+            reservations = [reservation for reservation in self.reservations.values() if reservation['expires'] > now]
+
+            node = self.select_node(node_states, placement_request, reservations)
+
+            if not node:
+                raise ValueError(f"No Proxmox node has room for {placement_request}")
+
+            reservation_id = str(uuid.uuid4())
+
+            self.reservations[reservation_id] = {
+                'node': node,
+                'storage': placement_request['storage'],
+                'memory': placement_request['memory'],
+                'vcpus': placement_request['vcpus'],
+                'disk': placement_request['disk'],
+                'expires': now + self.placement_config['reservation_ttl']
+            }
+
+        if self.debug:
+            print(f"PLACEMENT: {placement_request} -> {node} (reservation {reservation_id})")
+
+        return node, reservation_id
+
+
+    def release(self, reservation_id):
+        # the create is done: from now on, the new guest counts through cluster/resources
+        with self.lock:
+            self.reservations.pop(reservation_id, None)
+
+
+    def __get_template_nodes(self, template_vmid):
+        # A template on local storage can only be cloned on its own node
+        proxmox_api = get_client_registry(self.cfg_data, self.debug).proxmox_api()
+        inventory = get_proxmox_inventory(self.cfg_data, self.debug)
+
+        template_node = inventory.get_node_of_vmid(proxmox_api, template_vmid)
+
+        if not template_node:
+            return None
+
+        storage_resources = inventory.get_storage_resources(proxmox_api)
+        template_config = proxmox_api.nodes(template_node).qemu(template_vmid).config.get()
+
+        for config_key in template_config:
+            if not re.match(r'^(scsi|virtio|sata|ide|efidisk|tpmstate)\d+$', config_key) or 'media=cdrom' in str(template_config[config_key]):
+                continue
+
+            volume = str(template_config[config_key]).split(',')[0]
+
+            if ':' in volume and not int((storage_resources.get((template_node, volume.split(':')[0])) or {}).get('shared', 0) or 0):
+                return [template_node]
+
+        return None
+
+
+    def place_guest(self, webhook_json_data):
+        placement_request = self.get_placement_request(webhook_json_data)
+
+        if webhook_json_data['data']['custom_fields'].get('proxmox_vm_type', 'vm') == 'vm' and webhook_json_data['data']['custom_fields'].get('proxmox_vm_templates'):
+            placement_request['nodes'] = self.__get_template_nodes(int(webhook_json_data['data']['custom_fields']['proxmox_vm_templates']))
+
+        node, reservation_id = self.place(placement_request)
+
+        webhook_json_data['data']['custom_fields']['proxmox_node'] = node
+
+        # write the chosen node back to NetBox
+        netbox_api = get_client_registry(self.cfg_data, self.debug).netbox_api()
+        netbox_vm = netbox_api.virtualization.virtual_machines.get(webhook_json_data['data']['id'])
+
+        if netbox_vm:
+            netbox_vm.custom_fields['proxmox_node'] = node
+            netbox_vm.save()
+
+        logger.info(f"Placed {webhook_json_data['data'].get('name')} on Proxmox node {node}")
+
+        return node, reservation_id
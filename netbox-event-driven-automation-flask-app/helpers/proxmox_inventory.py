@@ -0,0 +1,192 @@
+import logging
+import threading
+import time
+
+from . client_registry import get_client_registry
+
+logger = logging.getLogger('netbox-proxmox-webhook-listener.inventory')
+
+proxmox_inventories = {}
+proxmox_inventories_lock = threading.Lock()
+
+
+def get_proxmox_inventory(cfg_data, debug=False):
+    # One inventory per Proxmox API endpoint, shared by every helper in this process
+    inventory_key = (cfg_data['proxmox_api_config']['api_host'], cfg_data['proxmox_api_config']['api_port'])
+
+    with proxmox_inventories_lock:
+        if not inventory_key in proxmox_inventories:
+            proxmox_inventories[inventory_key] = ProxmoxInventory(cfg_data, debug)
+
+        return proxmox_inventories[inventory_key]
+
+
+class ProxmoxInventory:
+    def __init__(self, cfg_data, debug=False):
+        self.debug = debug
+        self.cfg_data = cfg_data
+
+        inventory_config = cfg_data.get('proxmox_inventory', {}) or {}
+
+        self.inventory_config = {
+            'ttl': float(inventory_config.get('ttl', 5)),
+            'poll_interval': float(inventory_config.get('poll_interval', 0))
+        }
+
+        self.guests = {}
+        self.guests_by_name = {}
+        self.guests_refreshed = 0
+        self.guests_generation = 0
+        self.node_resources = {}
+        self.storage_resources = {}
+
+        self.cluster_name = None
+        self.nodes = {}
+        self.nodes_refreshed = 0
+
+        self.lock = threading.Lock()
+
+        # Only one handler refreshes a stale index, the others wait for (and then share) its result
+        self.refresh_lock = threading.Lock()
+
+        if self.inventory_config['poll_interval'] > 0:
+            threading.Thread(target=self.__poll, name='proxmox-inventory', daemon=True).start()
+
+
+    def __poll(self):
+        while True:
+            try:
+                proxmox_api = get_client_registry(self.cfg_data, self.debug).proxmox_api()
+
+                self.refresh_guests(proxmox_api)
+                self.refresh_nodes(proxmox_api)
+            except Exception as e:
+                logger.warning(f"Unable to refresh Proxmox inventory: {e}")
+
+            time.sleep(self.inventory_config['poll_interval'])
+
+
+    def __is_fresh(self, refreshed):
+        return refreshed and time.monotonic() - refreshed < self.inventory_config['ttl']
+
+
+    def refresh_guests(self, proxmox_api):
+        generation = self.guests_generation
+
+        guests = {}
+        guests_by_name = {}
+        node_resources = {}
+        storage_resources = {}
+
+        # the full listing also carries the memory / CPU usage of each node and the usage of each storage
+        for proxmox_resource in proxmox_api.cluster.resources.get():
+            if proxmox_resource.get('type') == 'node':
+                node_resources[proxmox_resource['node']] = proxmox_resource
+            elif proxmox_resource.get('type') == 'storage':
+                storage_resources[(proxmox_resource['node'], proxmox_resource['storage'])] = proxmox_resource
+            elif proxmox_resource.get('type') in ('qemu', 'lxc'):
+                guests[int(proxmox_resource['vmid'])] = proxmox_resource
+
+                if not proxmox_resource.get('template') and 'name' in proxmox_resource:
+                    guests_by_name[proxmox_resource['name']] = int(proxmox_resource['vmid'])
+
+        with self.lock:
+            self.guests = guests
+            self.guests_by_name = guests_by_name
+            self.node_resources = node_resources
+            self.storage_resources = storage_resources
+
+            # a listing which raced with an invalidation may miss our own change, so it is used only once
+            self.guests_refreshed = time.monotonic() if generation == self.guests_generation else 0
+
+        if self.debug:
+            print(f"INVENTORY: refreshed {len(guests)} guests")
+
+
+    def refresh_nodes(self, proxmox_api):
+        cluster_name = None
+        nodes = {}
+
+        for proxmox_resource in proxmox_api.cluster.status.get():
+            if not 'type' in proxmox_resource:
+                raise ValueError(f"Missing 'type' in Proxmox cluster resource {proxmox_resource}")
+
+            if proxmox_resource['type'] == 'cluster':
+                cluster_name = proxmox_resource['name']
+            elif proxmox_resource['type'] == 'node':
+                nodes[proxmox_resource['name']] = {'ip': proxmox_resource.get('ip'), 'online': proxmox_resource.get('online')}
+
+        with self.lock:
+            self.cluster_name = cluster_name
+            self.nodes = nodes
+            self.nodes_refreshed = time.monotonic()
+
+        if self.debug:
+            print(f"INVENTORY: refreshed {len(nodes)} nodes")
+
+
+    def __guests(self, proxmox_api):
+        if not self.__is_fresh(self.guests_refreshed):
+            with self.refresh_lock:
+                if not self.__is_fresh(self.guests_refreshed):
+                    self.refresh_guests(proxmox_api)
+
+        with self.lock:
+            return self.guests, self.guests_by_name
+
+
+    def __nodes(self, proxmox_api):
+        if not self.__is_fresh(self.nodes_refreshed):
+            with self.refresh_lock:
+                if not self.__is_fresh(self.nodes_refreshed):
+                    self.refresh_nodes(proxmox_api)
+
+        with self.lock:
+            return self.cluster_name, self.nodes
+
+
+    def get_node_resources(self, proxmox_api):
+        self.__guests(proxmox_api)
+
+        with self.lock:
+            return dict(self.node_resources)
+
+
+    def get_storage_resources(self, proxmox_api):
+        self.__guests(proxmox_api)
+
+        with self.lock:
+            return dict(self.storage_resources)
+
+
+    def get_vmids_by_name(self, proxmox_api):
+        return dict(self.__guests(proxmox_api)[1])
+
+
+    def get_guest(self, proxmox_api, vmid):
+        return self.__guests(proxmox_api)[0].get(int(vmid))
+
+
+    def get_guests(self, proxmox_api, guest_type=None):
+        return [guest for guest in self.__guests(proxmox_api)[0].values() if not guest_type or guest.get('type') == guest_type]
+
+
+    def get_node_of_vmid(self, proxmox_api, vmid):
+        guest = self.get_guest(proxmox_api, vmid)
+
+        return guest.get('node') if guest else None
+
+
+    def get_cluster_name(self, proxmox_api):
+        return self.__nodes(proxmox_api)[0]
+
+
+    def get_nodes(self, proxmox_api):
+        return dict(self.__nodes(proxmox_api)[1])
+
+
+    def invalidate(self):
+        # Called after our own clones, creates, deletes and migrations, so that the next reader sees them
+        with self.lock:
+            self.guests_generation += 1
+            self.guests_refreshed = 0
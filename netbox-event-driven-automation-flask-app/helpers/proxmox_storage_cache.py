@@ -0,0 +1,73 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger('netbox-proxmox-webhook-listener.storage_cache')
+
+proxmox_storage_caches = {}
+proxmox_storage_caches_lock = threading.Lock()
+
+
+def get_proxmox_storage_cache(cfg_data, debug=False):
+    # One cache per Proxmox API endpoint, shared by every helper in this process
+    storage_cache_key = (cfg_data['proxmox_api_config']['api_host'], cfg_data['proxmox_api_config']['api_port'])
+
+    with proxmox_storage_caches_lock:
+        if not storage_cache_key in proxmox_storage_caches:
+            proxmox_storage_caches[storage_cache_key] = ProxmoxStorageCache(cfg_data, debug)
+
+        return proxmox_storage_caches[storage_cache_key]
+
+
+class ProxmoxStorageCache:
+    # storage types which can hold linked clones of any disk format
+    linked_clone_storage_types = ('zfspool', 'lvmthin', 'rbd')
+
+    # file based storage types, which can only hold linked clones of qcow2 disks
+    linked_clone_file_storage_types = ('dir', 'nfs', 'cifs', 'glusterfs', 'cephfs', 'btrfs')
+
+    # storage types which are available on every node, even without 'shared' set
+    shared_storage_types = ('rbd', 'cephfs', 'nfs', 'cifs', 'glusterfs', 'iscsi', 'iscsidirect', 'pbs')
+
+    def __init__(self, cfg_data, debug=False):
+        self.debug = debug
+
+        clone_config = cfg_data.get('proxmox_clone', {}) or {}
+
+        self.ttl = float(clone_config.get('storage_cache_ttl', 300))
+
+        # {storage_id: (expires, storage_info)}
+        self.storages = {}
+        self.lock = threading.Lock()
+
+
+    def get_storage(self, proxmox_api, storage_id):
+        with self.lock:
+            if storage_id in self.storages and self.storages[storage_id][0] > time.monotonic():
+                return self.storages[storage_id][1]
+
+        storage_config = proxmox_api.storage(storage_id).get()
+
+        storage_info = {
+            'type': storage_config.get('type'),
+            'shared': bool(int(storage_config.get('shared', 0) or 0)) or storage_config.get('type') in self.shared_storage_types,
+            'content': str(storage_config.get('content', '')).split(',')
+        }
+
+        with self.lock:
+            self.storages[storage_id] = (time.monotonic() + self.ttl, storage_info)
+
+        if self.debug:
+            print(f"STORAGE {storage_id}: {storage_info}")
+
+        return storage_info
+
+
+    def supports_linked_clone(self, proxmox_api, storage_id, volume_format=None):
+        storage_type = self.get_storage(proxmox_api, storage_id)['type']
+
+        if storage_type in self.linked_clone_storage_types:
+            return True
+
+        return storage_type in self.linked_clone_file_storage_types and volume_format == 'qcow2'
+
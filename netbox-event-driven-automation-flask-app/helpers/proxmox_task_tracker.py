@@ -0,0 +1,163 @@
+import logging
+import threading
+import time
+
+from concurrent.futures import Future
+from proxmoxer import ResourceException
+
+logger = logging.getLogger('netbox-proxmox-webhook-listener.task_tracker')
+
+proxmox_task_trackers = {}
+proxmox_task_trackers_lock = threading.Lock()
+
+
+def get_proxmox_task_tracker(proxmox_api, cfg_data, debug=False):
+    task_tracker_config = cfg_data.get('proxmox_task_tracker', {}) or {}
+
+    if not task_tracker_config.get('enabled', False):
+        return None
+
+    # One tracker per Proxmox API endpoint, shared by every helper in this process
+    tracker_key = (cfg_data['proxmox_api_config']['api_host'], cfg_data['proxmox_api_config']['api_port'])
+
+    with proxmox_task_trackers_lock:
+        if not tracker_key in proxmox_task_trackers:
+            proxmox_task_trackers[tracker_key] = ProxmoxTaskTracker(proxmox_api, cfg_data, debug)
+
+        return proxmox_task_trackers[tracker_key]
+
+
+class ProxmoxTaskTracker:
+    def __init__(self, proxmox_api, cfg_data, debug=False):
+        self.debug = debug
+        self.proxmox_api = proxmox_api
+
+        task_tracker_config = cfg_data.get('proxmox_task_tracker', {}) or {}
+
+        self.task_tracker_config = {
+            'poll_interval': float(task_tracker_config.get('poll_interval', 0.5)),
+            'listing_limit': int(task_tracker_config.get('listing_limit', 500)),
+            'missing_polls_before_fallback': int(task_tracker_config.get('missing_polls_before_fallback', 3))
+        }
+
+        # {node: {upid: {'future': Future, 'starttime': int, 'missing_polls': int}}}
+        self.tracked_tasks = {}
+        self.pollers = {}
+        self.lock = threading.Lock()
+
+
+    @staticmethod
+    def parse_upid(upid):
+        # UPID:{node}:{pid}:{pstart}:{starttime}:{type}:{id}:{user}:
+        upid_parts = str(upid).split(':')
+
+        if len(upid_parts) < 5 or upid_parts[0] != 'UPID':
+            return None, 0
+
+        try:
+            return upid_parts[1], int(upid_parts[4], 16)
+        except ValueError:
+            return upid_parts[1], 0
+
+
+    def track(self, upid, proxmox_node=None):
+        upid_node, starttime = self.parse_upid(upid)
+        proxmox_node = upid_node or proxmox_node
+
+        if not proxmox_node:
+            raise ValueError(f"Unable to determine Proxmox node for task {upid}")
+
+        with self.lock:
+            if not proxmox_node in self.tracked_tasks:
+                self.tracked_tasks[proxmox_node] = {}
+
+            if not upid in self.tracked_tasks[proxmox_node]:
+                self.tracked_tasks[proxmox_node][upid] = {
+                    'future': Future(),
+                    'starttime': starttime,
+                    'missing_polls': 0
+                }
+
+            future = self.tracked_tasks[proxmox_node][upid]['future']
+
+            if not proxmox_node in self.pollers:
+                poller = threading.Thread(target=self.__poll_node, args=(proxmox_node,), name=f"proxmox-task-tracker-{proxmox_node}", daemon=True)
+                self.pollers[proxmox_node] = poller
+                poller.start()
+
+        return future
+
+
+    def untrack(self, upid, proxmox_node=None):
+        upid_node, _ = self.parse_upid(upid)
+        proxmox_node = upid_node or proxmox_node
+
+        with self.lock:
+            tracked_task = self.tracked_tasks.get(proxmox_node, {}).pop(upid, None)
+
+        if tracked_task:
+            tracked_task['future'].cancel()
+
+
+    def outstanding_tasks(self):
+        with self.lock:
+            return {proxmox_node: len(self.tracked_tasks[proxmox_node]) for proxmox_node in self.tracked_tasks}
+
+
+    def __resolve(self, proxmox_node, upid, exitstatus):
+        with self.lock:
+            tracked_task = self.tracked_tasks.get(proxmox_node, {}).pop(upid, None)
+
+        if tracked_task and not tracked_task['future'].done():
+            tracked_task['future'].set_result(exitstatus)
+
+
+    def __poll_node_once(self, proxmox_node, outstanding_tasks):
+        # One task listing per node per tick, instead of one status call per outstanding task
+        since = min(outstanding_tasks[upid]['starttime'] for upid in outstanding_tasks)
+
+        task_list = self.proxmox_api.nodes(proxmox_node).tasks.get(source='all', since=since, limit=self.task_tracker_config['listing_limit'])
+        listed_tasks = {task['upid']: task for task in task_list or [] if 'upid' in task}
+
+        for upid in outstanding_tasks:
+            if upid in listed_tasks:
+                # finished tasks carry an 'endtime', and 'status' holds the exit status
+                if 'endtime' in listed_tasks[upid]:
+                    self.__resolve(proxmox_node, upid, listed_tasks[upid].get('status'))
+
+                continue
+
+            # The listing can miss a task (e.g. listing_limit reached); fall back to a direct status lookup
+            outstanding_tasks[upid]['missing_polls'] += 1
+
+            if outstanding_tasks[upid]['missing_polls'] >= self.task_tracker_config['missing_polls_before_fallback']:
+                outstanding_tasks[upid]['missing_polls'] = 0
+
+                task_status = self.proxmox_api.nodes(proxmox_node).tasks(upid).status.get()
+
+                if 'status' in task_status and task_status['status'] == 'stopped':
+                    self.__resolve(proxmox_node, upid, task_status.get('exitstatus'))
+
+
+    def __poll_node(self, proxmox_node):
+        while True:
+            with self.lock:
+                outstanding_tasks = dict(self.tracked_tasks.get(proxmox_node, {}))
+
+                if not outstanding_tasks:
+                    # Nothing left to watch on this node; track() starts a new poller when needed
+                    self.tracked_tasks.pop(proxmox_node, None)
+                    del self.pollers[proxmox_node]
+                    return
+
+            try:
+                self.__poll_node_once(proxmox_node, outstanding_tasks)
+            except ResourceException as e:
+                logger.warning(f"Unable to list tasks on Proxmox node {proxmox_node}: {e}")
+            except Exception as e:
+                logger.exception(f"Unexpected error while polling tasks on Proxmox node {proxmox_node}: {e}")
+
+            if self.debug:
+                print(f"TASK TRACKER {proxmox_node}: {len(outstanding_tasks)} outstanding task(s)")
+
+            time.sleep(self.task_tracker_config['poll_interval'])
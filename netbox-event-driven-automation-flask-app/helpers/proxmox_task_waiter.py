@@ -0,0 +1,194 @@
+import logging
+import random
+import time
+
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from proxmoxer import ResourceException
+
+from . metrics import metrics
+
+logger = logging.getLogger('netbox-proxmox-webhook-listener.task_waiter')
+
+
+class ProxmoxTaskTimeout(ResourceException):
+    def __init__(self, upid, timeout):
+        super().__init__(504, 'Gateway Timeout', f"Proxmox task {upid} did not finish within {timeout} seconds")
+
+
+class ProxmoxTaskFailed(ResourceException):
+    def __init__(self, upid, exitstatus):
+        super().__init__(500, 'Internal Server Error', f"Proxmox task {upid} finished with exit status: {exitstatus}")
+
+
+class ProxmoxTaskWaiter:
+    # seconds, per kind of operation; overridable with proxmox_task_waiter.timeouts in app_config.yml
+    default_timeouts = {
+        'default': 300,
+        'clone': 3600,
+        'create': 1800,
+        'migrate': 600,
+        'delete': 600,
+        'resize': 600,
+        'config': 300,
+        'start': 300,
+        'stop': 300
+    }
+
+    def __init__(self, proxmox_api, cfg_data, debug=False, task_tracker=None):
+        self.debug = debug
+        self.proxmox_api = proxmox_api
+        self.task_tracker = task_tracker
+
+        task_waiter_config = cfg_data.get('proxmox_task_waiter', {}) or {}
+
+        self.task_waiter_config = {
+            'initial_interval': float(task_waiter_config.get('initial_interval', 0.25)),
+            'max_interval': float(task_waiter_config.get('max_interval', 5)),
+            'backoff_factor': float(task_waiter_config.get('backoff_factor', 2)),
+            'jitter': float(task_waiter_config.get('jitter', 0.2)),
+            'progress_interval': float(task_waiter_config.get('progress_interval', 10))
+        }
+
+        self.timeouts = dict(self.default_timeouts)
+        self.timeouts.update(task_waiter_config.get('timeouts', {}) or {})
+
+
+    @staticmethod
+    def node_from_upid(upid):
+        # UPID:{node}:{pid}:{pstart}:{starttime}:{type}:{id}:{user}:
+        upid_parts = str(upid).split(':')
+
+        if len(upid_parts) > 2 and upid_parts[0] == 'UPID':
+            return upid_parts[1]
+
+        return None
+
+
+    def get_timeout(self, operation='default'):
+        return float(self.timeouts.get(operation, self.timeouts['default']))
+
+
+    def next_interval(self, interval):
+        # exponential backoff, capped at max_interval, with +/- jitter so concurrent waiters do not poll in lockstep
+        capped_interval = min(interval, self.task_waiter_config['max_interval'])
+        jitter = self.task_waiter_config['jitter']
+
+        return capped_interval * random.uniform(1 - jitter, 1 + jitter)
+
+
+    def read_task_log(self, proxmox_node, upid, start=0):
+        task_log = self.proxmox_api.nodes(proxmox_node).tasks(upid).log.get(start=start, limit=500)
+
+        return [entry.get('t', '') for entry in task_log or []]
+
+
+    def __report_progress(self, proxmox_node, upid, log_lines_seen, progress_callback):
+        try:
+            new_log_lines = self.read_task_log(proxmox_node, upid, log_lines_seen)
+        except ResourceException as e:
+            logger.warning(f"Unable to read task log for {upid}: {e}")
+            return log_lines_seen
+
+        if new_log_lines:
+            progress_callback(upid, new_log_lines)
+
+        return log_lines_seen + len(new_log_lines)
+
+
+    def __wait_with_tracker(self, upid, proxmox_node, timeout, progress_callback):
+        # The shared tracker polls each node once per tick for all outstanding tasks and resolves the future
+        future = self.task_tracker.track(upid, proxmox_node)
+
+        start_time = time.monotonic()
+        deadline = start_time + timeout
+        log_lines_seen = 0
+
+        while True:
+            remaining = deadline - time.monotonic()
+
+            if remaining <= 0:
+                self.task_tracker.untrack(upid, proxmox_node)
+                raise ProxmoxTaskTimeout(upid, timeout)
+
+            if progress_callback:
+                remaining = min(remaining, self.task_waiter_config['progress_interval'])
+
+            try:
+                exitstatus = future.result(timeout=remaining)
+            except FutureTimeoutError:
+                if progress_callback:
+                    log_lines_seen = self.__report_progress(proxmox_node, upid, log_lines_seen, progress_callback)
+
+                continue
+
+            if progress_callback and log_lines_seen > 0:
+                self.__report_progress(proxmox_node, upid, log_lines_seen, progress_callback)
+
+            return exitstatus
+
+
+    def wait(self, upid, proxmox_node=None, operation='default', timeout=None, progress_callback=None):
+        # Synchronous Proxmox API calls do not return a UPID, so there is nothing to wait for
+        if not upid:
+            return 'OK'
+
+        if not metrics.enabled:
+            return self.__wait(upid, proxmox_node, operation, timeout, progress_callback)
+
+        start_time = time.monotonic()
+
+        try:
+            exitstatus = self.__wait(upid, proxmox_node, operation, timeout, progress_callback)
+        except Exception as e:
+            metrics.task_wait_duration.observe(time.monotonic() - start_time, operation=operation, exitstatus='timeout' if isinstance(e, ProxmoxTaskTimeout) else 'exception')
+            metrics.errors.inc(source='task_waiter', exception=type(e).__name__)
+            raise
+
+        # failed tasks have free-form exit statuses, which would make a label per error message;
+        # 'WARNINGS: <n>' is a success, as everywhere else tasks are checked
+        metrics.task_wait_duration.observe(time.monotonic() - start_time, operation=operation, exitstatus='OK' if exitstatus == 'OK' else 'WARNINGS' if str(exitstatus).startswith('WARNINGS') else 'error')
+
+        return exitstatus
+
+
+    def __wait(self, upid, proxmox_node, operation, timeout, progress_callback):
+        proxmox_node = self.node_from_upid(upid) or proxmox_node
+
+        if not timeout:
+            timeout = self.get_timeout(operation)
+
+        if self.task_tracker:
+            return self.__wait_with_tracker(upid, proxmox_node, timeout, progress_callback)
+
+        start_time = time.monotonic()
+        deadline = start_time + timeout
+        next_progress_time = start_time + self.task_waiter_config['progress_interval']
+        log_lines_seen = 0
+        interval = self.task_waiter_config['initial_interval']
+
+        while True:
+            task_status = self.proxmox_api.nodes(proxmox_node).tasks(upid).status.get()
+
+            if self.debug:
+                print("RAW TASK STATUS", task_status)
+
+            now = time.monotonic()
+
+            if 'status' in task_status and task_status['status'] == 'stopped':
+                if progress_callback and log_lines_seen > 0:
+                    self.__report_progress(proxmox_node, upid, log_lines_seen, progress_callback)
+
+                if self.debug:
+                    print(f"TASK {upid} ({operation}) stopped after {now - start_time:.2f}s: {task_status.get('exitstatus')}")
+
+                return task_status.get('exitstatus')
+
+            if progress_callback and now >= next_progress_time:
+                log_lines_seen = self.__report_progress(proxmox_node, upid, log_lines_seen, progress_callback)
+                next_progress_time = now + self.task_waiter_config['progress_interval']
+
+            if now >= deadline:
+                raise ProxmoxTaskTimeout(upid, timeout)
+
+            time.sleep(min(self.next_interval(interval), deadline - now))
+            interval *= self.task_waiter_config['backoff_factor']
@@ -0,0 +1,111 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger('netbox-proxmox-webhook-listener.vmid_allocator')
+
+proxmox_vmid_allocators = {}
+proxmox_vmid_allocators_lock = threading.Lock()
+
+
+def get_proxmox_vmid_allocator(cfg_data, debug=False):
+    vmid_allocator_config = cfg_data.get('vmid_allocator', {}) or {}
+
+    if not vmid_allocator_config.get('enabled', False):
+        return None
+
+    # One allocator per Proxmox API endpoint (cluster), shared by every helper in this process
+    allocator_key = (cfg_data['proxmox_api_config']['api_host'], cfg_data['proxmox_api_config']['api_port'])
+
+    with proxmox_vmid_allocators_lock:
+        if not allocator_key in proxmox_vmid_allocators:
+            proxmox_vmid_allocators[allocator_key] = ProxmoxVMIDAllocator(cfg_data, debug)
+
+        return proxmox_vmid_allocators[allocator_key]
+
+
+class ProxmoxVMIDAllocator:
+    def __init__(self, cfg_data, debug=False):
+        self.debug = debug
+
+        vmid_allocator_config = cfg_data.get('vmid_allocator', {}) or {}
+
+        self.vmid_allocator_config = {
+            'range': self.__parse_range(vmid_allocator_config.get('range', [100, 999999])),
+            'tenant_ranges': {tenant: self.__parse_range(tenant_range) for tenant, tenant_range in (vmid_allocator_config.get('tenant_ranges', {}) or {}).items()},
+            'lease_ttl': float(vmid_allocator_config.get('lease_ttl', 600)),
+            'resync_interval': float(vmid_allocator_config.get('resync_interval', 300)),
+            'max_attempts': int(vmid_allocator_config.get('max_attempts', 3))
+        }
+
+        self.used_vmids = set()
+        self.last_resync = 0
+
+        # {vmid: expires}
+        self.leases = {}
+        self.lock = threading.Lock()
+
+
+    @staticmethod
+    def __parse_range(vmid_range):
+        if len(vmid_range) != 2 or int(vmid_range[0]) < 100 or int(vmid_range[0]) > int(vmid_range[1]):
+            raise ValueError(f"Invalid vmid range {vmid_range} (expected [first, last], first >= 100)")
+
+        return int(vmid_range[0]), int(vmid_range[1])
+
+
+    def resync(self, proxmox_api):
+        used_vmids = set(int(proxmox_resource['vmid']) for proxmox_resource in proxmox_api.cluster.resources.get(type='vm'))
+
+        with self.lock:
+            self.used_vmids = used_vmids
+            self.last_resync = time.monotonic()
+
+        if self.debug:
+            print(f"VMID ALLOCATOR: resynced {len(used_vmids)} used vmids")
+
+
+    def allocate(self, proxmox_api, tenant=None):
+        if time.monotonic() - self.last_resync > self.vmid_allocator_config['resync_interval']:
+            self.resync(proxmox_api)
+
+        first_vmid, last_vmid = self.vmid_allocator_config['tenant_ranges'].get(tenant, self.vmid_allocator_config['range'])
+
+        with self.lock:
+            now = time.monotonic()
+
+            for leased_vmid in [leased_vmid for leased_vmid in self.leases if self.leases[leased_vmid] <= now]:
+                del self.leases[leased_vmid]
+
+            for vmid in range(first_vmid, last_vmid + 1):
+                if not vmid in self.used_vmids and not vmid in self.leases:
+                    self.leases[vmid] = now + self.vmid_allocator_config['lease_ttl']
+
+                    if self.debug:
+                        print(f"VMID ALLOCATOR: leased {vmid} (tenant: {tenant})")
+
+                    return vmid
+
+        raise ValueError(f"No free vmid left in range {first_vmid}-{last_vmid} (tenant: {tenant})")
+
+
+    def commit(self, vmid):
+        # The lease is left to expire, so that a resync which does not see the new guest yet cannot hand out its vmid again
+        with self.lock:
+            self.used_vmids.add(int(vmid))
+
+
+    def release(self, vmid):
+        with self.lock:
+            self.leases.pop(int(vmid), None)
+
+
+    def reject(self, proxmox_api, vmid):
+        # Proxmox refused the vmid (created outside of this process): remember it and pick up everything else we missed
+        logger.warning(f"Proxmox rejected vmid {vmid}, resyncing used vmids")
+
+        with self.lock:
+            self.used_vmids.add(int(vmid))
+            self.leases.pop(int(vmid), None)
+
+        self.resync(proxmox_api)
@@ -0,0 +1,288 @@
+import json
+import logging
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from proxmoxer import ResourceException
+
+from . client_registry import get_client_registry
+from . proxmox_task_waiter import ProxmoxTaskWaiter, ProxmoxTaskFailed
+from . proxmox_task_tracker import get_proxmox_task_tracker
+from . proxmox_inventory import get_proxmox_inventory
+from . vmid_allocator import get_proxmox_vmid_allocator
+
+logger = logging.getLogger('netbox-proxmox-webhook-listener.warm_pool')
+
+warm_pools = {}
+warm_pools_lock = threading.Lock()
+
+
+def get_warm_pool(cfg_data, debug=False):
+    warm_pool_config = cfg_data.get('warm_pool', {}) or {}
+
+    if not warm_pool_config.get('enabled', False):
+        return None
+
+    warm_pool_key = (cfg_data['proxmox_api_config']['api_host'], cfg_data['proxmox_api_config']['api_port'])
+
+    with warm_pools_lock:
+        if not warm_pool_key in warm_pools:
+            warm_pools[warm_pool_key] = ProxmoxWarmPool(cfg_data, debug)
+
+        return warm_pools[warm_pool_key]
+
+
+class ProxmoxWarmPool:
+    pool_tag = 'netbox-warm-pool'
+
+    def __init__(self, cfg_data, debug=False):
+        self.debug = debug
+        self.cfg_data = cfg_data
+
+        warm_pool_config = cfg_data.get('warm_pool', {}) or {}
+
+        self.warm_pool_config = {
+            'refill_workers': int(warm_pool_config.get('refill_workers', 2)),
+            'refill_interval': float(warm_pool_config.get('refill_interval', 60)),
+            'max_age': float(warm_pool_config.get('max_age', 86400)),
+            'name_prefix': warm_pool_config.get('name_prefix', 'warm-pool')
+        }
+
+        # (template, storage, node) -> number of stopped, pre-cloned VMs to keep around
+        self.pool_sizes = {}
+
+        for pool in warm_pool_config.get('pools', []) or []:
+            for required_setting in ('template', 'storage', 'node'):
+                if not required_setting in pool:
+                    raise ValueError(f"Missing '{required_setting}' in warm_pool.pools entry {pool}")
+
+            self.pool_sizes[self.pool_key(pool['template'], pool['storage'], pool['node'])] = int(pool.get('size', 1))
+
+        # pool key -> [{'vmid': int, 'created': float}], oldest first
+        self.available_vms = {pool_key: [] for pool_key in self.pool_sizes}
+        self.cloning = {pool_key: 0 for pool_key in self.pool_sizes}
+
+        # (pool key, vmid) of pooled VMs past max_age, deleted by the next refill
+        self.expired_vms = []
+
+        self.lock = threading.Lock()
+
+        self.refill_requested = threading.Event()
+        self.refill_executor = ThreadPoolExecutor(max_workers=max(1, self.warm_pool_config['refill_workers']), thread_name_prefix='proxmox-warm-pool-clone')
+
+        self.refill_thread = threading.Thread(target=self.__refill_loop, name='proxmox-warm-pool', daemon=True)
+        self.refill_thread.start()
+
+
+    @staticmethod
+    def pool_key(template, storage, node):
+        return (str(template), str(storage), str(node))
+
+
+    def __proxmox_api(self):
+        return get_client_registry(self.cfg_data, self.debug).proxmox_api()
+
+
+    def __wait(self, proxmox_api, upid, node, operation):
+        task_waiter = ProxmoxTaskWaiter(proxmox_api, self.cfg_data, self.debug, get_proxmox_task_tracker(proxmox_api, self.cfg_data, self.debug))
+        exitstatus = task_waiter.wait(upid, node, operation)
+
+        if exitstatus != 'OK' and not str(exitstatus).startswith('WARNINGS'):
+            raise ProxmoxTaskFailed(upid, exitstatus)
+
+
+    def pool_status(self):
+        with self.lock:
+            return {'/'.join(pool_key): {'size': self.pool_sizes[pool_key], 'available': len(self.available_vms[pool_key]), 'cloning': self.cloning[pool_key]} for pool_key in self.pool_sizes}
+
+
+    def __discover_pooled_vms(self):
+        # Pick up VMs pooled by an earlier run of the application
+        proxmox_api = self.__proxmox_api()
+
+        for proxmox_vm in proxmox_api.cluster.resources.get(type='vm'):
+            if not self.pool_tag in str(proxmox_vm.get('tags', '')).split(';') or proxmox_vm.get('template'):
+                continue
+
+            try:
+                pooled_vm_info = json.loads(proxmox_api.nodes(proxmox_vm['node']).qemu(proxmox_vm['vmid']).config.get().get('description', ''))
+            except (ValueError, ResourceException) as e:
+                logger.warning(f"Ignoring warm pool VM {proxmox_vm['vmid']}: {e}")
+                continue
+
+            pool_key = self.pool_key(pooled_vm_info.get('template'), pooled_vm_info.get('storage'), proxmox_vm['node'])
+
+            if pool_key in self.available_vms:
+                with self.lock:
+                    self.available_vms[pool_key].append({'vmid': int(proxmox_vm['vmid']), 'created': float(pooled_vm_info.get('created', 0))})
+
+        with self.lock:
+            for pool_key in self.available_vms:
+                self.available_vms[pool_key].sort(key=lambda pooled_vm: pooled_vm['created'])
+
+
+    def __clone_pooled_vm(self, pool_key):
+        template, storage, node = pool_key
+
+        vmid_allocator = get_proxmox_vmid_allocator(self.cfg_data, self.debug)
+        new_vm_id = None
+
+        try:
+            proxmox_api = self.__proxmox_api()
+
+            if vmid_allocator:
+                new_vm_id = vmid_allocator.allocate(proxmox_api)
+            else:
+                new_vm_id = int(proxmox_api.cluster.get('nextid'))
+
+            # Proxmox runs the clone on the node which holds the template, 'target' puts the clone on the pool's node
+            template_node = get_proxmox_inventory(self.cfg_data, self.debug).get_node_of_vmid(proxmox_api, template) or node
+
+            clone_data = proxmox_api.nodes(template_node).qemu(int(template)).clone.post(
+                newid=new_vm_id,
+                full=1,
+                name=f"{self.warm_pool_config['name_prefix']}-{template}-{new_vm_id}",
+                storage=storage,
+                target=node
+            )
+
+            self.__wait(proxmox_api, clone_data, template_node, 'clone')
+
+            if vmid_allocator:
+                vmid_allocator.commit(new_vm_id)
+
+            created = time.time()
+
+            config_data = proxmox_api.nodes(node).qemu(new_vm_id).config.post(
+                tags=self.pool_tag,
+                description=json.dumps({'template': template, 'storage': storage, 'created': created})
+            )
+
+            self.__wait(proxmox_api, config_data, node, 'config')
+
+            with self.lock:
+                self.available_vms[pool_key].append({'vmid': new_vm_id, 'created': created})
+                self.available_vms[pool_key].sort(key=lambda pooled_vm: pooled_vm['created'])
+
+            if self.debug:
+                print(f"WARM POOL: cloned VM {new_vm_id} for {pool_key}")
+        except Exception as e:
+            logger.warning(f"Unable to clone warm pool VM for {pool_key}: {e}")
+
+            if vmid_allocator and new_vm_id:
+                vmid_allocator.release(new_vm_id)
+        finally:
+            with self.lock:
+                self.cloning[pool_key] -= 1
+
+
+    def __claim_pooled_vm(self, proxmox_api, node, vmid, name):
+        # Every listener process discovers the same pooled VMs.  Renaming and untagging a VM is made a compare-and-swap
+        # with the config digest, so that only one process claims it; PUT fails if the config changed since it was read.
+        try:
+            pooled_vm_config = proxmox_api.nodes(node).qemu(vmid).config.get()
+
+            if not self.pool_tag in str(pooled_vm_config.get('tags', '')).split(';'):
+                return False
+
+            proxmox_api.nodes(node).qemu(vmid).config.put(
+                name=name,
+                delete='tags,description',
+                digest=pooled_vm_config['digest']
+            )
+        except ResourceException as e:
+            logger.warning(f"Unable to claim warm pool VM {vmid}: {e}")
+            return False
+
+        return True
+
+
+    def __is_expired(self, pooled_vm):
+        return time.time() - pooled_vm['created'] > self.warm_pool_config['max_age']
+
+
+    def __delete_pooled_vm(self, pool_key, vmid):
+        try:
+            proxmox_api = self.__proxmox_api()
+
+            # claimed first, so that a VM which another process just took from the pool is never deleted
+            if not self.__claim_pooled_vm(proxmox_api, pool_key[2], vmid, f"{self.warm_pool_config['name_prefix']}-expired-{vmid}"):
+                return
+
+            delete_data = proxmox_api.nodes(pool_key[2]).qemu(vmid).delete()
+            self.__wait(proxmox_api, delete_data, pool_key[2], 'delete')
+        except Exception as e:
+            logger.warning(f"Unable to delete expired warm pool VM {vmid}: {e}")
+
+
+    def __refill(self):
+        with self.lock:
+            # Pooled VMs older than max_age are replaced, so that template changes reach the pool
+            for pool_key in self.available_vms:
+                while self.available_vms[pool_key] and self.__is_expired(self.available_vms[pool_key][0]):
+                    self.expired_vms.append((pool_key, self.available_vms[pool_key].pop(0)['vmid']))
+
+            expired_vms, self.expired_vms = self.expired_vms, []
+
+            missing_vms = {}
+
+            for pool_key in self.pool_sizes:
+                missing_vms[pool_key] = self.pool_sizes[pool_key] - len(self.available_vms[pool_key]) - self.cloning[pool_key]
+
+                if missing_vms[pool_key] > 0:
+                    self.cloning[pool_key] += missing_vms[pool_key]
+
+        for pool_key, vmid in expired_vms:
+            self.__delete_pooled_vm(pool_key, vmid)
+
+        for pool_key in missing_vms:
+            for _ in range(max(0, missing_vms[pool_key])):
+                self.refill_executor.submit(self.__clone_pooled_vm, pool_key)
+
+
+    def __refill_loop(self):
+        try:
+            self.__discover_pooled_vms()
+        except Exception as e:
+            logger.warning(f"Unable to discover existing warm pool VMs: {e}")
+
+        while True:
+            try:
+                self.__refill()
+            except Exception as e:
+                logger.exception(f"Unexpected error while refilling the warm pool: {e}")
+
+            self.refill_requested.wait(self.warm_pool_config['refill_interval'])
+            self.refill_requested.clear()
+
+
+    def acquire(self, template, storage, node, name):
+        # Claim a pooled VM and rename it to name; None when the pool has no VM left to claim
+        pool_key = self.pool_key(template, storage, node)
+        proxmox_api = self.__proxmox_api()
+
+        while True:
+            with self.lock:
+                # expired VMs are never handed out, even before the next refill replaces them
+                while self.available_vms.get(pool_key) and self.__is_expired(self.available_vms[pool_key][0]):
+                    self.expired_vms.append((pool_key, self.available_vms[pool_key].pop(0)['vmid']))
+
+                if not self.available_vms.get(pool_key):
+                    pooled_vm = None
+                else:
+                    # hand out the oldest pooled VM first
+                    pooled_vm = self.available_vms[pool_key].pop(0)
+
+            if not pooled_vm:
+                break
+
+            self.refill_requested.set()
+
+            # a VM claimed by another process is dropped, and the next one is tried
+            if self.__claim_pooled_vm(proxmox_api, node, pooled_vm['vmid'], name):
+                return pooled_vm['vmid']
+
+        self.refill_requested.set()
+
+        return None
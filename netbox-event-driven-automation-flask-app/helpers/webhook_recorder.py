@@ -0,0 +1,173 @@
+import atexit
+import glob
+import gzip
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import zlib
+
+logger = logging.getLogger('netbox-proxmox-webhook-listener.webhook_recorder')
+
+webhook_recorders = {}
+webhook_recorders_lock = threading.Lock()
+
+# Only secrets are masked: IP and MAC addresses are kept, so that replayed ipaddress and interface webhooks still parse
+sensitive_keys = {'password', 'token', 'secret'}
+
+
+def get_webhook_recorder(cfg_data, debug=False):
+    webhook_recorder_config = cfg_data.get('webhook_recorder', {}) or {}
+
+    if not webhook_recorder_config.get('enabled', False):
+        return None
+
+    # One recorder (and one writer thread) per corpus file
+    webhook_recorder_key = get_corpus_path(webhook_recorder_config.get('path', 'webhooks.jsonl.gz'))
+
+    with webhook_recorders_lock:
+        if not webhook_recorder_key in webhook_recorders:
+            webhook_recorders[webhook_recorder_key] = NetBoxProxmoxWebhookRecorder(cfg_data, debug)
+
+        return webhook_recorders[webhook_recorder_key]
+
+
+def get_corpus_path(path):
+    # {pid} gives every gunicorn worker process a corpus file of its own
+    return path.replace('{pid}', str(os.getpid()))
+
+
+def sanitize_value(key, value):
+    if key in sensitive_keys:
+        return '***'
+    elif isinstance(value, dict):
+        return {k: sanitize_value(k, v) for k, v in value.items()}
+    elif isinstance(value, list):
+        return [sanitize_value(key, v) for v in value]
+    return value
+
+
+def sanitize_webhook(webhook_json_data):
+    # A sanitized copy: handlers change webhook_json_data (e.g. set proxmox_vmid) after it was recorded
+    return {key: sanitize_value(key, value) for key, value in webhook_json_data.items()}
+
+
+def read_webhook_corpus(paths):
+    # Yields {'received', 'webhook'} records from one or more corpus files (or glob patterns), in the order they were received
+    corpus_records = []
+
+    for path in paths:
+        for corpus_file in sorted(glob.glob(path)) or [path]:
+            with gzip.open(corpus_file, 'rt') as corpus:
+                try:
+                    for line in corpus:
+                        if line.strip():
+                            corpus_records.append(json.loads(line))
+                except (EOFError, zlib.error, json.JSONDecodeError) as e:
+                    # the tail of a corpus whose listener was killed, after the last flush
+                    logger.warning(f"Corpus {corpus_file} is truncated after {len(corpus_records)} webhooks: {e}")
+
+    corpus_records.sort(key=lambda corpus_record: corpus_record['received'])
+
+    return corpus_records
+
+
+class NetBoxProxmoxWebhookRecorder:
+    def __init__(self, cfg_data, debug=False):
+        self.debug = debug
+
+        webhook_recorder_config = cfg_data.get('webhook_recorder', {}) or {}
+
+        self.webhook_recorder_config = {
+            'path': get_corpus_path(webhook_recorder_config.get('path', 'webhooks.jsonl.gz')),
+            'sample_rate': float(webhook_recorder_config.get('sample_rate', 1.0)),
+            'max_bytes': int(webhook_recorder_config.get('max_bytes', 1024 ** 3)),
+            'max_queue_size': int(webhook_recorder_config.get('max_queue_size', 10000)),
+            'compresslevel': int(webhook_recorder_config.get('compresslevel', 6))
+        }
+
+        if not 0 < self.webhook_recorder_config['sample_rate'] <= 1:
+            raise ValueError("'webhook_recorder.sample_rate' must be above 0 and at most 1")
+
+        self.recorded = 0
+        self.dropped = 0
+
+        # sanitized webhook records; None stops the writer
+        self.pending = queue.Queue(self.webhook_recorder_config['max_queue_size'])
+
+        self.writer_thread = threading.Thread(target=self.__writer, name='netbox-proxmox-webhook-recorder', daemon=True)
+        self.writer_thread.start()
+
+        atexit.register(self.close)
+
+
+    def __writer(self):
+        # Appending starts a new gzip member, which gzip readers treat as part of the same file
+        corpus = gzip.open(self.webhook_recorder_config['path'], 'at', compresslevel=self.webhook_recorder_config['compresslevel'])
+        corpus_bytes = os.path.getsize(self.webhook_recorder_config['path'])
+
+        while True:
+            batch = [self.pending.get()]
+
+            while batch[-1] is not None:
+                try:
+                    batch.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = batch[-1] is None
+            records = [record for record in batch if record is not None]
+
+            if records and corpus_bytes < self.webhook_recorder_config['max_bytes']:
+                try:
+                    corpus.write(''.join(json.dumps(record, separators=(',', ':'), default=str) + '\n' for record in records))
+
+                    # once the queue is empty, so that a killed listener loses at most the batch being written
+                    corpus.flush()
+                    corpus_bytes = os.path.getsize(self.webhook_recorder_config['path'])
+                    self.recorded += len(records)
+                except (OSError, TypeError, ValueError):
+                    logger.exception(f"Unable to record {len(records)} webhooks to {self.webhook_recorder_config['path']}")
+
+                if corpus_bytes >= self.webhook_recorder_config['max_bytes']:
+                    logger.warning(f"Webhook corpus {self.webhook_recorder_config['path']} reached {self.webhook_recorder_config['max_bytes']} bytes, no longer recording")
+            elif records:
+                self.dropped += len(records)
+
+            if stop:
+                corpus.close()
+                return
+
+
+    def record(self, webhook_json_data):
+        # Never blocks the webhook: when the writer falls behind, webhooks are dropped from the corpus
+        if self.webhook_recorder_config['sample_rate'] < 1 and random.random() >= self.webhook_recorder_config['sample_rate']:
+            return False
+
+        try:
+            self.pending.put_nowait({'received': time.time(), 'webhook': sanitize_webhook(webhook_json_data)})
+        except queue.Full:
+            self.dropped += 1
+
+            if self.dropped == 1:
+                logger.warning(f"Webhook recorder queue is full ({self.webhook_recorder_config['max_queue_size']} webhooks), dropping webhooks from the corpus")
+
+            return False
+
+        if self.debug:
+            print(f"RECORDED WEBHOOK {webhook_json_data.get('model')} {webhook_json_data.get('event')} to {self.webhook_recorder_config['path']}")
+
+        return True
+
+
+    def stats(self):
+        return {'recorded': self.recorded, 'dropped': self.dropped, 'pending': self.pending.qsize()}
+
+
+    def close(self):
+        if self.writer_thread.is_alive():
+            self.pending.put(None)
+            self.writer_thread.join()
@@ -0,0 +1,104 @@
+import os
+import json
+import hashlib
+import time
+
+
+class ProxmoxDiscoveryState:
+    # cluster/resources fields which change when a guest is (re)configured, moved or started / stopped
+    fingerprint_keys = ('vmid', 'name', 'node', 'type', 'status', 'template', 'maxcpu', 'maxmem', 'maxdisk', 'tags', 'lock', 'hastate')
+
+    def __init__(self, state_file: str, debug: bool = False):
+        self.state_file = state_file
+        self.debug = debug
+
+        self.state = {'version': 1, 'guests': {}}
+        self.unchanged = {}
+
+        if os.path.isfile(self.state_file):
+            try:
+                with open(self.state_file) as state_fh:
+                    loaded_state = json.load(state_fh)
+            except (IOError, ValueError) as e:
+                raise ValueError(f"Unable to read discovery state file {self.state_file}: {e}")
+
+            if loaded_state.get('version') == self.state['version']:
+                self.state = loaded_state
+            else:
+                print(f"WARNING: Ignoring discovery state file {self.state_file} (unknown version)")
+
+
+    @classmethod
+    def fingerprint(cls, proxmox_resource: dict):
+        fingerprint_data = json.dumps({key: proxmox_resource.get(key) for key in cls.fingerprint_keys}, sort_keys=True)
+
+        return hashlib.sha256(fingerprint_data.encode('utf-8')).hexdigest()
+
+
+    def __guests(self, guest_type: str):
+        if not guest_type in self.state['guests']:
+            self.state['guests'][guest_type] = {}
+
+        return self.state['guests'][guest_type]
+
+
+    def guest_changed(self, guest_type: str, guest_name: str, proxmox_resource: dict):
+        guest_state = self.__guests(guest_type).get(guest_name)
+
+        if not guest_state:
+            return True
+
+        if guest_state['fingerprint'] != self.fingerprint(proxmox_resource):
+            return True
+
+        # A guest that was restarted since the last run (uptime went down) may have picked up a new configuration or IP addresses
+        if int(proxmox_resource.get('uptime', 0) or 0) < int(guest_state.get('uptime', 0) or 0):
+            return True
+
+        return False
+
+
+    def get_configuration(self, guest_type: str, guest_name: str):
+        return self.__guests(guest_type)[guest_name]['configuration']
+
+
+    def update(self, guest_type: str, guest_name: str, proxmox_resource: dict, configuration: dict, config_digest: str = None):
+        self.__guests(guest_type)[guest_name] = {
+            'fingerprint': self.fingerprint(proxmox_resource),
+            'uptime': int(proxmox_resource.get('uptime', 0) or 0),
+            'config_digest': config_digest,
+            'configuration': configuration,
+            'updated': int(time.time())
+        }
+
+
+    def touch(self, guest_type: str, guest_name: str, proxmox_resource: dict):
+        # Unchanged guest: only the uptime moves forward
+        self.__guests(guest_type)[guest_name]['uptime'] = int(proxmox_resource.get('uptime', 0) or 0)
+
+        if not guest_type in self.unchanged:
+            self.unchanged[guest_type] = []
+
+        self.unchanged[guest_type].append(guest_name)
+
+
+    def prune(self, guest_type: str, guest_names):
+        # Forget guests which no longer exist in Proxmox
+        guests = self.__guests(guest_type)
+
+        for guest_name in list(guests):
+            if not guest_name in guest_names:
+                del guests[guest_name]
+
+
+    def save(self):
+        state_file_tmp = f"{self.state_file}.tmp"
+
+        with open(state_file_tmp, 'w') as state_fh:
+            json.dump(self.state, state_fh)
+
+        os.replace(state_file_tmp, self.state_file)
+
+        if self.debug:
+            print(f"Saved discovery state to {self.state_file}")
+            print()
@@ -4,7 +4,7 @@ import pynetbox
 import requests
 import time
 
-from . netbox_branches import NetBoxBranches
+from . netbox_session import get_netbox_session
 
 
 def __netbox_make_slug(in_str: str):
@@ -59,37 +59,18 @@ class NetBox:
 
 
     def __init_api(self, options: dict):
-        # Initialize pynetbox API connection
-        try:
-            self.nb = pynetbox.api(self.netbox_url, token=self.netbox_token)
+        if self.debug:
+            print(f"INCOMING OPTIONS __init_api: {options}")
+            print()
 
-            if self.debug:
-                print(f"INCOMING OPTIONS __init_api: {options}")
-                print()
+        # Reuse the pynetbox session and branch activation shared by all NetBox object wrappers
+        if 'netbox_session' in options and options['netbox_session']:
+            netbox_session = options['netbox_session']
+        else:
+            netbox_session = get_netbox_session(self.netbox_url, self.netbox_token, options)
 
-            if 'verify_ssl' in options:
-                self.nb.http_session.verify = options['verify_ssl']
-            else:
-                self.nb.http_session.verify = False
-        except requests.exceptions.SSLError as e:
-            raise ValueError(f"SSL error (pynetbox): {e}")
-        except pynetbox.RequestError as e:
-            raise ValueError(f"pynetbox request error: {e}")
-        except pynetbox.core.query.ContentError as e:
-            raise ValueError(f"pynetbox content error: {e}")
-        except pynetbox.core.query.AllocationError as e:
-            raise ValueError(f"pynetbox allocation error: {e}")
-        except NameError as e:
-            raise ValueError(f"pynetbox name error: {e}")
-
-        if 'branch' in options:
-            branch_timeout = 0
-
-            if 'branch_timeout' in options:
-                branch_timeout = int(options['branch_timeout'])
-
-            self.nbb = NetBoxBranches(self.nb, options['branch'], branch_timeout)
-            self.nbb.activate_branch()        
+        self.nb = netbox_session.nb
+        self.nbb = netbox_session.nbb
 
 
     def findBy(self, key):
@@ -2,10 +2,13 @@ import re
 import pynetbox
 import proxmoxer
 import requests
+import threading
 import urllib
 import urllib.parse
 
+from concurrent.futures import ThreadPoolExecutor
 from proxmoxer import ProxmoxAPI, ResourceException
+from requests.adapters import HTTPAdapter
 from . proxmox_api_common import ProxmoxAPICommon
 
 class NetBoxProxmoxAPIHelper(ProxmoxAPICommon):
@@ -21,9 +24,94 @@ class NetBoxProxmoxAPIHelper(ProxmoxAPICommon):
         self.proxmox_storage_volumes = []
         self.proxmox_lxc_storage_volumes = []
 
+        # cluster/resources entries and config digests, used for incremental discovery
+        self.proxmox_vm_resources = {}
+        self.proxmox_lxc_resources = {}
+        self.proxmox_config_digests = {}
+        self.discovery_state = options.get('discovery_state')
+
+        # Concurrent collection of VM / LXC configurations (1 worker keeps the sequential behavior)
+        self.collection_workers = max(1, int(options.get('collection_workers', 1)))
+        self.collection_node_workers = max(1, int(options.get('collection_node_workers', self.collection_workers)))
+        self.collection_node_semaphores = {}
+        self.collection_node_semaphores_lock = threading.Lock()
+
+        if self.collection_workers > 1:
+            self.__proxmox_mount_connection_pool(self.proxmox_api)
+
+        # Guest agent calls get their own (short) timeout, so that an unresponsive agent does not stall discovery
+        self.proxmox_agent_api = self.proxmox_api
+
+        if options.get('agent_timeout'):
+            self.proxmox_agent_api = ProxmoxAPI(
+                self.proxmox_api_config['api_host'],
+                port=self.proxmox_api_config['api_port'],
+                user=self.proxmox_api_config['api_user'],
+                token_name=self.proxmox_api_config['api_token_id'],
+                token_value=self.proxmox_api_config['api_token_secret'],
+                verify_ssl=self.proxmox_api_config['verify_ssl'],
+                timeout=float(options['agent_timeout'])
+            )
+
+            if self.collection_workers > 1:
+                self.__proxmox_mount_connection_pool(self.proxmox_agent_api)
+
         self.__proxmox_collect_vms()
 
 
+    def __proxmox_mount_connection_pool(self, proxmox_api):
+        http_adapter = HTTPAdapter(pool_connections=len(self.proxmox_nodes) or 1, pool_maxsize=self.collection_workers)
+
+        proxmox_api._store['session'].mount('https://', http_adapter)
+        proxmox_api._store['session'].mount('http://', http_adapter)
+
+
+    def __proxmox_node_semaphore(self, proxmox_node: str):
+        with self.collection_node_semaphores_lock:
+            if not proxmox_node in self.collection_node_semaphores:
+                self.collection_node_semaphores[proxmox_node] = threading.BoundedSemaphore(self.collection_node_workers)
+
+            return self.collection_node_semaphores[proxmox_node]
+
+
+    def __proxmox_run_collection(self, proxmox_guests: dict, collect_configuration):
+        # Results are keyed by guest name, so the merged dict has the same structure whatever the collection order
+        if self.collection_workers == 1:
+            return {proxmox_guest: collect_configuration(proxmox_guest) for proxmox_guest in proxmox_guests}
+
+        def collect_on_node(proxmox_guest):
+            with self.__proxmox_node_semaphore(proxmox_guests[proxmox_guest]['node']):
+                return collect_configuration(proxmox_guest)
+
+        with ThreadPoolExecutor(max_workers=self.collection_workers, thread_name_prefix='proxmox-collect') as executor:
+            return dict(zip(proxmox_guests, executor.map(collect_on_node, proxmox_guests)))
+
+
+    def __proxmox_collect_configurations(self, guest_type: str, proxmox_guests: dict, proxmox_resources: dict, collect_configuration):
+        if not self.discovery_state:
+            return self.__proxmox_run_collection(proxmox_guests, collect_configuration)
+
+        # Incremental discovery: only guests whose cluster/resources entry changed since the last run are collected (and returned)
+        changed_guests = {}
+
+        for proxmox_guest in proxmox_guests:
+            if self.discovery_state.guest_changed(guest_type, proxmox_guest, proxmox_resources[proxmox_guest]):
+                changed_guests[proxmox_guest] = proxmox_guests[proxmox_guest]
+            else:
+                self.discovery_state.touch(guest_type, proxmox_guest, proxmox_resources[proxmox_guest])
+
+        self.discovery_state.prune(guest_type, proxmox_guests)
+
+        proxmox_configurations = self.__proxmox_run_collection(changed_guests, collect_configuration)
+
+        for proxmox_guest in proxmox_configurations:
+            self.discovery_state.update(guest_type, proxmox_guest, proxmox_resources[proxmox_guest], proxmox_configurations[proxmox_guest], self.proxmox_config_digests.get((guest_type, proxmox_guest)))
+
+        print(f"Incremental discovery ({guest_type}): {len(changed_guests)} changed, {len(proxmox_guests) - len(changed_guests)} unchanged")
+
+        return proxmox_configurations
+
+
     def __proxmox_collect_vms(self):
         try:
             proxmox_get_vms = self.proxmox_api.cluster.resources.get(type='vm')
@@ -34,6 +122,9 @@ class NetBoxProxmoxAPIHelper(ProxmoxAPICommon):
                 
                 if proxmox_vm['template']:
                     self.proxmox_vm_templates[proxmox_vm['vmid']] = proxmox_vm['name']
+                elif 'netbox-warm-pool' in str(proxmox_vm.get('tags', '')).split(';'):
+                    # pre-cloned VMs kept by the Flask application's warm pool are not (yet) NetBox VMs
+                    continue
                 else:
                     proxmox_vm_name = proxmox_vm['name']
 
@@ -45,6 +136,7 @@ class NetBoxProxmoxAPIHelper(ProxmoxAPICommon):
                         if not proxmox_vm_name in self.proxmox_vms:
                             self.proxmox_vms[proxmox_vm_name] = {}
 
+                        self.proxmox_vm_resources[proxmox_vm_name] = proxmox_vm
                         self.proxmox_vms[proxmox_vm_name]['node'] = proxmox_vm['node']
                         self.proxmox_vms[proxmox_vm_name]['vmid'] = proxmox_vm['vmid']
 
@@ -56,6 +148,7 @@ class NetBoxProxmoxAPIHelper(ProxmoxAPICommon):
                         if not proxmox_vm['name'] in self.proxmox_lxc:
                             self.proxmox_lxc[proxmox_vm_name] = {}
 
+                        self.proxmox_lxc_resources[proxmox_vm_name] = proxmox_vm
                         self.proxmox_lxc[proxmox_vm_name]['node'] = proxmox_vm['node']
                         self.proxmox_lxc[proxmox_vm_name]['vmid'] = proxmox_vm['vmid']
 
@@ -98,103 +191,110 @@ class NetBoxProxmoxAPIHelper(ProxmoxAPICommon):
         return vm_exists
     
 
-    def proxmox_get_vms_configurations(self):
-        proxmox_vm_configurations = {}
+    def __proxmox_get_vm_configuration(self, proxmox_vm: str):
+        proxmox_vm_configuration = {}
+
+        proxmox_vm_config = self.proxmox_api.nodes(self.proxmox_vms[proxmox_vm]['node']).qemu(self.proxmox_vms[proxmox_vm]['vmid']).config.get()
 
         if self.debug:
-            print("ALL PROXMOX VMS", "NODES", self.proxmox_nodes, "VMS", self.proxmox_vms, "LXC", self.proxmox_lxc)
+            print(" -- CONFIG", proxmox_vm_config)
+
+        self.proxmox_config_digests[('vm', proxmox_vm)] = proxmox_vm_config.get('digest')
 
-        for proxmox_vm in self.proxmox_vms:
-            proxmox_vm_config = self.proxmox_api.nodes(self.proxmox_vms[proxmox_vm]['node']).qemu(self.proxmox_vms[proxmox_vm]['vmid']).config.get()
+        proxmox_vm_configuration['vcpus'] = proxmox_vm_config.get('cores', 1)
+        proxmox_vm_configuration['memory'] = proxmox_vm_config['memory']
+        proxmox_vm_configuration['running'] = self.proxmox_vms[proxmox_vm]['running']
+        proxmox_vm_configuration['node'] = self.proxmox_vms[proxmox_vm]['node']
+        proxmox_vm_configuration['vmid'] = str(self.proxmox_vms[proxmox_vm]['vmid'])
 
-            if self.debug:
-                print(" -- CONFIG", proxmox_vm_config)
+        if self.proxmox_vms[proxmox_vm]['running']: # FIX: MOVE BEFORE TRY AND DECREASE INDENT BUT ONLY IF CLOUD-INIT ENABLED (ide2 in our config)
+            if 'sshkeys' in proxmox_vm_config:
+                proxmox_vm_configuration['public_ssh_key'] = urllib.parse.unquote(proxmox_vm_config['sshkeys'])
 
-            if not proxmox_vm in proxmox_vm_configurations:
-                proxmox_vm_configurations[proxmox_vm] = {}
+            proxmox_vm_disks = []
+            if 'bootdisk' in proxmox_vm_config:
+                proxmox_vm_configuration['bootdisk'] = proxmox_vm_config['bootdisk']
 
-            proxmox_vm_configurations[proxmox_vm]['vcpus'] = proxmox_vm_config.get('cores', 1)
-            proxmox_vm_configurations[proxmox_vm]['memory'] = proxmox_vm_config['memory']
-            proxmox_vm_configurations[proxmox_vm]['running'] = self.proxmox_vms[proxmox_vm]['running']
-            proxmox_vm_configurations[proxmox_vm]['node'] = self.proxmox_vms[proxmox_vm]['node']
-            proxmox_vm_configurations[proxmox_vm]['vmid'] = str(self.proxmox_vms[proxmox_vm]['vmid'])
+                base_disk_name = re.sub(r'\d+$', '', proxmox_vm_config['bootdisk'])
+                proxmox_vm_disks = [key for key in proxmox_vm_config if re.search(r'^%s\d+' % base_disk_name, key)]
 
-            if self.proxmox_vms[proxmox_vm]['running']: # FIX: MOVE BEFORE TRY AND DECREASE INDENT BUT ONLY IF CLOUD-INIT ENABLED (ide2 in our config)
-                if 'sshkeys' in proxmox_vm_config:
-                    proxmox_vm_configurations[proxmox_vm]['public_ssh_key'] = urllib.parse.unquote(proxmox_vm_config['sshkeys'])
+                proxmox_vm_configuration['storage'] = proxmox_vm_config[proxmox_vm_config['bootdisk']].split(':')[0]
 
-                proxmox_vm_disks = []
-                if 'bootdisk' in proxmox_vm_config:
-                    proxmox_vm_configurations[proxmox_vm]['bootdisk'] = proxmox_vm_config['bootdisk']
+            if not 'disks' in proxmox_vm_configuration:
+                proxmox_vm_configuration['disks'] = []
 
-                    base_disk_name = re.sub(r'\d+$', '', proxmox_vm_config['bootdisk'])
-                    proxmox_vm_disks = [key for key in proxmox_vm_config if re.search(r'^%s\d+' % base_disk_name, key)]
+            for proxmox_vm_disk in proxmox_vm_disks:
+                if self.debug:
+                    print(f"PVMD: {proxmox_vm_disk} ||| {proxmox_vm_config[proxmox_vm_disk]}")
+                    print()
 
-                    proxmox_vm_configurations[proxmox_vm]['storage'] = proxmox_vm_config[proxmox_vm_config['bootdisk']].split(':')[0]
+                tmp_disk_name = {}
 
-                if not 'disks' in proxmox_vm_configurations[proxmox_vm]:
-                    proxmox_vm_configurations[proxmox_vm]['disks'] = []
+                disk_info = proxmox_vm_config[proxmox_vm_disk].split(',')[0]
+                storage_volume = disk_info.split(':')[0]
+                disk_size = proxmox_vm_config[proxmox_vm_disk].split(',')[-1]
+                get_disk_size = re.search(r'size=(\d+)([MG]{1})', proxmox_vm_config[proxmox_vm_disk])
 
-                for proxmox_vm_disk in proxmox_vm_disks:
-                    if self.debug:
-                        print(f"PVMD: {proxmox_vm_disk} ||| {proxmox_vm_config[proxmox_vm_disk]}")
-                        print()
+                if self.debug:
+                    print(f"GDS: {get_disk_size}")
+                    print()
 
-                    tmp_disk_name = {}
+                if get_disk_size.group(2) == "M":
+                    disk_size = get_disk_size.group(1)
+                elif get_disk_size.group(2) == "G":
+                    disk_size = int(get_disk_size.group(1)) * 1024
+                else:
+                    raise ValueError(f"Unknown disk size metric: {get_disk_size.group(2)}")
+                
+                if self.debug:
+                    print(f"DISK SIZE: {disk_size}")
+                    print()
+
+                tmp_disk_name[proxmox_vm_disk] = str(disk_size)
+                proxmox_vm_configuration['disks'].append({'disk_name': proxmox_vm_disk, 'disk_size': tmp_disk_name[proxmox_vm_disk], 'proxmox_disk_storage_volume': storage_volume})
+
+            try:
+                self.proxmox_agent_api.nodes(self.proxmox_vms[proxmox_vm]['node']).qemu(self.proxmox_vms[proxmox_vm]['vmid']).agent.ping.post()
+
+                if not 'network_interfaces' in proxmox_vm_configuration:
+                    proxmox_vm_configuration['network_interfaces'] = {}
+
+                if self.debug:
+                    print("    -- NETWORK INTERFACES", self.proxmox_agent_api.nodes(self.proxmox_vms[proxmox_vm]['node']).qemu(self.proxmox_vms[proxmox_vm]['vmid']).agent('network-get-interfaces').get())
+
+                for ni_info in self.proxmox_agent_api.nodes(self.proxmox_vms[proxmox_vm]['node']).qemu(self.proxmox_vms[proxmox_vm]['vmid']).agent('network-get-interfaces').get()['result']:
+                    network_interface_name = ni_info['name']
+                    if not re.search(r'^(lo|docker)', network_interface_name):
+                        if not network_interface_name in proxmox_vm_configuration['network_interfaces']:
+                            proxmox_vm_configuration['network_interfaces'][network_interface_name] = {}
+
+                        proxmox_vm_configuration['network_interfaces'][network_interface_name] = {}
+                        proxmox_vm_configuration['network_interfaces'][network_interface_name]['mac-address'] = ni_info.get('hardware-address', '')
+                        proxmox_vm_configuration['network_interfaces'][network_interface_name]['ip-addresses'] = []
+
+                        for ip_address in ni_info['ip-addresses']:
+                            proxmox_vm_configuration['network_interfaces'][network_interface_name]['ip-addresses'].append(
+                                {
+                                    'type': ip_address['ip-address-type'],
+                                    'ip-address': f"{ip_address['ip-address']}/{ip_address['prefix']}"
+                                }
+                            )
+            except proxmoxer.core.ResourceException as e:
+                if e.status_code == 500 and e.content == 'No QEMU guest agent configured':
+                    print(f"- (SKIPPING) {e.content} for Proxmox VM {self.proxmox_vms[proxmox_vm]['vmid']}")
+                    print()
+            except requests.exceptions.Timeout:
+                print(f"- (SKIPPING) QEMU guest agent did not respond in time for Proxmox VM {self.proxmox_vms[proxmox_vm]['vmid']}")
+                print()
+
+        return proxmox_vm_configuration
 
-                    disk_info = proxmox_vm_config[proxmox_vm_disk].split(',')[0]
-                    storage_volume = disk_info.split(':')[0]
-                    disk_size = proxmox_vm_config[proxmox_vm_disk].split(',')[-1]
-                    get_disk_size = re.search(r'size=(\d+)([MG]{1})', proxmox_vm_config[proxmox_vm_disk])
 
-                    if self.debug:
-                        print(f"GDS: {get_disk_size}")
-                        print()
+    def proxmox_get_vms_configurations(self):
+        if self.debug:
+            print("ALL PROXMOX VMS", "NODES", self.proxmox_nodes, "VMS", self.proxmox_vms, "LXC", self.proxmox_lxc)
 
-                    if get_disk_size.group(2) == "M":
-                        disk_size = get_disk_size.group(1)
-                    elif get_disk_size.group(2) == "G":
-                        disk_size = int(get_disk_size.group(1)) * 1024
-                    else:
-                        raise ValueError(f"Unknown disk size metric: {get_disk_size.group(2)}")
-                    
-                    if self.debug:
-                        print(f"DISK SIZE: {disk_size}")
-                        print()
-
-                    tmp_disk_name[proxmox_vm_disk] = str(disk_size)
-                    proxmox_vm_configurations[proxmox_vm]['disks'].append({'disk_name': proxmox_vm_disk, 'disk_size': tmp_disk_name[proxmox_vm_disk], 'proxmox_disk_storage_volume': storage_volume})
-
-                try:
-                    self.proxmox_api.nodes(self.proxmox_vms[proxmox_vm]['node']).qemu(self.proxmox_vms[proxmox_vm]['vmid']).agent.ping.post()
-
-                    if not 'network_interfaces' in proxmox_vm_configurations[proxmox_vm]:
-                        proxmox_vm_configurations[proxmox_vm]['network_interfaces'] = {}
-
-                    if self.debug:
-                        print("    -- NETWORK INTERFACES", self.proxmox_api.nodes(self.proxmox_vms[proxmox_vm]['node']).qemu(self.proxmox_vms[proxmox_vm]['vmid']).agent('network-get-interfaces').get())
-
-                    for ni_info in self.proxmox_api.nodes(self.proxmox_vms[proxmox_vm]['node']).qemu(self.proxmox_vms[proxmox_vm]['vmid']).agent('network-get-interfaces').get()['result']:
-                        network_interface_name = ni_info['name']
-                        if not re.search(r'^(lo|docker)', network_interface_name):
-                            if not network_interface_name in proxmox_vm_configurations[proxmox_vm]['network_interfaces']:
-                                proxmox_vm_configurations[proxmox_vm]['network_interfaces'][network_interface_name] = {}
-
-                            proxmox_vm_configurations[proxmox_vm]['network_interfaces'][network_interface_name] = {}
-                            proxmox_vm_configurations[proxmox_vm]['network_interfaces'][network_interface_name]['mac-address'] = ni_info.get('hardware-address', '')
-                            proxmox_vm_configurations[proxmox_vm]['network_interfaces'][network_interface_name]['ip-addresses'] = []
-
-                            for ip_address in ni_info['ip-addresses']:
-                                proxmox_vm_configurations[proxmox_vm]['network_interfaces'][network_interface_name]['ip-addresses'].append(
-                                    {
-                                        'type': ip_address['ip-address-type'],
-                                        'ip-address': f"{ip_address['ip-address']}/{ip_address['prefix']}"
-                                    }
-                                )
-                except proxmoxer.core.ResourceException as e:
-                    if e.status_code == 500 and e.content == 'No QEMU guest agent configured':
-                        print(f"- (SKIPPING) {e.content} for Proxmox VM {self.proxmox_vms[proxmox_vm]['vmid']}")
-                        print()
+        proxmox_vm_configurations = self.__proxmox_collect_configurations('vm', self.proxmox_vms, self.proxmox_vm_resources, self.__proxmox_get_vm_configuration)
 
         if self.debug:
             print("PXMXRVM", proxmox_vm_configurations)
@@ -225,96 +325,98 @@ class NetBoxProxmoxAPIHelper(ProxmoxAPICommon):
         return self.proxmox_lxc
 
 
-    def proxmox_get_lxc_configurations(self):
-        proxmox_lxc_configurations = {}
+    def __proxmox_get_lxc_configuration(self, proxmox_lxc: str):
+        proxmox_lxc_configuration = {}
 
-        for proxmox_lxc in self.proxmox_get_lxc():
-            if not proxmox_lxc in proxmox_lxc_configurations:
-                proxmox_lxc_configurations[proxmox_lxc] = {}
+        proxmox_lxc_config = self.proxmox_api.nodes(self.proxmox_lxc[proxmox_lxc]['node']).lxc(self.proxmox_lxc[proxmox_lxc]['vmid']).config.get()
 
-            proxmox_lxc_config = self.proxmox_api.nodes(self.proxmox_lxc[proxmox_lxc]['node']).lxc(self.proxmox_lxc[proxmox_lxc]['vmid']).config.get()
+        self.proxmox_config_digests[('lxc', proxmox_lxc)] = proxmox_lxc_config.get('digest')
 
-            proxmox_lxc_configurations[proxmox_lxc]['vcpus'] = proxmox_lxc_config['cores']
-            proxmox_lxc_configurations[proxmox_lxc]['memory'] = proxmox_lxc_config['memory']
-            proxmox_lxc_configurations[proxmox_lxc]['running'] = self.proxmox_lxc[proxmox_lxc]['running']
-            proxmox_lxc_configurations[proxmox_lxc]['node'] = self.proxmox_lxc[proxmox_lxc]['node']
-            proxmox_lxc_configurations[proxmox_lxc]['vmid'] = str(self.proxmox_lxc[proxmox_lxc]['vmid'])
+        proxmox_lxc_configuration['vcpus'] = proxmox_lxc_config['cores']
+        proxmox_lxc_configuration['memory'] = proxmox_lxc_config['memory']
+        proxmox_lxc_configuration['running'] = self.proxmox_lxc[proxmox_lxc]['running']
+        proxmox_lxc_configuration['node'] = self.proxmox_lxc[proxmox_lxc]['node']
+        proxmox_lxc_configuration['vmid'] = str(self.proxmox_lxc[proxmox_lxc]['vmid'])
 
-            proxmox_lxc_configurations[proxmox_lxc]['is_lxc'] = True
+        proxmox_lxc_configuration['is_lxc'] = True
 
-            if not 'disks' in proxmox_lxc_configurations[proxmox_lxc]:
-                proxmox_lxc_configurations[proxmox_lxc]['disks'] = []
+        if not 'disks' in proxmox_lxc_configuration:
+            proxmox_lxc_configuration['disks'] = []
 
-            if 'rootfs' in proxmox_lxc_config:
-                storage_volume, disk_name, disk_size = sum([part.split(':') for part in proxmox_lxc_config['rootfs'].split(',')], [])
-                del disk_name
+        if 'rootfs' in proxmox_lxc_config:
+            storage_volume, disk_name, disk_size = sum([part.split(':') for part in proxmox_lxc_config['rootfs'].split(',')], [])
+            del disk_name
 
-                get_disk_size = re.search(r'size=(\d+)([MG])$', disk_size)
+            get_disk_size = re.search(r'size=(\d+)([MG])$', disk_size)
 
-                if not get_disk_size:
-                    raise ValueError(f"Unable to find matching disk size for {proxmox_lxc}")
+            if not get_disk_size:
+                raise ValueError(f"Unable to find matching disk size for {proxmox_lxc}")
 
-                if get_disk_size.group(2) == "M":
-                    disk_size = get_disk_size.group(1)
-                elif get_disk_size.group(2) == "G":
-                    disk_size = int(get_disk_size.group(1)) * 1024
-                else:
-                    raise ValueError(f"Unknown disk size metric: {get_disk_size.group(2)}")
+            if get_disk_size.group(2) == "M":
+                disk_size = get_disk_size.group(1)
+            elif get_disk_size.group(2) == "G":
+                disk_size = int(get_disk_size.group(1)) * 1024
+            else:
+                raise ValueError(f"Unknown disk size metric: {get_disk_size.group(2)}")
 
-                proxmox_lxc_configurations[proxmox_lxc]['disks'].append({'disk_name': 'rootfs', 'disk_size': str(disk_size), 'proxmox_disk_storage_volume': storage_volume})
-                
-            if not 'network_interfaces' in proxmox_lxc_configurations[proxmox_lxc]:
-                proxmox_lxc_configurations[proxmox_lxc]['network_interfaces'] = {}
+            proxmox_lxc_configuration['disks'].append({'disk_name': 'rootfs', 'disk_size': str(disk_size), 'proxmox_disk_storage_volume': storage_volume})
+            
+        if not 'network_interfaces' in proxmox_lxc_configuration:
+            proxmox_lxc_configuration['network_interfaces'] = {}
 
-            network_interface_id = 0
+        network_interface_id = 0
 
-            while True:
-                net_interface_name = f"net{network_interface_id}"
+        while True:
+            net_interface_name = f"net{network_interface_id}"
 
-                if not net_interface_name in proxmox_lxc_config and network_interface_id == 0:
-                    raise ValueError(f"Unable to find '{net_interface_name}' for {proxmox_lxc}")
-                elif not net_interface_name in proxmox_lxc_config and network_interface_id > 0:
-                    break
-                
-                ni_info = re.search(r'^name=([^,]+),bridge=[^,]+,firewall=\d{1},gw=([^,]+),hwaddr=([^,]+),ip=([^,]+),', proxmox_lxc_config[net_interface_name])
-                ni_info6 = re.search(r'^name=([^,]+),bridge=[^,]+,firewall=\d{1},gw6=([^,]+),hwaddr=([^,]+),ip6=([^,]+),', proxmox_lxc_config[net_interface_name])
+            if not net_interface_name in proxmox_lxc_config and network_interface_id == 0:
+                raise ValueError(f"Unable to find '{net_interface_name}' for {proxmox_lxc}")
+            elif not net_interface_name in proxmox_lxc_config and network_interface_id > 0:
+                break
+            
+            ni_info = re.search(r'^name=([^,]+),bridge=[^,]+,firewall=\d{1},gw=([^,]+),hwaddr=([^,]+),ip=([^,]+),', proxmox_lxc_config[net_interface_name])
+            ni_info6 = re.search(r'^name=([^,]+),bridge=[^,]+,firewall=\d{1},gw6=([^,]+),hwaddr=([^,]+),ip6=([^,]+),', proxmox_lxc_config[net_interface_name])
 
-                if not ni_info and not ni_info6:
-                    print(f"WARNING: Skipping {proxmox_lxc} - unable to parse network interface (may be DHCP)")
-                    break
-                
-                if ni_info:
-                    if len(ni_info.groups()) != 4:
-                        raise ValueError(f"Incorrect number of fields in '{net_interface_name}' for {proxmox_lxc}")                    
-                    ip_address_type = 'ipv4'
+            if not ni_info and not ni_info6:
+                print(f"WARNING: Skipping {proxmox_lxc} - unable to parse network interface (may be DHCP)")
+                break
+            
+            if ni_info:
+                if len(ni_info.groups()) != 4:
+                    raise ValueError(f"Incorrect number of fields in '{net_interface_name}' for {proxmox_lxc}")                    
+                ip_address_type = 'ipv4'
 
-                if ni_info6:
-                    if len(ni_info6.groups()) != 4:
-                        raise ValueError(f"Incorrect number of fields in '{net_interface_name}' for {proxmox_lxc}")
-                    ip_address_type = 'ipv6'
+            if ni_info6:
+                if len(ni_info6.groups()) != 4:
+                    raise ValueError(f"Incorrect number of fields in '{net_interface_name}' for {proxmox_lxc}")
+                ip_address_type = 'ipv6'
 
-                interface_name = ni_info.group(1)
-                #gateway = ni_info.group(2)
-                mac_address = ni_info.group(3)
-                ip_address = ni_info.group(4)
+            interface_name = ni_info.group(1)
+            #gateway = ni_info.group(2)
+            mac_address = ni_info.group(3)
+            ip_address = ni_info.group(4)
 
-                if not interface_name in proxmox_lxc_configurations[proxmox_lxc]['network_interfaces']:
-                    proxmox_lxc_configurations[proxmox_lxc]['network_interfaces'][interface_name] = {}
+            if not interface_name in proxmox_lxc_configuration['network_interfaces']:
+                proxmox_lxc_configuration['network_interfaces'][interface_name] = {}
 
-                proxmox_lxc_configurations[proxmox_lxc]['network_interfaces'][interface_name] = {}
-                proxmox_lxc_configurations[proxmox_lxc]['network_interfaces'][interface_name]['mac-address'] = mac_address
+            proxmox_lxc_configuration['network_interfaces'][interface_name] = {}
+            proxmox_lxc_configuration['network_interfaces'][interface_name]['mac-address'] = mac_address
 
-                if not 'ip-addresses' in proxmox_lxc_configurations[proxmox_lxc]['network_interfaces'][interface_name]:
-                    proxmox_lxc_configurations[proxmox_lxc]['network_interfaces'][interface_name]['ip-addresses'] = []
+            if not 'ip-addresses' in proxmox_lxc_configuration['network_interfaces'][interface_name]:
+                proxmox_lxc_configuration['network_interfaces'][interface_name]['ip-addresses'] = []
 
-                proxmox_lxc_configurations[proxmox_lxc]['network_interfaces'][interface_name]['ip-addresses'].append(
-                    {
-                        'type': ip_address_type,
-                        'ip-address': ip_address
-                    }
-                )
+            proxmox_lxc_configuration['network_interfaces'][interface_name]['ip-addresses'].append(
+                {
+                    'type': ip_address_type,
+                    'ip-address': ip_address
+                }
+            )
 
-                network_interface_id += 1
+            network_interface_id += 1
 
-        return proxmox_lxc_configurations    
+        return proxmox_lxc_configuration
+
+
+    def proxmox_get_lxc_configurations(self):
+        return self.__proxmox_collect_configurations('lxc', self.proxmox_get_lxc(), self.proxmox_lxc_resources, self.__proxmox_get_lxc_configuration)    
  
@@ -6,6 +6,9 @@ import paramiko
 import pynetbox
 import proxmoxer
 import requests
+import shlex
+
+from concurrent.futures import ThreadPoolExecutor
 import urllib
 import urllib.parse
 
@@ -19,6 +22,17 @@ class NetBoxProxmoxCluster(ProxmoxAPICommon):
         self.cfg_data = cfg_data
         self.discovered_proxmox_nodes_information = {}
 
+        # one SSH session per Proxmox node for the whole discovery run, and the batched probe results per node
+        self.ssh_clients = {}
+        self.proxmox_node_probes = {}
+        self.proxmox_node_network_info = {}
+
+        # seconds, applied to SSH connects and to every read on a node's SSH channel (None: no timeout)
+        self.ssh_timeout = None
+
+        # Proxmox API client for the per-node probe requests, bounded by the node timeout once probe_proxmox_nodes sets one
+        self.proxmox_probe_api = self.proxmox_api
+
         self.ssh_known_hosts_file = '~/.ssh/known_hosts'
 
         if 'ssh_known_hosts_file' in self.cfg_data['proxmox'] and 'proxmox' in self.cfg_data:
@@ -85,10 +99,16 @@ class NetBoxProxmoxCluster(ProxmoxAPICommon):
         self.proxmox_nodes_connection_info = temp_nodes_cn_info
 
 
-    def __get_proxmox_node_info_cmd(self, proxmox_node_info: dict, run_command: str):
-        do_get_pty = False
-        output = None
-        error = None
+    def __get_ssh_client(self, proxmox_node_info: dict):
+        ssh_client_key = (proxmox_node_info['ip'], proxmox_node_info['login'])
+
+        if ssh_client_key in self.ssh_clients:
+            ssh_transport = self.ssh_clients[ssh_client_key].get_transport()
+
+            if ssh_transport and ssh_transport.is_active():
+                return self.ssh_clients[ssh_client_key]
+
+            self.ssh_clients.pop(ssh_client_key).close()
 
         # Create an SSH client instance
         client = paramiko.SSHClient()
@@ -106,6 +126,34 @@ class NetBoxProxmoxCluster(ProxmoxAPICommon):
         #client.set_missing_host_key_policy(paramiko.RejectPolicy())
 
         # Connect to the server
+        try:
+            if 'use_pass' in proxmox_node_info and proxmox_node_info['use_pass']:
+                client.connect(proxmox_node_info['ip'], username=proxmox_node_info['login'], password=proxmox_node_info['pass'], timeout=self.ssh_timeout, banner_timeout=self.ssh_timeout, auth_timeout=self.ssh_timeout)
+            else:
+                client.connect(proxmox_node_info['ip'], username=proxmox_node_info['login'], timeout=self.ssh_timeout, banner_timeout=self.ssh_timeout, auth_timeout=self.ssh_timeout)
+        except Exception:
+            client.close()
+            raise
+
+        if self.debug:
+            print(f"Opened SSH session to {proxmox_node_info['login']}@{proxmox_node_info['ip']}")
+            print()
+
+        self.ssh_clients[ssh_client_key] = client
+
+        return client
+
+
+    def close_ssh_sessions(self):
+        for ssh_client_key in list(self.ssh_clients):
+            self.ssh_clients.pop(ssh_client_key).close()
+
+
+    def __get_proxmox_node_info_cmd(self, proxmox_node_info: dict, run_command: str):
+        do_get_pty = False
+        output = None
+        error = None
+
         try:
             if not 'login' in proxmox_node_info:
                 raise ValueError("'login' field missing in proxmox_node_info")
@@ -123,12 +171,9 @@ class NetBoxProxmoxCluster(ProxmoxAPICommon):
             if 'sudo_pass' in proxmox_node_info and proxmox_node_info['sudo_pass']:
                 do_get_pty = True
 
-            if 'use_pass' in proxmox_node_info and proxmox_node_info['use_pass']:
-                client.connect(proxmox_node_info['ip'], username=proxmox_node_info['login'], password=proxmox_node_info['pass'])
-            else:
-                client.connect(proxmox_node_info['ip'], username=proxmox_node_info['login'])
+            client = self.__get_ssh_client(proxmox_node_info)
 
-            stdin, stdout, stderr = client.exec_command(run_command, get_pty=do_get_pty)
+            stdin, stdout, stderr = client.exec_command(run_command, get_pty=do_get_pty, timeout=self.ssh_timeout)
 
             if 'sudo_pass' in proxmox_node_info and proxmox_node_info['sudo_pass']:
                 stdin.write(proxmox_node_info['sudo_pass'] + '\n')
@@ -149,13 +194,137 @@ class NetBoxProxmoxCluster(ProxmoxAPICommon):
             print(f"SSH connection error: {e}")
         except Exception as e:
             print(f"An unexpected error occurred: {e}")
-        finally:
-            # Close the connection
-            client.close()
 
         return output, error
 
 
+    def __get_proxmox_node_network_info(self, proxmox_node: str):
+        if not proxmox_node in self.proxmox_node_network_info:
+            self.proxmox_node_network_info[proxmox_node] = self.proxmox_probe_api.nodes(proxmox_node).network.get()
+
+        return self.proxmox_node_network_info[proxmox_node]
+
+
+    def __probe_proxmox_node(self, proxmox_node: str):
+        # Run dmidecode, and read the MAC address and ethtool settings of every interface, in one remote script.
+        # Each command's stdout, exit code and stderr are framed by @@@ markers, so they can be split apart again.
+        probe_commands = [('dmidecode', f"{self.cfg_data['proxmox']['node_commands']['dmidecode_command']} -t system")]
+
+        for ni in sorted(self.__get_proxmox_node_network_info(proxmox_node) or [], key=lambda item: item['iface']):
+            interface_mac_addr_file = shlex.quote(f"/sys/class/net/{ni['iface']}/address")
+            probe_commands.append((f"mac:{ni['iface']}", f"/usr/bin/cat {interface_mac_addr_file}"))
+
+            if bool(ni.get('active', 0)) and not ni['iface'].startswith('vmbr'):
+                probe_commands.append((f"ethtool:{ni['iface']}", f"{self.cfg_data['proxmox']['node_commands']['ethtool_command']} {shlex.quote(ni['iface'])}"))
+
+        probe_script = [
+            'probe() { n="$1"; shift; echo "@@@out $n"; "$@" 2>"$e"; echo "@@@rc $n $?"; echo "@@@err $n"; cat "$e"; }',
+            'e=$(mktemp) || exit 1'
+        ]
+
+        for probe_name, probe_command in probe_commands:
+            probe_script.append(f"probe {shlex.quote(probe_name)} {probe_command}")
+
+        probe_script.append('rm -f "$e"')
+
+        output, error = self.__get_proxmox_node_info_cmd(self.proxmox_nodes_connection_info[proxmox_node], f"sh -c {shlex.quote('; '.join(probe_script))}")
+
+        if output is None:
+            raise ValueError(f"Unable to probe Proxmox node {proxmox_node}: {error}")
+
+        probe_results = {}
+        probe_section = None
+
+        for line in output.split('\n'):
+            probe_marker = re.search(r'^@@@(out|rc|err) (\S+)(?: (\d+))?\r?$', line)
+
+            if probe_marker:
+                probe_name = probe_marker.group(2)
+
+                if not probe_name in probe_results:
+                    probe_results[probe_name] = {'output': [], 'error': [], 'rc': None}
+
+                if probe_marker.group(1) == 'rc':
+                    probe_results[probe_name]['rc'] = int(probe_marker.group(3))
+                    probe_section = None
+                else:
+                    probe_section = probe_results[probe_name]['output' if probe_marker.group(1) == 'out' else 'error']
+
+                continue
+
+            if probe_section is not None:
+                probe_section.append(line)
+
+        self.proxmox_node_probes[proxmox_node] = {}
+
+        for probe_name in probe_results:
+            probe_error = '\n'.join(probe_results[probe_name]['error']).strip()
+
+            # A command that failed without writing to stderr must still fail the callers' 'if error' checks
+            if probe_results[probe_name]['rc'] is None and not probe_error:
+                probe_error = f"{probe_name} probe did not finish"
+            elif probe_results[probe_name]['rc'] and not probe_error:
+                probe_error = f"{probe_name} probe exited with status {probe_results[probe_name]['rc']}"
+
+            self.proxmox_node_probes[proxmox_node][probe_name] = (
+                '\n'.join(probe_results[probe_name]['output']) + '\n',
+                probe_error
+            )
+
+        if self.debug:
+            print(f"Probed Proxmox node {proxmox_node}: {sorted(self.proxmox_node_probes[proxmox_node])}")
+            print()
+
+
+    def probe_proxmox_nodes(self, max_workers: int = 1, node_timeout: float = None):
+        # Probe all online nodes (network API and SSH probe) at once; the system information and
+        # network interface collection below then only parse the cached results
+        self.ssh_timeout = node_timeout
+
+        if node_timeout:
+            # a node whose API requests hang fails on its own, instead of holding up the probe pool and the whole run
+            self.proxmox_probe_api = ProxmoxAPI(
+                self.proxmox_api_config['api_host'],
+                port=self.proxmox_api_config['api_port'],
+                user=self.proxmox_api_config['api_user'],
+                token_name=self.proxmox_api_config['api_token_id'],
+                token_value=self.proxmox_api_config['api_token_secret'],
+                verify_ssl=self.proxmox_api_config['verify_ssl'],
+                timeout=node_timeout
+            )
+
+        proxmox_nodes = [proxmox_node for proxmox_node in self.proxmox_nodes_connection_info if 'login' in self.proxmox_nodes_connection_info[proxmox_node]]
+        failed_proxmox_nodes = {}
+
+        def probe_node(proxmox_node):
+            self.__get_proxmox_node_network_info(proxmox_node)
+            self.__probe_proxmox_node(proxmox_node)
+
+        with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='proxmox-node-probe') as executor:
+            probe_futures = {proxmox_node: executor.submit(probe_node, proxmox_node) for proxmox_node in proxmox_nodes}
+
+        for proxmox_node in probe_futures:
+            try:
+                probe_futures[proxmox_node].result()
+            except (ValueError, ResourceException, requests.exceptions.RequestException) as e:
+                failed_proxmox_nodes[proxmox_node] = str(e)
+
+        if failed_proxmox_nodes:
+            raise ValueError(f"Unable to probe Proxmox nodes: {failed_proxmox_nodes}")
+
+        if self.debug:
+            print(f"Probed {len(proxmox_nodes)} Proxmox nodes with {max_workers} workers")
+            print()
+
+
+    def __get_proxmox_node_probe_output(self, proxmox_node: str, probe_name: str, run_command: str):
+        # Output of the batched probe if it covered this command, otherwise run it on its own (pooled) SSH session
+        if probe_name in self.proxmox_node_probes.get(proxmox_node, {}):
+            return self.proxmox_node_probes[proxmox_node][probe_name]
+
+        return self.__get_proxmox_node_info_cmd(self.proxmox_nodes_connection_info[proxmox_node], run_command)
+
+
     def simulate_get_proxmox_nodes_system_information(self):
         pm_nodes_sim_dir = './.simulate/proxmox_nodes'
 
@@ -189,7 +358,10 @@ class NetBoxProxmoxCluster(ProxmoxAPICommon):
             if not proxmox_node in self.discovered_proxmox_nodes_information:
                 self.discovered_proxmox_nodes_information[proxmox_node] = {}
 
-            output, error = self.__get_proxmox_node_info_cmd(self.proxmox_nodes_connection_info[proxmox_node], dmidecode_command)
+            if not proxmox_node in self.proxmox_node_probes:
+                self.__probe_proxmox_node(proxmox_node)
+
+            output, error = self.__get_proxmox_node_probe_output(proxmox_node, 'dmidecode', dmidecode_command)
 
             sys_info_lines = output.split('\n')
 
@@ -248,7 +420,7 @@ class NetBoxProxmoxCluster(ProxmoxAPICommon):
                     self.discovered_proxmox_nodes_information[proxmox_node]['system']['network_interfaces'] = {}
 
                 print(f"PM NODE NI: {proxmox_node} ||| {self.proxmox_nodes_connection_info[proxmox_node]}")
-                node_network_info = self.proxmox_api.nodes(proxmox_node).network.get()
+                node_network_info = self.__get_proxmox_node_network_info(proxmox_node)
 
                 if not node_network_info:
                     raise ValueError(f"Unable to finding network information for {proxmox_node}")
@@ -265,7 +437,7 @@ class NetBoxProxmoxCluster(ProxmoxAPICommon):
                     self.discovered_proxmox_nodes_information[proxmox_node]['system']['network_interfaces'][ni['iface']]['enabled'] = bool(ni['active'])
 
                     interface_mac_addr_cmd = f"/usr/bin/cat /sys/class/net/{ni['iface']}/address"
-                    output, error = self.__get_proxmox_node_info_cmd(self.proxmox_nodes_connection_info[proxmox_node], interface_mac_addr_cmd)
+                    output, error = self.__get_proxmox_node_probe_output(proxmox_node, f"mac:{ni['iface']}", interface_mac_addr_cmd)
 
                     if error:
                         raise ValueError(f"Unable to retrieve mac address for {ni['iface']} on {proxmox_node}: {error}")
@@ -293,7 +465,7 @@ class NetBoxProxmoxCluster(ProxmoxAPICommon):
                         print("  NODE NETWORK INTERFACE", json.dumps(ni, indent=4), "\n", ni['iface'], ni['type'], ni['active'])
 
                     if bool(ni['active']) and not ni['iface'].startswith('vmbr'):
-                        ethtool_info = self.__get_proxmox_node_ethtool_info(self.proxmox_nodes_connection_info[proxmox_node], ni['iface'])
+                        ethtool_info = self.__get_proxmox_node_ethtool_info(proxmox_node, ni['iface'])
 
                         if self.debug:
                             print(f"ethtool output")
@@ -403,10 +575,10 @@ class NetBoxProxmoxCluster(ProxmoxAPICommon):
             mac_addr_first_val += 1
 
 
-    def __get_proxmox_node_ethtool_info(self, proxmox_node_info: dict, network_interface: str):
+    def __get_proxmox_node_ethtool_info(self, proxmox_node: str, network_interface: str):
         ethtool_settings = {}
         ethtool_command = f"{self.cfg_data['proxmox']['node_commands']['ethtool_command']} {network_interface}"
-        output, error = self.__get_proxmox_node_info_cmd(proxmox_node_info, ethtool_command)
+        output, error = self.__get_proxmox_node_probe_output(proxmox_node, f"ethtool:{network_interface}", ethtool_command)
         
         if error:
             raise ValueError(error)
@@ -0,0 +1,59 @@
+import threading
+import pynetbox
+import requests
+
+from . netbox_branches import NetBoxBranches
+
+netbox_sessions = {}
+netbox_sessions_lock = threading.Lock()
+
+
+def get_netbox_session(url: str, token: str, options: dict):
+    # One pynetbox session (and one branch activation) per NetBox URL, token and branch for the whole run
+    session_key = (url, token, options.get('verify_ssl', False), options.get('branch'))
+
+    with netbox_sessions_lock:
+        if not session_key in netbox_sessions:
+            netbox_sessions[session_key] = NetBoxSession(url, token, options)
+
+        return netbox_sessions[session_key]
+
+
+class NetBoxSession:
+    def __init__(self, url: str, token: str, options: dict):
+        self.netbox_url = url
+        self.netbox_token = token
+        self.nbb = None
+
+        self.debug = options.get('debug', False)
+
+        try:
+            self.nb = pynetbox.api(self.netbox_url, token=self.netbox_token)
+
+            if 'verify_ssl' in options:
+                self.nb.http_session.verify = options['verify_ssl']
+            else:
+                self.nb.http_session.verify = False
+        except requests.exceptions.SSLError as e:
+            raise ValueError(f"SSL error (pynetbox): {e}")
+        except pynetbox.RequestError as e:
+            raise ValueError(f"pynetbox request error: {e}")
+        except pynetbox.core.query.ContentError as e:
+            raise ValueError(f"pynetbox content error: {e}")
+        except pynetbox.core.query.AllocationError as e:
+            raise ValueError(f"pynetbox allocation error: {e}")
+        except NameError as e:
+            raise ValueError(f"pynetbox name error: {e}")
+
+        if 'branch' in options:
+            branch_timeout = 0
+
+            if 'branch_timeout' in options:
+                branch_timeout = int(options['branch_timeout'])
+
+            if self.debug:
+                print(f"Activating NetBox branch {options['branch']} for {self.netbox_url}")
+                print()
+
+            self.nbb = NetBoxBranches(self.nb, options['branch'], branch_timeout)
+            self.nbb.activate_branch()
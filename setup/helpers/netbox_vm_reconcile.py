@@ -0,0 +1,445 @@
+import re
+import pynetbox
+
+from . netbox_objects import NetBoxClusterTypes, NetBoxClusters
+
+proxmox_to_netbox_vm_status_mappings = {
+    False: 'offline',
+    True: 'active'
+}
+
+
+def _record_id(value):
+    # pynetbox returns nested objects as Records, bulk responses may also return plain ids or dicts
+    if value is None:
+        return None
+
+    if isinstance(value, int):
+        return value
+
+    if isinstance(value, dict):
+        return value.get('id')
+
+    return getattr(value, 'id', None)
+
+
+def _choice_value(value):
+    if isinstance(value, dict):
+        return value.get('value')
+
+    return getattr(value, 'value', value)
+
+
+# Load the NetBox state for a Proxmox cluster once, diff it against the discovered Proxmox
+# configurations and write only the changes back with NetBox's list-based (bulk) POST and PATCH endpoints
+class NetBoxVMReconciler:
+    def __init__(self, nb_url: str, nb_token: str, nb_options: dict, nb, proxmox_cluster_name: str, cluster_type_name: str, vm_role_id: int, page_size: int = 1000, chunk_size: int = 100):
+        self.nb_url = nb_url
+        self.nb_token = nb_token
+        self.nb_options = nb_options
+        self.nb = nb
+
+        self.debug = nb_options['debug']
+
+        self.proxmox_cluster_name = proxmox_cluster_name
+        self.cluster_type_name = cluster_type_name
+        self.vm_role_id = vm_role_id
+
+        self.page_size = page_size
+        self.chunk_size = chunk_size
+
+        self.cluster_id = None
+
+        # in-memory indexes of the NetBox state
+        self.netbox_vms = {}           # name -> Record
+        self.netbox_interfaces = {}    # (vm id, interface name) -> Record
+        self.netbox_mac_addresses = {} # (interface id, mac address) -> Record
+        self.netbox_ip_addresses = {}  # address -> Record
+        self.netbox_disks = {}         # (vm id, disk name) -> Record
+
+        self.stats = {
+            'vms_created': 0,
+            'vms_updated': 0,
+            'interfaces_created': 0,
+            'interfaces_updated': 0,
+            'mac_addresses_created': 0,
+            'ip_addresses_created': 0,
+            'ip_addresses_updated': 0,
+            'disks_created': 0
+        }
+
+
+    @staticmethod
+    def make_slug(in_str: str):
+        return re.sub(r'\W+', '-', in_str).lower()
+
+
+    @staticmethod
+    def normalize_ip_address(ip_address: str):
+        # Skip invalid IP addresses (no prefix or /0 mask)
+        if not ip_address or not '/' in ip_address or ip_address.endswith('/0'):
+            return None
+
+        # Strip IPv6 zone ID (e.g., %5) if present
+        if '%' in ip_address:
+            ip_address = re.sub(r'%[^/]+', '', ip_address)
+
+        return ip_address
+
+
+    def __chunks(self, items: list):
+        for i in range(0, len(items), self.chunk_size):
+            yield items[i:i + self.chunk_size]
+
+
+    def __filter_chunked(self, endpoint, key: str, values: list):
+        records = []
+
+        for values_chunk in self.__chunks(sorted(set(values))):
+            records.extend(list(endpoint.filter(**{key: values_chunk}, limit=self.page_size)))
+
+        return records
+
+
+    def __bulk_create(self, endpoint, payloads: list):
+        created = []
+
+        for payloads_chunk in self.__chunks(payloads):
+            result = endpoint.create(payloads_chunk)
+
+            if not isinstance(result, list):
+                result = [result]
+
+            created.extend(result)
+
+        return created
+
+
+    def __bulk_update(self, endpoint, payloads: list):
+        updated = []
+
+        for payloads_chunk in self.__chunks(payloads):
+            result = endpoint.update(payloads_chunk)
+
+            if not isinstance(result, list):
+                result = [result]
+
+            updated.extend(result)
+
+        return updated
+
+
+    def __ensure_cluster(self):
+        cluster_type_obj = NetBoxClusterTypes(self.nb_url, self.nb_token, self.nb_options, {'name': self.cluster_type_name, 'slug': self.make_slug(self.cluster_type_name)})
+        cluster_type_id = dict(cluster_type_obj.obj)['id']
+
+        cluster_payload = {
+            'name': self.proxmox_cluster_name,
+            'type': cluster_type_id,
+            'status': 'active'
+        }
+
+        cluster_obj = NetBoxClusters(self.nb_url, self.nb_token, self.nb_options, cluster_payload)
+        self.cluster_id = dict(cluster_obj.obj)['id']
+
+
+    def load(self, vm_configurations: dict):
+        try:
+            self.__ensure_cluster()
+
+            for netbox_vm in self.nb.virtualization.virtual_machines.filter(cluster_id=self.cluster_id, limit=self.page_size):
+                self.netbox_vms[netbox_vm.name] = netbox_vm
+
+            # Like the per-object path, a discovered VM matches a NetBox VM of the same name in any (or no) cluster,
+            # which is then moved to this cluster instead of being created a second time
+            other_netbox_vm_ids = []
+
+            for netbox_vm in self.__filter_chunked(self.nb.virtualization.virtual_machines, 'name', [vm_name for vm_name in vm_configurations if not vm_name in self.netbox_vms]):
+                if not netbox_vm.name in self.netbox_vms:
+                    self.netbox_vms[netbox_vm.name] = netbox_vm
+                    other_netbox_vm_ids.append(netbox_vm.id)
+
+            for netbox_interface in self.nb.virtualization.interfaces.filter(cluster_id=self.cluster_id, limit=self.page_size):
+                self.netbox_interfaces[(_record_id(netbox_interface.virtual_machine), netbox_interface.name)] = netbox_interface
+
+            for netbox_interface in self.__filter_chunked(self.nb.virtualization.interfaces, 'virtual_machine_id', other_netbox_vm_ids):
+                self.netbox_interfaces[(_record_id(netbox_interface.virtual_machine), netbox_interface.name)] = netbox_interface
+
+            for netbox_mac_address in self.__filter_chunked(self.nb.dcim.mac_addresses, 'vminterface_id', [netbox_interface.id for netbox_interface in self.netbox_interfaces.values()]):
+                self.netbox_mac_addresses[(netbox_mac_address.assigned_object_id, str(netbox_mac_address.mac_address).lower())] = netbox_mac_address
+
+            discovered_ip_addresses = []
+
+            for vm_configuration in vm_configurations.values():
+                for network_interface in vm_configuration.get('network_interfaces', {}).values():
+                    for ip_address_entry in network_interface.get('ip-addresses', []):
+                        ip_address = self.normalize_ip_address(ip_address_entry['ip-address'])
+
+                        if ip_address:
+                            discovered_ip_addresses.append(ip_address)
+
+            for netbox_ip_address in self.__filter_chunked(self.nb.ipam.ip_addresses, 'address', discovered_ip_addresses):
+                if not netbox_ip_address.address in self.netbox_ip_addresses:
+                    self.netbox_ip_addresses[netbox_ip_address.address] = netbox_ip_address
+
+            for netbox_disk in self.__filter_chunked(self.nb.virtualization.virtual_disks, 'virtual_machine_id', [netbox_vm.id for netbox_vm in self.netbox_vms.values()]):
+                self.netbox_disks[(_record_id(netbox_disk.virtual_machine), netbox_disk.name)] = netbox_disk
+        except pynetbox.RequestError as e:
+            raise ValueError(e, e.error)
+
+        if self.debug:
+            print(f"RECONCILE LOADED: {len(self.netbox_vms)} VMs, {len(self.netbox_interfaces)} interfaces, {len(self.netbox_mac_addresses)} MAC addresses, {len(self.netbox_ip_addresses)} IP addresses, {len(self.netbox_disks)} disks")
+            print()
+
+
+    def __desired_vm(self, vm_name: str, vm_configuration: dict, tag_id: int):
+        desired_vm = {
+            'name': vm_name,
+            'cluster': self.cluster_id,
+            'vcpus': vm_configuration['vcpus'],
+            'memory': int(vm_configuration['memory']),
+            'role': self.vm_role_id,
+            'status': proxmox_to_netbox_vm_status_mappings[vm_configuration['running']],
+            'custom_fields': {}
+        }
+
+        if tag_id > 0:
+            desired_vm['tags'] = [tag_id]
+
+        for vm_configuration_key, custom_field in (('node', 'proxmox_node'), ('public_ssh_key', 'proxmox_public_ssh_key'), ('storage', 'proxmox_vm_storage'), ('vmid', 'proxmox_vmid')):
+            if vm_configuration_key in vm_configuration:
+                desired_vm['custom_fields'][custom_field] = vm_configuration[vm_configuration_key]
+
+        desired_vm['custom_fields']['proxmox_vm_type'] = 'lxc' if 'is_lxc' in vm_configuration else 'vm'
+
+        # Don't take the default template (jammy, currently) for dicovered VM and LXC
+        desired_vm['custom_fields']['proxmox_vm_templates'] = ''
+
+        return desired_vm
+
+
+    def __vm_changes(self, netbox_vm, desired_vm: dict):
+        changes = {}
+
+        if netbox_vm.vcpus is None or float(netbox_vm.vcpus) != float(desired_vm['vcpus']):
+            changes['vcpus'] = desired_vm['vcpus']
+
+        if netbox_vm.memory != desired_vm['memory']:
+            changes['memory'] = desired_vm['memory']
+
+        if _record_id(netbox_vm.role) != desired_vm['role']:
+            changes['role'] = desired_vm['role']
+
+        if _record_id(netbox_vm.cluster) != desired_vm['cluster']:
+            changes['cluster'] = desired_vm['cluster']
+
+        if _choice_value(netbox_vm.status) != desired_vm['status']:
+            changes['status'] = desired_vm['status']
+
+        netbox_custom_fields = dict(netbox_vm.custom_fields or {})
+        changed_custom_fields = {key: value for key, value in desired_vm['custom_fields'].items() if str(netbox_custom_fields.get(key) or '') != str(value or '')}
+
+        if changed_custom_fields:
+            changes['custom_fields'] = changed_custom_fields
+
+        return changes
+
+
+    def __reconcile_vms(self, vm_configurations: dict, tagged_vm_names: set, tag_id: int):
+        vms_to_create = []
+        vms_to_update = []
+
+        for vm_name, vm_configuration in vm_configurations.items():
+            desired_vm = self.__desired_vm(vm_name, vm_configuration, tag_id if vm_name in tagged_vm_names else 0)
+
+            if not vm_name in self.netbox_vms:
+                vms_to_create.append(desired_vm)
+                continue
+
+            changes = self.__vm_changes(self.netbox_vms[vm_name], desired_vm)
+
+            if changes:
+                changes['id'] = self.netbox_vms[vm_name].id
+                vms_to_update.append(changes)
+
+        for netbox_vm in self.__bulk_create(self.nb.virtualization.virtual_machines, vms_to_create):
+            self.netbox_vms[netbox_vm.name] = netbox_vm
+
+        for netbox_vm in self.__bulk_update(self.nb.virtualization.virtual_machines, vms_to_update):
+            self.netbox_vms[netbox_vm.name] = netbox_vm
+
+        self.stats['vms_created'] += len(vms_to_create)
+        self.stats['vms_updated'] += len(vms_to_update)
+
+
+    def __reconcile_interfaces(self, vm_configurations: dict):
+        interfaces_to_create = []
+
+        for vm_name, vm_configuration in vm_configurations.items():
+            netbox_vm_id = self.netbox_vms[vm_name].id
+
+            for network_interface_name in vm_configuration.get('network_interfaces', {}):
+                if not (netbox_vm_id, network_interface_name) in self.netbox_interfaces:
+                    interfaces_to_create.append({'virtual_machine': netbox_vm_id, 'name': network_interface_name, 'enabled': True})
+
+        for netbox_interface in self.__bulk_create(self.nb.virtualization.interfaces, interfaces_to_create):
+            self.netbox_interfaces[(_record_id(netbox_interface.virtual_machine), netbox_interface.name)] = netbox_interface
+
+        self.stats['interfaces_created'] += len(interfaces_to_create)
+
+        # MAC addresses are separate objects, assigned to the interface and referenced as its primary MAC address
+        mac_addresses_to_create = []
+
+        for vm_name, vm_configuration in vm_configurations.items():
+            netbox_vm_id = self.netbox_vms[vm_name].id
+
+            for network_interface_name, network_interface in vm_configuration.get('network_interfaces', {}).items():
+                mac_address = str(network_interface.get('mac-address') or '').lower()
+                netbox_interface = self.netbox_interfaces[(netbox_vm_id, network_interface_name)]
+
+                if mac_address and not (netbox_interface.id, mac_address) in self.netbox_mac_addresses:
+                    mac_addresses_to_create.append({
+                        'mac_address': mac_address,
+                        'assigned_object_type': 'virtualization.vminterface',
+                        'assigned_object_id': netbox_interface.id
+                    })
+
+        for netbox_mac_address in self.__bulk_create(self.nb.dcim.mac_addresses, mac_addresses_to_create):
+            self.netbox_mac_addresses[(netbox_mac_address.assigned_object_id, str(netbox_mac_address.mac_address).lower())] = netbox_mac_address
+
+        self.stats['mac_addresses_created'] += len(mac_addresses_to_create)
+
+        interfaces_to_update = []
+
+        for vm_name, vm_configuration in vm_configurations.items():
+            netbox_vm_id = self.netbox_vms[vm_name].id
+
+            for network_interface_name, network_interface in vm_configuration.get('network_interfaces', {}).items():
+                mac_address = str(network_interface.get('mac-address') or '').lower()
+                netbox_interface = self.netbox_interfaces[(netbox_vm_id, network_interface_name)]
+                changes = {}
+
+                if not netbox_interface.enabled:
+                    changes['enabled'] = True
+
+                if mac_address:
+                    netbox_mac_address_id = self.netbox_mac_addresses[(netbox_interface.id, mac_address)].id
+
+                    if _record_id(getattr(netbox_interface, 'primary_mac_address', None)) != netbox_mac_address_id:
+                        changes['primary_mac_address'] = netbox_mac_address_id
+
+                if changes:
+                    changes['id'] = netbox_interface.id
+                    interfaces_to_update.append(changes)
+
+        self.__bulk_update(self.nb.virtualization.interfaces, interfaces_to_update)
+        self.stats['interfaces_updated'] += len(interfaces_to_update)
+
+
+    def __reconcile_ip_addresses(self, vm_configurations: dict):
+        ip_addresses_to_create = []
+        ip_addresses_to_update = []
+        primary_ip_addresses = {}
+        claimed_ip_addresses = set()
+
+        for vm_name, vm_configuration in vm_configurations.items():
+            netbox_vm_id = self.netbox_vms[vm_name].id
+
+            for network_interface_name, network_interface in vm_configuration.get('network_interfaces', {}).items():
+                netbox_interface_id = self.netbox_interfaces[(netbox_vm_id, network_interface_name)].id
+
+                for ip_address_entry in network_interface.get('ip-addresses', []):
+                    ip_address = self.normalize_ip_address(ip_address_entry['ip-address'])
+
+                    if not ip_address:
+                        continue
+
+                    if network_interface_name in ('eth0', 'net0') and not ip_address.endswith('/64') and not ':' in ip_address:
+                        primary_ip_addresses[vm_name] = ip_address
+
+                    # an address reported by several guests (e.g. link-local) is only created or assigned once per run
+                    if ip_address in claimed_ip_addresses:
+                        continue
+
+                    claimed_ip_addresses.add(ip_address)
+
+                    desired_ip_address = {
+                        'address': ip_address,
+                        'status': 'active',
+                        'assigned_object_type': 'virtualization.vminterface',
+                        'assigned_object_id': netbox_interface_id
+                    }
+
+                    if not ip_address in self.netbox_ip_addresses:
+                        ip_addresses_to_create.append(desired_ip_address)
+                    else:
+                        netbox_ip_address = self.netbox_ip_addresses[ip_address]
+
+                        if netbox_ip_address.assigned_object_type != 'virtualization.vminterface' or netbox_ip_address.assigned_object_id != netbox_interface_id or _choice_value(netbox_ip_address.status) != 'active':
+                            desired_ip_address['id'] = netbox_ip_address.id
+                            ip_addresses_to_update.append(desired_ip_address)
+
+        for netbox_ip_address in self.__bulk_create(self.nb.ipam.ip_addresses, ip_addresses_to_create):
+            self.netbox_ip_addresses[netbox_ip_address.address] = netbox_ip_address
+
+        self.__bulk_update(self.nb.ipam.ip_addresses, ip_addresses_to_update)
+
+        self.stats['ip_addresses_created'] += len(ip_addresses_to_create)
+        self.stats['ip_addresses_updated'] += len(ip_addresses_to_update)
+
+        vms_to_update = []
+
+        for vm_name, ip_address in primary_ip_addresses.items():
+            netbox_ip_address = self.netbox_ip_addresses.get(ip_address)
+
+            if netbox_ip_address is None:
+                continue
+
+            if _record_id(self.netbox_vms[vm_name].primary_ip4) != netbox_ip_address.id:
+                print(f"Setting primary IP address on VM {vm_name} to {ip_address}")
+                vms_to_update.append({'id': self.netbox_vms[vm_name].id, 'primary_ip4': netbox_ip_address.id})
+
+        self.__bulk_update(self.nb.virtualization.virtual_machines, vms_to_update)
+        self.stats['vms_updated'] += len(vms_to_update)
+
+
+    def __reconcile_disks(self, vm_configurations: dict):
+        disks_to_create = []
+
+        for vm_name, vm_configuration in vm_configurations.items():
+            netbox_vm_id = self.netbox_vms[vm_name].id
+
+            for vm_disk in vm_configuration.get('disks', []):
+                if not (netbox_vm_id, vm_disk['disk_name']) in self.netbox_disks:
+                    print(f"Adding virtual disk {vm_disk['disk_name']} (vol: {vm_disk['proxmox_disk_storage_volume']}) VM {vm_name}")
+
+                    disks_to_create.append({
+                        'virtual_machine': netbox_vm_id,
+                        'name': vm_disk['disk_name'],
+                        'size': int(vm_disk['disk_size']),
+                        'custom_fields': {
+                            'proxmox_disk_storage_volume': vm_disk['proxmox_disk_storage_volume']
+                        }
+                    })
+
+        for netbox_disk in self.__bulk_create(self.nb.virtualization.virtual_disks, disks_to_create):
+            self.netbox_disks[(_record_id(netbox_disk.virtual_machine), netbox_disk.name)] = netbox_disk
+
+        self.stats['disks_created'] += len(disks_to_create)
+
+
+    def reconcile(self, vm_configurations: dict, tagged_vm_names: set = None, tag_id: int = 0):
+        if tagged_vm_names is None:
+            tagged_vm_names = set()
+
+        try:
+            self.__reconcile_vms(vm_configurations, tagged_vm_names, tag_id)
+            self.__reconcile_interfaces(vm_configurations)
+            self.__reconcile_ip_addresses(vm_configurations)
+            self.__reconcile_disks(vm_configurations)
+        except pynetbox.RequestError as e:
+            raise ValueError(e, e.error)
+
+        print(f"Reconciled {len(vm_configurations)} Proxmox guests with NetBox: {self.stats}")
+
+        return self.stats
@@ -11,8 +11,11 @@ import pynetbox
 import proxmoxer
 import urllib3
 
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from helpers.netbox_proxmox_cluster import NetBoxProxmoxCluster
 #from helpers.netbox_proxmox_api import NetBoxProxmoxAPIHelper
+from helpers.netbox_session import get_netbox_session
 from helpers.netbox_objects import __netbox_make_slug, NetBox, NetBoxSites, NetBoxManufacturers, NetBoxPlatforms, NetBoxTags, NetBoxDeviceRoles, NetBoxDeviceTypes, NetBoxDeviceTypesInterfaceTemplates, NetBoxDevices, NetBoxDevicesInterfaces, NetBoxDeviceInterface, NetBoxDeviceBridgeInterface, NetBoxObjectInterfaceMacAddressMapping, NetBoxClusterTypes, NetBoxClusters, NetBoxClusterGroups, NetBoxVirtualMachines, NetBoxVirtualMachineInterface, NetBoxIPAddresses
 
 from proxmoxer import ProxmoxAPI, ResourceException
@@ -27,6 +30,8 @@ def get_arguments():
     parser.add_argument("--config", required=True, help="YAML file containing the configuration")
     parser.add_argument("--debug", action='store_true', default=False, help="Enable debug (verbose) output")
     parser.add_argument("--simulate", action='store_true', default=False, help="Simulate device collection.  DO NOT USE.  INTERNAL ONLY!")
+    parser.add_argument("--workers", type=int, default=1, help="Number of Proxmox nodes probed and written to NetBox concurrently (default: 1)")
+    parser.add_argument("--node-timeout", type=float, default=None, help="Timeout in seconds for SSH connects and reads, and for Proxmox API requests, on each Proxmox node (default: none)")
 
     # Parse the arguments
     args = parser.parse_args()
@@ -82,6 +87,176 @@ def get_proxmox_node_vmbr_network_interface_mapping(proxmox_api_config: dict, pr
     return {}
 
 
+def netbox_create_proxmox_node_device(nb_url: str, app_config: dict, nb_options: dict, nb_pxmx_cluster: NetBoxProxmoxCluster, proxmox_node: str, netbox_device_role_id: int, netbox_device_type_id: int, netbox_site_id: int, netbox_platform_id: int, netbox_cluster_id: int, DEBUG: bool = False):
+    collected_netbox_interface_ids = {proxmox_node: {}}
+
+    for network_interface in nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']['network_interfaces']:
+        collected_netbox_interface_ids[proxmox_node][network_interface] = {}
+
+    # Create Device in NetBox
+    try:
+        device_serial = None
+
+        if 'serial_number' in nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']:
+            nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']['serial'] = nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system'].pop('serial_number')
+
+        system_info = nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']
+
+        device_serial = system_info.get('serial')
+
+        # If no serial or empty string, use a generated one or skip
+        if not device_serial or device_serial.strip() == '':
+            if DEBUG:
+                print(f"Warning: No serial found for {proxmox_node}, creating device without serial")
+
+        device_payload = {
+            'name': proxmox_node,
+            'role': netbox_device_role_id,
+            'device_type': netbox_device_type_id,
+            'site': netbox_site_id,
+            'platform': netbox_platform_id,
+            'cluster': netbox_cluster_id,
+            'status': 'active'
+        }
+
+        # Only add serial number if it exists
+        if device_serial:
+            device_payload['serial'] = device_serial
+
+        netbox_device_id = dict(NetBoxDevices(nb_url, app_config['netbox_api_config']['api_token'], nb_options, device_payload).obj)['id']
+    except pynetbox.RequestError as e:
+        raise ValueError(e, e.error)
+
+    if not netbox_device_id:
+        raise ValueError(f"NetBox missing device id for {proxmox_node}, device type id {netbox_device_type_id}")
+
+    # Create device interfaces in NetBox
+    if DEBUG:
+        print("Adding device interfaces to NetBox")
+        print()
+
+    for network_interface in nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']['network_interfaces']:
+        if 'bridge_ports' in nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']['network_interfaces'][network_interface]:
+            continue
+
+        if DEBUG:
+            print(f"+ Going to try and create network interface {network_interface} for device {netbox_device_id} ({proxmox_node}) in NetBox")
+
+        interface_payload = {
+            'device': netbox_device_id,
+            'name': network_interface,
+            'type': convert_proxmox_interface_type_to_netbox(nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']['network_interfaces'][network_interface]['type']),
+            'enabled': nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']['network_interfaces'][network_interface]['enabled']
+        }
+
+        if DEBUG:
+            print("  Interface payload", interface_payload)
+            print()
+
+        netbox_network_interface_id = dict(NetBoxDeviceInterface(nb_url, app_config['netbox_api_config']['api_token'], nb_options, interface_payload).obj)['id']
+        collected_netbox_interface_ids[proxmox_node][network_interface] = netbox_network_interface_id
+
+        if DEBUG:
+            print("Collected NetBox Interface IDs", collected_netbox_interface_ids)
+            print()
+
+    # Create device (bridge) interfaces in NetBox
+    if DEBUG:
+        print("Adding device (bridge) interfaces to NetBox")
+        print()
+
+    for network_interface in nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']['network_interfaces']:
+        if 'bridge_ports' in nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']['network_interfaces'][network_interface]:
+            if DEBUG:
+                print(f"+ Going to try and create network (bridge) interface {network_interface} for device {netbox_device_id} ({proxmox_node}) in NetBox")
+                print()
+
+            interface_payload = {
+                'device': netbox_device_id,
+                'name': network_interface,
+                'type': nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']['network_interfaces'][network_interface]['type'],
+                'bridge': collected_netbox_interface_ids[proxmox_node][nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']['network_interfaces'][network_interface]['bridge_ports']],
+                'enabled': nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']['network_interfaces'][network_interface]['enabled']
+            }
+
+            if DEBUG:
+                print("  Bridge interface payload", interface_payload)
+                print()
+
+            netbox_network_interface_id = dict(NetBoxDeviceInterface(nb_url, app_config['netbox_api_config']['api_token'], nb_options, interface_payload).obj)['id']
+            collected_netbox_interface_ids[proxmox_node][network_interface] = netbox_network_interface_id
+
+            if DEBUG:
+                print("  Collected NetBox (bridge) interface ids", collected_netbox_interface_ids)
+                print()
+
+    # Now assign IP addresses amd MAC addresses to interfaces in NetBox
+    if DEBUG:
+        print("Assigning IP addresses and MAC addresses to device interfaces")
+        print()
+
+    for network_interface in nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']['network_interfaces']:
+        if network_interface in collected_netbox_interface_ids[proxmox_node]:
+            nb_nw_if_id = collected_netbox_interface_ids[proxmox_node][network_interface]
+
+            if 'ipv4address' in nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']['network_interfaces'][network_interface]:
+                nb_ipv4_address = nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']['network_interfaces'][network_interface]['ipv4address']
+
+                if DEBUG:
+                    print(f"Attempting to assign (v4) IP {nb_ipv4_address} to {network_interface} on {proxmox_node}")
+                    print()
+
+                nb_assign_ip_address_payload = {
+                    'address': nb_ipv4_address,
+                    'status': 'active',
+                    'assigned_object_type': 'dcim.interface',
+                    'assigned_object_id': str(nb_nw_if_id)
+                }
+
+                try:
+                    NetBoxIPAddresses(nb_url, app_config['netbox_api_config']['api_token'], nb_options, nb_assign_ip_address_payload, 'address')
+                except pynetbox.RequestError as e:
+                    raise ValueError(e, e.error)
+
+            if 'ipv6address' in nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']['network_interfaces'][network_interface]:
+                nb_ipv6_address = nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']['network_interfaces'][network_interface]['ipv6address']
+
+                if DEBUG:
+                    print(f"Attempting to assign (v6) IP {nb_ipv6_address} to {network_interface} on {proxmox_node}")
+                    print()
+                    
+                nb_assign_ip_address_payload = {
+                    'address': nb_ipv6_address,
+                    'status': 'active',
+                    'assigned_object_type': 'dcim.interface',
+                    'assigned_object_id': str(nb_nw_if_id)
+                }
+
+                try:
+                    NetBoxIPAddresses(nb_url, app_config['netbox_api_config']['api_token'], nb_options, nb_assign_ip_address_payload, 'address')
+                except pynetbox.RequestError as e:
+                    raise ValueError(e, e.error)
+                
+            if 'mac' in nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']['network_interfaces'][network_interface]:
+                nb_mac_address = nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']['network_interfaces'][network_interface]['mac']
+
+                if DEBUG:
+                    print(f"Attempting to assign MAC address {nb_mac_address} to {network_interface} on {proxmox_node}")
+                    print()
+                    
+                nb_assign_mac_address_payload = {
+                    'mac': nb_mac_address,
+                    'enabled': nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']['network_interfaces'][network_interface]['enabled']
+                }
+
+                try:
+                    NetBoxObjectInterfaceMacAddressMapping(nb_url, app_config['netbox_api_config']['api_token'], nb_options, 'dcim.interface', netbox_device_id, network_interface, nb_assign_mac_address_payload)
+                except pynetbox.RequestError as e:
+                    raise ValueError(e, e.error)
+
+    return collected_netbox_interface_ids[proxmox_node]
+
+
 def main():
     default_proxmox_cluster_type = 'Proxmox'
     discovered_proxmox_nodes_information = {}
@@ -124,6 +299,12 @@ def main():
     
     nb_options['debug'] = DEBUG
     nb_options['simulate'] = SIMULATE
+
+    if args.workers > 1:
+        # enough keep-alive connections in the shared NetBox session for all node workers
+        netbox_http_session = get_netbox_session(nb_url, app_config['netbox_api_config']['api_token'], nb_options).nb.http_session
+        netbox_http_session.mount('https://', HTTPAdapter(pool_maxsize=args.workers))
+        netbox_http_session.mount('http://', HTTPAdapter(pool_maxsize=args.workers))
     
     nb_pxmx_cluster = NetBoxProxmoxCluster(app_config, nb_options)
 
@@ -138,8 +319,12 @@ def main():
         proxmox_nodes_connection_info = nb_pxmx_cluster.proxmox_nodes_connection_info
 
         # discover nodes base system information
+        if args.workers > 1 or args.node_timeout:
+            nb_pxmx_cluster.probe_proxmox_nodes(args.workers, args.node_timeout)
+
         nb_pxmx_cluster.get_proxmox_nodes_system_information()
         nb_pxmx_cluster.get_proxmox_nodes_network_interfaces()    
+        nb_pxmx_cluster.close_ssh_sessions()
     else:
         print("*** IN SIMULATE MODE ***")
         nb_pxmx_cluster.simulate_get_proxmox_nodes_system_information()
@@ -184,7 +369,9 @@ def main():
 
     collected_netbox_device_type_ids = {}
     collected_netbox_interface_ids = {}
+    collected_netbox_platform_ids = {}
 
+    # Objects shared between nodes (manufacturer, platform, device role and type) are created one node after another
     for proxmox_node in discovered_proxmox_nodes_information:
         # Create Manufacturer in NetBox
         try:
@@ -200,6 +387,7 @@ def main():
         try:
             proxmox_version = nb_pxmx_cluster.proxmox_nodes[proxmox_node]['version']
             netbox_platform_id = dict(NetBoxPlatforms(nb_url, app_config['netbox_api_config']['api_token'], nb_options, {'name': proxmox_version, 'slug': __netbox_make_slug(proxmox_version)}).obj)['id']
+            collected_netbox_platform_ids[proxmox_node] = netbox_platform_id
         except pynetbox.RequestError as e:
             raise ValueError(e, e.error)        
 
@@ -246,166 +434,21 @@ def main():
             except pynetbox.RequestError as e:
                 raise ValueError(e, e.error)
 
-        # Create Device in NetBox
-        try:
-            device_serial = None
-
-            if 'serial_number' in nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']:
-                nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']['serial'] = nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system'].pop('serial_number')
-
-            system_info = nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']
-
-            device_serial = system_info.get('serial')
-
-            # If no serial or empty string, use a generated one or skip
-            if not device_serial or device_serial.strip() == '':
-                if DEBUG:
-                    print(f"Warning: No serial found for {proxmox_node}, creating device without serial")
-
-            device_payload = {
-                'name': proxmox_node,
-                'role': netbox_device_role_id,
-                'device_type': collected_netbox_device_type_ids[proxmox_node],
-                'site': netbox_site_id,
-                'platform': netbox_platform_id,
-                'cluster': netbox_cluster_id,
-                'status': 'active'
-            }
-
-            # Only add serial number if it exists
-            if device_serial:
-                device_payload['serial'] = device_serial
-
-            netbox_device_id = dict(NetBoxDevices(nb_url, app_config['netbox_api_config']['api_token'], nb_options, device_payload).obj)['id']
-        except pynetbox.RequestError as e:
-            raise ValueError(e, e.error)
-
-        if not netbox_device_id:
-            raise ValueError(f"NetBox missing device id for {proxmox_node}, device type id {netbox_device_type_id}")
-
-        # Create device interfaces in NetBox
-        if DEBUG:
-            print("Adding device interfaces to NetBox")
-            print()
-
-        for network_interface in nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']['network_interfaces']:
-            if 'bridge_ports' in nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']['network_interfaces'][network_interface]:
-                continue
-
-            if DEBUG:
-                print(f"+ Going to try and create network interface {network_interface} for device {netbox_device_id} ({proxmox_node}) in NetBox")
-
-            interface_payload = {
-                'device': netbox_device_id,
-                'name': network_interface,
-                'type': convert_proxmox_interface_type_to_netbox(nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']['network_interfaces'][network_interface]['type']),
-                'enabled': nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']['network_interfaces'][network_interface]['enabled']
-            }
-
-            if DEBUG:
-                print("  Interface payload", interface_payload)
-                print()
-
-            netbox_network_interface_id = dict(NetBoxDeviceInterface(nb_url, app_config['netbox_api_config']['api_token'], nb_options, interface_payload).obj)['id']
-            collected_netbox_interface_ids[proxmox_node][network_interface] = netbox_network_interface_id
 
-            if DEBUG:
-                print("Collected NetBox Interface IDs", collected_netbox_interface_ids)
-                print()
+    # Devices, interfaces, IP and MAC addresses of each node are independent from the other nodes
+    with ThreadPoolExecutor(max_workers=max(1, args.workers), thread_name_prefix='netbox-node') as executor:
+        netbox_node_futures = {}
 
-        # Create device (bridge) interfaces in NetBox
-        if DEBUG:
-            print("Adding device (bridge) interfaces to NetBox")
-            print()
+        for proxmox_node in discovered_proxmox_nodes_information:
+            netbox_node_futures[proxmox_node] = executor.submit(
+                netbox_create_proxmox_node_device,
+                nb_url, app_config, nb_options, nb_pxmx_cluster, proxmox_node,
+                netbox_device_role_id, collected_netbox_device_type_ids[proxmox_node], netbox_site_id, collected_netbox_platform_ids[proxmox_node], netbox_cluster_id,
+                DEBUG
+            )
 
-        for network_interface in nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']['network_interfaces']:
-            if 'bridge_ports' in nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']['network_interfaces'][network_interface]:
-                if DEBUG:
-                    print(f"+ Going to try and create network (bridge) interface {network_interface} for device {netbox_device_id} ({proxmox_node}) in NetBox")
-                    print()
-
-                interface_payload = {
-                    'device': netbox_device_id,
-                    'name': network_interface,
-                    'type': nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']['network_interfaces'][network_interface]['type'],
-                    'bridge': collected_netbox_interface_ids[proxmox_node][nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']['network_interfaces'][network_interface]['bridge_ports']],
-                    'enabled': nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']['network_interfaces'][network_interface]['enabled']
-                }
-
-                if DEBUG:
-                    print("  Bridge interface payload", interface_payload)
-                    print()
-
-                netbox_network_interface_id = dict(NetBoxDeviceInterface(nb_url, app_config['netbox_api_config']['api_token'], nb_options, interface_payload).obj)['id']
-                collected_netbox_interface_ids[proxmox_node][network_interface] = netbox_network_interface_id
-
-                if DEBUG:
-                    print("  Collected NetBox (bridge) interface ids", collected_netbox_interface_ids)
-                    print()
-
-        # Now assign IP addresses amd MAC addresses to interfaces in NetBox
-        if DEBUG:
-            print("Assigning IP addresses and MAC addresses to device interfaces")
-            print()
-
-        for network_interface in nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']['network_interfaces']:
-            if network_interface in collected_netbox_interface_ids[proxmox_node]:
-                nb_nw_if_id = collected_netbox_interface_ids[proxmox_node][network_interface]
-
-                if 'ipv4address' in nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']['network_interfaces'][network_interface]:
-                    nb_ipv4_address = nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']['network_interfaces'][network_interface]['ipv4address']
-
-                    if DEBUG:
-                        print(f"Attempting to assign (v4) IP {nb_ipv4_address} to {network_interface} on {proxmox_node}")
-                        print()
-
-                    nb_assign_ip_address_payload = {
-                        'address': nb_ipv4_address,
-                        'status': 'active',
-                        'assigned_object_type': 'dcim.interface',
-                        'assigned_object_id': str(nb_nw_if_id)
-                    }
-
-                    try:
-                        NetBoxIPAddresses(nb_url, app_config['netbox_api_config']['api_token'], nb_options, nb_assign_ip_address_payload, 'address')
-                    except pynetbox.RequestError as e:
-                        raise ValueError(e, e.error)
-
-                if 'ipv6address' in nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']['network_interfaces'][network_interface]:
-                    nb_ipv6_address = nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']['network_interfaces'][network_interface]['ipv6address']
-
-                    if DEBUG:
-                        print(f"Attempting to assign (v6) IP {nb_ipv6_address} to {network_interface} on {proxmox_node}")
-                        print()
-                        
-                    nb_assign_ip_address_payload = {
-                        'address': nb_ipv6_address,
-                        'status': 'active',
-                        'assigned_object_type': 'dcim.interface',
-                        'assigned_object_id': str(nb_nw_if_id)
-                    }
-
-                    try:
-                        NetBoxIPAddresses(nb_url, app_config['netbox_api_config']['api_token'], nb_options, nb_assign_ip_address_payload, 'address')
-                    except pynetbox.RequestError as e:
-                        raise ValueError(e, e.error)
-                    
-                if 'mac' in nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']['network_interfaces'][network_interface]:
-                    nb_mac_address = nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']['network_interfaces'][network_interface]['mac']
-
-                    if DEBUG:
-                        print(f"Attempting to assign MAC address {nb_mac_address} to {network_interface} on {proxmox_node}")
-                        print()
-                        
-                    nb_assign_mac_address_payload = {
-                        'mac': nb_mac_address,
-                        'enabled': nb_pxmx_cluster.discovered_proxmox_nodes_information[proxmox_node]['system']['network_interfaces'][network_interface]['enabled']
-                    }
-
-                    try:
-                        NetBoxObjectInterfaceMacAddressMapping(nb_url, app_config['netbox_api_config']['api_token'], nb_options, 'dcim.interface', netbox_device_id, network_interface, nb_assign_mac_address_payload)
-                    except pynetbox.RequestError as e:
-                        raise ValueError(e, e.error)
+        for proxmox_node in netbox_node_futures:
+            collected_netbox_interface_ids[proxmox_node] = netbox_node_futures[proxmox_node].result()
 
 
 if __name__ == "__main__":
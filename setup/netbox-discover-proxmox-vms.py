@@ -8,6 +8,8 @@ import pynetbox
 import proxmoxer
 
 from helpers.netbox_proxmox_api import NetBoxProxmoxAPIHelper
+from helpers.netbox_vm_reconcile import NetBoxVMReconciler
+from helpers.discovery_state import ProxmoxDiscoveryState
 from helpers.netbox_objects import __netbox_make_slug, NetBox, NetBoxTags, NetBoxDeviceRoles, NetBoxClusterTypes, NetBoxClusters, NetBoxVirtualMachines, NetBoxVirtualMachineInterface, NetBoxIPAddresses
 
 nb_obj = None
@@ -23,6 +25,12 @@ def get_arguments():
     # Initialize the parser
     parser = argparse.ArgumentParser(description="Import NetBox and Proxmox Configurations")
     parser.add_argument("--debug", action='store_true', default=False, help="Enable debug (verbose) output")
+    parser.add_argument("--bulk", action='store_true', default=False, help="Load NetBox state once and apply only the differences with bulk API calls")
+    parser.add_argument("--workers", type=int, default=1, help="Number of concurrent Proxmox configuration / guest agent requests (default: 1)")
+    parser.add_argument("--node-workers", type=int, default=4, help="Maximum number of concurrent requests per Proxmox node (default: 4)")
+    parser.add_argument("--agent-timeout", type=float, default=0, help="Timeout in seconds for QEMU guest agent requests (default: Proxmox API timeout)")
+    parser.add_argument("--incremental", action='store_true', default=False, help="Only collect and update guests that changed since the last (incremental) run")
+    parser.add_argument("--state-file", default='.netbox-discover-proxmox-vms.state.json', help="State file for --incremental (default: .netbox-discover-proxmox-vms.state.json)")
 
     # Add arguments for URL and Token
     sub_parser = parser.add_subparsers(dest='virt_type',
@@ -246,6 +254,13 @@ def __netbox_vm_create_disk(vm_name = None, disk_name = None, disk_size = 0, pro
         raise ValueError(e, e.error)
 
 
+def netbox_bulk_reconcile_vms(nb_url = None, nb_api_token = None, nb_options = {}, proxmox_cluster_name = None, vm_configurations = {}, vm_role_id = 0, cluster_type_name = None, tagged_vm_names = set(), tag_id = 0):
+    reconciler = NetBoxVMReconciler(nb_url, nb_api_token, nb_options, nb_obj.nb, proxmox_cluster_name, cluster_type_name, vm_role_id)
+    reconciler.load(vm_configurations)
+
+    return reconciler.reconcile(vm_configurations, tagged_vm_names, tag_id)
+
+
 def main():
     global nb_obj
     global DEBUG
@@ -296,9 +311,16 @@ def main():
     # Build options for ProxmoxAPICommon
     pm_options = {
         'debug': DEBUG,
-        'simulate': False
+        'simulate': False,
+        'collection_workers': args.workers,
+        'collection_node_workers': args.node_workers,
+        'agent_timeout': args.agent_timeout,
+        'discovery_state': None
     }
 
+    if args.incremental:
+        pm_options['discovery_state'] = ProxmoxDiscoveryState(args.state_file, DEBUG)
+
     nb_obj = NetBox(nb_url, app_config['netbox_api_config']['api_token'], nb_options, {})
 
     # Collect all NetBox VMs, and for Proxmox VMs: VMIDs
@@ -322,6 +344,16 @@ def main():
 
         proxmox_vm_configurations = pm.proxmox_get_vms_configurations()
 
+        if args.bulk:
+            tagged_vm_names = set([proxmox_vm_configuration for proxmox_vm_configuration in proxmox_vm_configurations if not proxmox_vm_configuration in all_nb_vms and not pm.proxmox_vms[proxmox_vm_configuration]['vmid'] in all_nb_vms_ids])
+            nbt_vm_discovered_id = 0
+
+            if tagged_vm_names:
+                nbt_vm_discovered_id = dict(NetBoxTags(nb_url, app_config['netbox_api_config']['api_token'], nb_options, {'name': 'proxmox-vm-discovered', 'slug': __netbox_make_slug('proxmox-vm-discovered'), 'color': 'aa1409'}).obj)['id']
+
+            netbox_bulk_reconcile_vms(nb_url, app_config['netbox_api_config']['api_token'], nb_options, pm.proxmox_cluster_name, proxmox_vm_configurations, device_role_id, app_config['netbox']['cluster_role'], tagged_vm_names, nbt_vm_discovered_id)
+            proxmox_vm_configurations = {}
+
         for proxmox_vm_configuration in proxmox_vm_configurations:
             if DEBUG:
                 print(f"\t\tPROXMOX VMC {proxmox_vm_configuration}")
@@ -342,6 +374,16 @@ def main():
 
         proxmox_lxc_configurations = pm.proxmox_get_lxc_configurations()
 
+        if args.bulk:
+            tagged_lxc_names = set([proxmox_lxc_configuration for proxmox_lxc_configuration in proxmox_lxc_configurations if not proxmox_lxc_configuration in all_nb_vms and not pm.proxmox_lxc[proxmox_lxc_configuration]['vmid'] in all_nb_vms_ids])
+            nbt_lxc_discovered_id = 0
+
+            if tagged_lxc_names:
+                nbt_lxc_discovered_id = dict(NetBoxTags(nb_url, app_config['netbox_api_config']['api_token'], nb_options, {'name': 'proxmox-lxc-discovered', 'slug': __netbox_make_slug('proxmox-lxc-discovered'), 'color': 'f44336'}).obj)['id']
+
+            netbox_bulk_reconcile_vms(nb_url, app_config['netbox_api_config']['api_token'], nb_options, pm.proxmox_cluster_name, proxmox_lxc_configurations, device_role_id, app_config['netbox']['cluster_role'], tagged_lxc_names, nbt_lxc_discovered_id)
+            proxmox_lxc_configurations = {}
+
         for proxmox_lxc_configuration in proxmox_lxc_configurations:
             if DEBUG:
                 print(f"\t\tPROXMOX LXC {proxmox_lxc_configuration}")
@@ -357,6 +399,10 @@ def main():
         print(f"Unknown virtualizaton type {args.virt_type}")
         sys.exit(1)
 
+    # Only remember what was discovered once NetBox has been updated successfully
+    if pm_options['discovery_state']:
+        pm_options['discovery_state'].save()
+
     sys.exit(0)
 
 
@@ -83,6 +83,9 @@ def create_custom_field_choice_sets_proxmox_vm_cluster_nodes(proxmox_api_obj, nb
     for pcn in proxmox_cluster_nodes:
         extra_choices.append([pcn, pcn])
 
+    # lets the Flask application pick the node for new VMs (placement)
+    extra_choices.append(['auto', 'auto (placed by the Flask application)'])
+
     ncfcs = NetBoxCustomFieldChoiceSets(netbox_url, netbox_api_token, nb_options, {'name': 'proxmox-cluster-nodes', 'extra_choices': extra_choices})
     return dict(ncfcs.obj)['id']
 
@@ -102,6 +105,22 @@ def create_custom_field_choice_sets_proxmox_vm_type(proxmox_api_obj, nb_options:
     return dict(ncfcs.obj)['id']
 
 
+def create_custom_field_choice_sets_proxmox_vm_clone_mode(proxmox_api_obj, nb_options: dict):
+    extra_choices = []
+
+    proxmox_vm_clone_modes = {
+        'default': 'Default (from Flask application configuration)',
+        'full': 'Full clone',
+        'linked': 'Linked clone'
+    }
+
+    for proxmox_vm_clone_mode in proxmox_vm_clone_modes:
+        extra_choices.append([proxmox_vm_clone_mode, proxmox_vm_clone_modes[proxmox_vm_clone_mode]])
+
+    ncfcs = NetBoxCustomFieldChoiceSets(netbox_url, netbox_api_token, nb_options, {'name': 'proxmox-vm-clone-mode', 'extra_choices': extra_choices})
+    return dict(ncfcs.obj)['id']
+
+
 def create_custom_field(netbox_url=None, netbox_api_token=None, nb_options = {}, name=None, label=None, choice_set_id=0, default=None):
     weight = 100
     description = ''
@@ -122,7 +141,7 @@ def create_custom_field(netbox_url=None, netbox_api_token=None, nb_options = {},
     else:
         group_name = 'Proxmox VM'
 
-    if name in ['proxmox_node', 'proxmox_vm_storage', 'proxmox_vm_templates', 'proxmox_lxc_templates', 'proxmox_vm_type']:
+    if name in ['proxmox_node', 'proxmox_vm_storage', 'proxmox_vm_templates', 'proxmox_lxc_templates', 'proxmox_vm_type', 'proxmox_vm_clone_mode']:
         object_types = ['virtualization.virtualmachine']
         input_type = {'value': 'select', 'label': 'Selection'}
     elif name in ['proxmox_disk_storage_volume']:
@@ -303,6 +322,10 @@ if __name__ == "__main__":
         if netbox_field_choice_sets_vms_templates_id > 0:
             custom_field_vms_template_id = create_custom_field(netbox_url, netbox_api_token, nb_options, 'proxmox_vm_templates', 'Proxmox VM Templates', netbox_field_choice_sets_vms_templates_id, str(min(p.proxmox_vm_templates.keys())))
 
+            # proxmox_vm_clone_mode
+            netbox_field_choice_sets_proxmox_vm_clone_mode_id = create_custom_field_choice_sets_proxmox_vm_clone_mode(p, nb_options)
+            custom_field_proxmox_vm_clone_mode_id = create_custom_field(netbox_url, netbox_api_token, nb_options, 'proxmox_vm_clone_mode', 'Proxmox VM Clone Mode', netbox_field_choice_sets_proxmox_vm_clone_mode_id, 'default')
+
     # VM proxmox node id
     # NODES {'pxmx-n1': {'ip': '192.168.71.3', 'online': 1, 'version': 'Proxmox-8.4.1-2a5fa54a8503f96d'}, 'pxmx-n2': {'ip': '192.168.71.4', 'online': 1, 'version': 'Proxmox-8.4.1-2a5fa54a8503f96d'}}
     custom_field_proxmox_node_id = create_custom_field(netbox_url, netbox_api_token, nb_options, 'proxmox_node', 'Proxmox node', netbox_field_choice_sets_proxmox_nodes_id, list(p.proxmox_nodes.keys())[0])